@@ -0,0 +1,4 @@
+"""
+Pacote do motor do DataFlow: consolidação (engine), definição de jobs (jobs) e
+linha de comando (cli, executada com `python -m dataflow`). Nenhum módulo importa Qt.
+"""
@@ -0,0 +1,75 @@
+"""
+Benchmark de inicialização: mede, em interpretadores novos, o tempo de importação dos
+módulos de entrada (motor, linha de comando e interface) e verifica que as dependências
+pesadas só são carregadas por quem precisa delas.
+
+    python -m dataflow bench-startup --repeat 5 --max-ms 1500
+"""
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+# Dependências cuja importação custa caro na inicialização
+HEAVY_MODULES = ("polars", "openpyxl", "xlrd", "xlsxwriter", "fastexcel", "PySide6")
+
+# Módulo de entrada -> dependências que NÃO podem ser carregadas só por importá-lo
+STARTUP_TARGETS = {
+    "dataflow.engine": {"openpyxl", "xlrd", "xlsxwriter", "fastexcel", "PySide6"},
+    "dataflow.cli": {"openpyxl", "xlrd", "xlsxwriter", "fastexcel", "PySide6"},
+    "main": {"openpyxl", "xlrd", "xlsxwriter", "fastexcel"},
+}
+
+_MEASURE_CODE = """
+import sys, json, time, importlib
+started_at = time.perf_counter()
+importlib.import_module({module!r})
+import_ms = (time.perf_counter() - started_at) * 1000
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{"import_ms": import_ms, "loaded": heavy}}))
+"""
+
+def _app_dir() -> str:
+    """Pasta que contém main.py e o pacote dataflow (raiz das importações)."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure_import(module: str, repeat: int = 5) -> dict:
+    """
+    Importa `module` em `repeat` interpretadores novos e retorna as medianas do tempo de
+    importação e do tempo total do processo (ms), além das dependências pesadas carregadas.
+    """
+    import_times, process_times, loaded = [], [], set()
+    code = _MEASURE_CODE.format(module=module, heavy=HEAVY_MODULES)
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    for _ in range(max(1, repeat)):
+        started_at = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", code], cwd=_app_dir(), env=env,
+                                   capture_output=True, text=True, check=True)
+        process_times.append((time.perf_counter() - started_at) * 1000)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        import_times.append(result["import_ms"])
+        loaded.update(result["loaded"])
+    return {
+        "module": module,
+        "import_ms": round(statistics.median(import_times), 1),
+        "process_ms": round(statistics.median(process_times), 1),
+        "loaded": sorted(loaded),
+    }
+
+def run_startup_benchmark(repeat=5, max_ms=None, modules=None) -> tuple:
+    """
+    Mede todos os módulos de entrada. Retorna (resultados, problemas): há problema quando
+    um módulo carrega uma dependência proibida ou quando o tempo de importação passa de max_ms.
+    """
+    results, problems = [], []
+    for module in modules or STARTUP_TARGETS:
+        result = measure_import(module, repeat)
+        results.append(result)
+        forbidden = sorted(set(result["loaded"]) & STARTUP_TARGETS.get(module, set()))
+        if forbidden:
+            problems.append(f"'{module}' carrega na importação: {', '.join(forbidden)}")
+        if max_ms is not None and result["import_ms"] > max_ms:
+            problems.append(f"'{module}' levou {result['import_ms']} ms para importar (limite: {max_ms} ms)")
+    return results, problems
@@ -0,0 +1,178 @@
+"""
+Linha de comando do DataFlow (sem interface gráfica e sem importar Qt).
+
+    python -m dataflow consolidate PASTA --job job.json --output saida.xlsx
+
+Executa o mesmo pipeline da interface a partir de um job exportado, informando o
+andamento e o tempo decorrido no terminal ou, com --json-log, em JSON (uma linha por evento).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from .engine import ConsolidationJob, DEFAULT_CSV_ENCODING, DEFAULT_MAX_WORKERS, LogLevel, _incremental_store_dir
+from .excel import EXCEL_ENGINES
+from .jobs import load_job, resolve_files_to_process, resolve_header_mapping
+
+OUTPUT_FORMATS = {".xlsx": "XLSX", ".csv": "CSV", ".parquet": "Parquet"}
+ENGINE_MODES = ("lazy", "eager", "streaming")
+
+class _Reporter:
+    """Escreve os eventos da consolidação como texto legível ou como JSON Lines."""
+    def __init__(self, json_log_path=None, quiet=False):
+        self.started_at = time.perf_counter()
+        self.quiet = quiet
+        self.json_file = None
+        if json_log_path == "-":
+            self.json_file = sys.stdout
+        elif json_log_path:
+            self.json_file = open(json_log_path, 'w', encoding='utf-8')
+
+    def elapsed(self) -> float:
+        return round(time.perf_counter() - self.started_at, 3)
+
+    def _emit_json(self, event, **fields):
+        self.json_file.write(json.dumps({"elapsed": self.elapsed(), "event": event, **fields}, ensure_ascii=False) + "\n")
+        self.json_file.flush()
+
+    def _print(self, text):
+        if not self.quiet and self.json_file is not sys.stdout:
+            print(f"[{self.elapsed():8.2f}s] {text}", flush=True)
+
+    def log(self, message, level=LogLevel.INFO):
+        if self.json_file:
+            self._emit_json("log", level=level.name, message=message)
+        self._print(f"{level.value} {message}")
+
+    def progress(self, percent):
+        if self.json_file:
+            self._emit_json("progress", percent=percent)
+        self._print(f"Progresso: {percent}%")
+
+    def progress_text(self, text):
+        if self.json_file:
+            self._emit_json("progress_text", message=text)
+        self._print(text)
+
+    def finished(self, success, message):
+        if self.json_file:
+            self._emit_json("finished", success=success, message=message)
+        self._print(f"{'Concluído' if success else 'Falhou'} em {self.elapsed():.2f}s: {message}")
+
+    def close(self):
+        if self.json_file and self.json_file is not sys.stdout:
+            self.json_file.close()
+
+def _positive_int(value) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"deve ser um inteiro positivo: {value}")
+    return number
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="dataflow", description="DataFlow - consolidação de arquivos sem interface gráfica.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    consolidate = subparsers.add_parser("consolidate", help="Consolida os arquivos de uma pasta usando um job salvo.")
+    consolidate.add_argument("folder", help="Pasta com os arquivos (.xlsx, .xls, .csv, .txt).")
+    consolidate.add_argument("--job", required=True, help="Arquivo de job (JSON) exportado pela interface.")
+    consolidate.add_argument("--output", required=True, help="Arquivo de saída (.xlsx, .csv ou .parquet).")
+    consolidate.add_argument("--format", choices=sorted(set(OUTPUT_FORMATS.values())),
+                             help="Formato de saída (padrão: pela extensão da saída, senão o do job).")
+    consolidate.add_argument("--engine", choices=ENGINE_MODES, help="Modo do motor (padrão: o do job).")
+    consolidate.add_argument("--excel-engine", choices=EXCEL_ENGINES,
+                             help="Leitor de Excel (padrão: o mais rápido instalado; openpyxl lê apenas .xlsx).")
+    consolidate.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="Leituras em paralelo.")
+    consolidate.add_argument("--width-sample-rows", type=_positive_int, metavar="N",
+                             help="Estima as larguras das colunas XLSX pelas primeiras, últimas e N linhas "
+                                  "aleatórias (padrão: o do job; sem valor, examina todas as linhas).")
+    consolidate.add_argument("--incremental", action="store_true", default=None,
+                             help="Reaproveita fragmentos de execuções anteriores (padrão: o do job).")
+    consolidate.add_argument("--key-index", help="Pasta do índice de chaves de duplicatas entre execuções (ativa o índice).")
+    consolidate.add_argument("--header-cache", help="Arquivo do cache de análise de cabeçalhos.")
+    consolidate.add_argument("--json-log", help="Grava os eventos em JSON Lines neste arquivo ('-' para a saída padrão).")
+    consolidate.add_argument("--quiet", action="store_true", help="Não imprime o andamento no terminal.")
+
+    bench_startup = subparsers.add_parser("bench-startup", help="Mede o tempo de inicialização (importação) dos módulos de entrada.")
+    bench_startup.add_argument("--repeat", type=int, default=5, help="Número de interpretadores novos por módulo.")
+    bench_startup.add_argument("--max-ms", type=float, help="Falha se a importação de algum módulo passar deste tempo.")
+    bench_startup.add_argument("--json", action="store_true", help="Imprime os resultados em JSON.")
+    return parser
+
+def _run_consolidate(args) -> int:
+    reporter = _Reporter(args.json_log, args.quiet)
+    try:
+        try:
+            job = load_job(args.job)
+        except (OSError, ValueError) as e:
+            reporter.finished(False, f"Não foi possível carregar o job: {e}")
+            return 2
+        if not os.path.isdir(args.folder):
+            reporter.finished(False, f"Pasta não encontrada: {args.folder}")
+            return 2
+
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+        job_output = job.get("output") or {}
+        output_format = (args.format or OUTPUT_FORMATS.get(os.path.splitext(args.output)[1].lower())
+                         or job_output.get("format") or "XLSX")
+        engine_mode = args.engine or job_output.get("engine_mode") or "lazy"
+        incremental = job_output.get("incremental", False) if args.incremental is None else args.incremental
+        width_sample_rows = args.width_sample_rows or job_output.get("width_sample_rows")
+
+        duplicates_config = dict(job.get("duplicates_config") or {})
+        if args.key_index:
+            duplicates_config.update(use_key_index=True, key_index_path=args.key_index)
+
+        files_to_process = resolve_files_to_process(job, args.folder, reporter.log)
+        if not files_to_process:
+            reporter.finished(False, "Nenhum arquivo ou aba válida para consolidação.")
+            return 1
+        header_mapping = resolve_header_mapping(job, args.folder, files_to_process, reporter.log, args.header_cache, args.excel_engine)
+        reporter.log(f"Preparação concluída: {len(files_to_process)} arquivo(s), {len(header_mapping)} regra(s) de mapeamento.", LogLevel.INFO)
+
+        result = {}
+        def on_finished(success, message):
+            result.update(success=success)
+            reporter.finished(success, message)
+
+        consolidation = ConsolidationJob(
+            files_to_process, args.output, output_format, header_mapping, job.get("filter_rules", []),
+            job.get("delimiter", ";"), job.get("pivot_rules", {}), duplicates_config,
+            job.get("encoding", DEFAULT_CSV_ENCODING), engine_mode, args.workers,
+            width_sample_rows=width_sample_rows, header_cache_path=args.header_cache, excel_engine=args.excel_engine,
+            incremental_dir=_incremental_store_dir(args.output) if incremental else None,
+            on_log=reporter.log, on_progress=reporter.progress,
+            on_progress_text=reporter.progress_text, on_finished=on_finished)
+        try:
+            consolidation.run()
+        except KeyboardInterrupt:
+            consolidation.stop()
+            reporter.finished(False, "Interrompido pelo usuário.")
+            return 130
+        return 0 if result.get("success") else 1
+    finally:
+        reporter.close()
+
+def _run_bench_startup(args) -> int:
+    from .bench import run_startup_benchmark
+    results, problems = run_startup_benchmark(args.repeat, args.max_ms)
+    if args.json:
+        print(json.dumps({"results": results, "problems": problems}, ensure_ascii=False, indent=2))
+    else:
+        for result in results:
+            loaded = ", ".join(result["loaded"]) or "-"
+            print(f"{result['module']:<16} importação {result['import_ms']:8.1f} ms | processo {result['process_ms']:8.1f} ms | carrega: {loaded}")
+        for problem in problems:
+            print(f"{LogLevel.ERROR.value} {problem}")
+    return 1 if problems else 0
+
+def main(argv=None) -> int:
+    args = _build_parser().parse_args(argv)
+    if args.command == "consolidate":
+        return _run_consolidate(args)
+    if args.command == "bench-startup":
+        return _run_bench_startup(args)
+    return 2
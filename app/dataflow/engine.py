@@ -0,0 +1,2060 @@
+"""
+Motor de consolidação do DataFlow, sem dependência de Qt.
+
+Reúne a detecção de cabeçalhos, a leitura das fontes (CSV/TXT e abas de Excel), o cache
+de análise, os helpers de escrita XLSX e o ConsolidationJob, usado tanto pela interface
+gráfica (main.py) quanto pela linha de comando (python -m dataflow).
+"""
+import os
+import sys
+import glob
+import json
+import re
+import datetime
+import hashlib
+import contextlib
+import functools
+import unicodedata
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import defaultdict, Counter
+from enum import Enum
+
+import polars as pl
+from unidecode import unidecode
+
+from .excel import cached_workbook, close_cached_workbooks, read_sheet_names, resolve_excel_engine
+# fastexcel, openpyxl, xlrd e xlsxwriter são importados apenas quando usados (arquivos Excel /
+# saída XLSX), para não pesar na inicialização da interface e da linha de comando.
+
+# Definir os tipos de dados que o usuário pode escolher
+DATA_TYPES_OPTIONS = ["Automático/String", "Inteiro", "Decimal (Float)", "Data", "Booleano"]
+# Mapeamento para tipos Polars (pode ser um dict global ou dentro do worker)
+TYPE_STRING_TO_POLARS = {
+    "Automático/String": pl.String,
+    "Inteiro": pl.Int64,
+    "Decimal (Float)": pl.Float64,
+    "Data": pl.Date, # ou pl.Datetime se precisar de hora
+    "Booleano": pl.Boolean
+}
+# --- Constantes para as Opções de Filtro ---
+OPERATOR_OPTIONS = [
+    "Igual a",
+    "Diferente de",
+    "Está na lista (arquivo)",
+    "Contém",
+    "Não contém",
+    "Começa com",
+    "Termina com",
+    "Maior que",
+    "Menor que",
+    "Entre",
+    "Está em branco",
+    "Não está em branco",
+]
+# Operadores que não precisam de um campo de valor
+OPERATORS_NO_VALUE = {"Está em branco", "Não está em branco"}
+
+# Operador cujo valor é o caminho de um arquivo (CSV/TXT/Parquet) com a lista de valores aceitos
+OPERATOR_VALUE_FILE = "Está na lista (arquivo)"
+
+# Codificação padrão de CSV/TXT e codificações lidas nativamente pelo Polars (scan_csv);
+# as demais são decodificadas em Python.
+DEFAULT_CSV_ENCODING = "latin-1"
+NATIVE_CSV_ENCODINGS = {"utf8", "utf8-lossy"}
+
+# Escrita XLSX: limite de linhas por aba (com folga para o cabeçalho) e tamanho do lote de conversão
+XLSX_MAX_ROWS_PER_SHEET = 1_048_570
+XLSX_WRITE_BATCH_ROWS = 50_000
+
+# Leitura de CSV/TXT decodificados em Python (codificações não nativas): tamanho de cada lote lido
+CSV_READ_BATCH_BYTES = 64 * 1024 * 1024
+
+# Linhas executadas na leitura de cada fonte que continua lazy, para pular cedo as fontes ilegíveis
+SOURCE_VALIDATION_ROWS = 100
+
+# Consolidação incremental: manifesto das fontes já processadas (na pasta de fragmentos de cada saída)
+INCREMENTAL_MANIFEST_FILE_NAME = "manifesto.json"
+INCREMENTAL_MANIFEST_VERSION = 1
+
+def _incremental_store_dir(output_path: str) -> str:
+    """Pasta (oculta, ao lado do arquivo de saída) com os fragmentos persistentes do modo incremental."""
+    return os.path.join(os.path.dirname(os.path.abspath(output_path)), f".{os.path.basename(output_path)}.fragmentos")
+
+# Número padrão de arquivos/abas lidos em paralelo na consolidação
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+
+# Operações da Tabela de Resumo (as mesmas do PivotDialog) e nome da tabela única (formato antigo)
+PIVOT_OPERATIONS = ["Soma", "Média", "Contagem", "Mínimo", "Máximo", "Contagem Única"]
+DEFAULT_PIVOT_NAME = "Tabela_Resumo"
+
+# Remoção de duplicatas: máximo de chaves deduplicadas de uma vez na memória.
+# Acima disso, as chaves vão para o disco e são processadas em partições pelo hash.
+DEDUP_MEMORY_BUDGET_ROWS = 20_000_000
+
+# Índice persistente de chaves de duplicatas (entre execuções): pasta ao lado das saídas
+KEY_INDEX_DIR_NAME = ".dataflow_indice_chaves"
+KEY_INDEX_VERSION = 1
+
+def _key_index_dir(output_path: str) -> str:
+    """Pasta padrão do índice de chaves: compartilhada pelas saídas gravadas na mesma pasta."""
+    return os.path.join(os.path.dirname(os.path.abspath(output_path)), KEY_INDEX_DIR_NAME)
+
+HEADER_CACHE_FILE_NAME = "cache_cabecalhos.json" # Cache da análise de cabeçalhos (ao lado da configuração)
+# Tipos possíveis no perfil de colunas da análise, pelo nome gravado no cache
+PROFILE_DTYPES = {str(dtype): dtype for dtype in (pl.String, pl.Int64, pl.Float64, pl.Datetime)}
+# Formatos de data/hora testados no perfil, em ordem: o primeiro que converte o primeiro valor da coluna é o candidato
+PROFILE_DATE_FORMATS = (
+    "%Y-%m-%d %H:%M:%S%.f", "%Y-%m-%dT%H:%M:%S%.f", "%Y-%m-%d %H:%M:%S%.f%#z", "%Y-%m-%dT%H:%M:%S%.f%#z", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d",
+    "%d/%m/%Y %H:%M:%S%.f", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%d-%m-%Y %H:%M:%S%.f", "%d-%m-%Y %H:%M", "%d-%m-%Y",
+    "%d.%m.%Y %H:%M:%S%.f", "%d.%m.%Y", "%Y/%m/%d %H:%M:%S%.f", "%Y/%m/%d %H:%M", "%Y/%m/%d", "%Y.%m.%d",
+)
+
+def _normalize_header_name(header_name: str) -> str:
+    if not isinstance(header_name, str):
+        header_name = str(header_name)
+    
+    # 1. Remove acentos (ex: "Endereço" -> "Endereco")
+    text = unidecode(header_name)
+    # 2. Converte para minúsculas
+    text = text.lower()
+    # 3. Substitui separadores comuns por espaço (para depois lidar com "valorICMS" vs "valor_ICMS")
+    text = re.sub(r'[._-]+', ' ', text)
+    # 4. Adiciona espaço antes de letras maiúsculas (camelCase -> camel Case)
+    text = re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', text)
+    # 5. Remove todos os caracteres não alfanuméricos e junta tudo
+    text = re.sub(r'[^a-z0-9]', '', text)
+    return text
+
+# Caracteres removidos pelo str.strip() do Python (o Polars, sozinho, não remove \x1c-\x1f)
+_PY_WHITESPACE_CHARS = "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+
+@functools.lru_cache(maxsize=None)
+def _numeric_string_pattern() -> str:
+    """
+    Regex equivalente a str.isnumeric(): categoria Unicode N mais os ideogramas com
+    valor numérico (ex.: '三'), que o Python considera numéricos. Calculada uma única vez.
+    """
+    extra_chars = "".join(f"\\x{{{ord(c):X}}}" for c in map(chr, range(sys.maxunicode + 1))
+                          if c.isnumeric() and not unicodedata.category(c).startswith("N"))
+    return rf"^[\p{{N}}{extra_chars}]+$"
+
+@functools.lru_cache(maxsize=None)
+def _same_type_penalty_table(num_cells: int) -> tuple:
+    """Penalidade acumulada (-0.2 por coluna com tipo repetido), somada na mesma ordem do cálculo célula a célula."""
+    table = [0.0]
+    for _ in range(num_cells):
+        table.append(table[-1] - 0.2)
+    return tuple(table)
+
+def _header_value_key(col_name: str, dtype) -> pl.Expr:
+    """
+    Chave textual de uma célula para medir a unicidade da linha: valores que o Python
+    consideraria iguais (ex.: 1, 1.0 e True) recebem a mesma chave.
+    """
+    column = pl.col(col_name)
+    if dtype == pl.Boolean:
+        return pl.lit("n:") + column.cast(pl.Int8).cast(pl.String)
+    if dtype.is_integer():
+        return pl.lit("n:") + column.cast(pl.String)
+    if dtype.is_float() or isinstance(dtype, pl.Decimal):
+        as_float = column.cast(pl.Float64)
+        as_integer = pl.when(as_float.is_finite() & (as_float == as_float.floor())).then(as_float.cast(pl.Int64, strict=False))
+        return pl.lit("n:") + pl.coalesce(as_integer.cast(pl.String), as_float.cast(pl.String))
+    if dtype in (pl.String, pl.Categorical) or isinstance(dtype, pl.Enum):
+        return pl.lit("s:") + column.cast(pl.String)
+    type_prefix = f"{dtype.base_type()}{getattr(dtype, 'time_zone', None) or ''}:"
+    return pl.lit(type_prefix) + column.cast(pl.String)
+
+def _header_cell_keys(df_sample: pl.DataFrame, rows_to_check: int) -> pl.DataFrame:
+    """
+    Converte as primeiras linhas de uma amostra para colunas posicionais (c0, c1, ...),
+    formato comum a amostras de schemas diferentes. Amostras só de texto (o caso das
+    pré-leituras brutas) são apenas renomeadas; as demais viram chaves com prefixo de tipo.
+    """
+    head_df = df_sample.head(rows_to_check)
+    if all(dtype == pl.String for dtype in head_df.dtypes):
+        head_df.columns = [f"c{col_idx}" for col_idx in range(head_df.width)]
+        return head_df
+    return head_df.select([_header_value_key(name, dtype).alias(f"c{col_idx}") for col_idx, (name, dtype) in enumerate(head_df.schema.items())])
+
+def _header_row_counts(samples: list, rows_to_check: list) -> pl.DataFrame:
+    """
+    Contagens por linha candidata de todas as amostras (nulos, textos, textos numéricos,
+    valores únicos e colunas com o mesmo tipo na linha seguinte) em uma única consulta
+    sobre as amostras empilhadas célula a célula. Cada coluna do Polars tem um só tipo,
+    então "mesmo tipo na linha seguinte" equivale a "mesmo estado nulo/não nulo na linha
+    seguinte" e a transição Texto -> Número nunca ocorre dentro de uma coluna.
+    """
+    stacked = pl.concat([_header_cell_keys(df_sample, n_rows) for df_sample, n_rows in zip(samples, rows_to_check)], how="diagonal")
+    n_stacked_rows = stacked.height
+
+    # Atributos de cada linha empilhada: amostra de origem, posição na amostra, largura, etc.
+    row_ends = pl.Series(rows_to_check, dtype=pl.UInt32).cum_sum()
+    sample_ids = row_ends.search_sorted(pl.int_range(n_stacked_rows, dtype=pl.UInt32, eager=True), side="right").cast(pl.UInt32)
+    row_info = pl.DataFrame({
+        "sample": sample_ids,
+        "row": pl.int_range(n_stacked_rows, dtype=pl.UInt32, eager=True) - (row_ends - pl.Series(rows_to_check, dtype=pl.UInt32)).gather(sample_ids),
+        "num_cells": pl.Series([df_sample.width for df_sample in samples], dtype=pl.UInt32).gather(sample_ids),
+        "sample_rows": pl.Series(rows_to_check, dtype=pl.UInt32).gather(sample_ids),
+        "typed_keys": pl.Series([any(dtype != pl.String for dtype in df_sample.dtypes) for df_sample in samples]).gather(sample_ids),
+    })
+
+    # Amostras só de texto não passaram por _header_value_key: recebem o prefixo "s:" aqui
+    key = pl.when(pl.col("typed_keys")).then(pl.col("value")).otherwise(pl.lit("s:") + pl.col("value"))
+    text = pl.when(pl.col("key").str.starts_with("s:")).then(pl.col("key").str.slice(2).str.strip_chars(_PY_WHITESPACE_CHARS))
+    return (
+        stacked.hstack(row_info).lazy()
+        # Ordem coluna a coluna: a célula seguinte de uma mesma coluna é a da linha seguinte
+        .unpivot(on=stacked.columns, index=row_info.columns, value_name="value")
+        .with_columns((pl.int_range(pl.len(), dtype=pl.UInt32) // n_stacked_rows).alias("col_idx"), key.alias("key"))
+        .with_columns(text.alias("text"), pl.col("key").is_null().alias("is_null"))
+        .with_columns((pl.col("is_null") == pl.col("is_null").shift(-1)).alias("same_type"))
+        # Descarta colunas de preenchimento (amostras mais estreitas) e a última linha, que só serve de "linha seguinte"
+        .filter((pl.col("col_idx") < pl.col("num_cells")) & (pl.col("row") < pl.col("sample_rows") - 1))
+        .group_by("sample", "row", "num_cells")
+        .agg(
+            pl.col("is_null").sum().alias("null_count"),
+            (pl.col("text").str.len_bytes() > 0).sum().alias("string_count"),
+            pl.col("text").str.contains(_numeric_string_pattern()).sum().alias("numeric_string_count"),
+            pl.col("key").drop_nulls().n_unique().alias("unique_count"),
+            pl.col("same_type").sum().alias("same_type_count"),
+        )
+        .sort("sample", "row")
+        .collect()
+    )
+
+def _header_row_score(num_cells, null_count, string_count, numeric_string_count, unique_count, same_type_count) -> float:
+    """Pontuação de uma linha candidata a cabeçalho (mesma ordem de operações de ponto flutuante de sempre)."""
+    non_null_cells = num_cells - null_count
+    if non_null_cells == 0:
+        base_score = -100
+    else:
+        base_score = 0
+        base_score += (unique_count / non_null_cells) * 3
+        base_score += (string_count / non_null_cells) * 3
+        base_score -= (numeric_string_count / non_null_cells) * 5
+        base_score -= (null_count / num_cells) * 2
+    # Recompensa Texto -> Número (não ocorre numa mesma coluna) e penaliza levemente tipos repetidos
+    transition_score = _same_type_penalty_table(num_cells)[same_type_count]
+    return base_score + (transition_score / num_cells) * 5
+
+def _find_header_row_indices(samples: list, max_rows_to_check: int = 20) -> list:
+    """
+    Versão em lote de _find_header_row_index: calcula as contagens das linhas candidatas
+    de todas as amostras em uma única execução do Polars e retorna um índice por amostra.
+    """
+    header_indices = [0] * len(samples)
+    candidates = [(sample_idx, df_sample, min(df_sample.height, max_rows_to_check)) for sample_idx, df_sample in enumerate(samples)]
+    candidates = [(sample_idx, df_sample, n_rows) for sample_idx, df_sample, n_rows in candidates if n_rows >= 2 and df_sample.width > 0]
+    if not candidates:
+        return header_indices
+
+    counts_df = _header_row_counts([df_sample for _, df_sample, _ in candidates], [n_rows for _, _, n_rows in candidates])
+    best_scores = {}
+    for candidate_idx, row_idx, num_cells, null_count, string_count, numeric_string_count, unique_count, same_type_count in counts_df.select(
+            "sample", "row", "num_cells", "null_count", "string_count", "numeric_string_count", "unique_count", "same_type_count").iter_rows():
+        sample_idx = candidates[candidate_idx][0]
+        score = _header_row_score(num_cells, null_count, string_count, numeric_string_count, unique_count, same_type_count)
+        if score > best_scores.get(sample_idx, -999): # Primeira linha com a maior pontuação
+            best_scores[sample_idx] = score
+            header_indices[sample_idx] = row_idx
+    return header_indices
+
+def _find_header_row_index(df_sample: pl.DataFrame, max_rows_to_check: int = 20) -> int:
+    """
+    Analisa as primeiras N linhas de um DataFrame e retorna o índice da linha
+    que tem a maior probabilidade de ser o cabeçalho, usando uma heurística de
+    transição de tipos (unicidade, proporção de textos, de textos numéricos e de
+    nulos, e repetição de tipos na linha seguinte).
+    """
+    return _find_header_row_indices([df_sample], max_rows_to_check)[0]
+
+def _make_headers_unique(header_names: list) -> list:
+    """
+    Garante que todos os nomes de cabeçalho em uma lista sejam únicos
+    """
+    counts = Counter(header_names)
+    duplicates = {name for name, count in counts.items() if count > 1}
+    if not duplicates:
+            return header_names
+    new_headers = []
+    running_counts = Counter()
+    for name in header_names:
+        if name in duplicates:
+            running_counts[name] += 1
+            new_headers.append(f"{name}_{running_counts[name]}")
+        else:
+            new_headers.append(name)
+    return new_headers
+
+class LogLevel(Enum):
+    INFO = "[INFO]"
+    WARNING = "[AVISO]"
+    ERROR = "[ERRO]"
+    SUCCESS = "[SUCESSO]"
+
+def _describe_source(file_path: str, sheet_name=None) -> str:
+    """Descrição de uma fonte (arquivo ou arquivo + aba) usada nas mensagens de log."""
+    return f"'{os.path.basename(file_path)}'" + (f" - Aba: '{sheet_name}'" if sheet_name else "")
+
+def _read_csv_raw(source, delimiter: str, encoding: str = DEFAULT_CSV_ENCODING, n_rows=None, schema=None, columns=None) -> pl.DataFrame:
+    """
+    Lê um CSV/TXT de forma bruta: sem cabeçalho e com todas as colunas como texto.
+    Com schema, as colunas são fixadas (linhas maiores são cortadas, menores completadas com
+    nulos); com columns (posições), apenas essas colunas são convertidas.
+    """
+    return pl.read_csv(source=source, has_header=False, n_rows=n_rows, separator=delimiter, encoding=encoding, ignore_errors=True, infer_schema=False, quote_char=None, truncate_ragged_lines=True, schema=schema, columns=columns)
+
+def _included_column_indices(header_names, file_path, sheet_name, header_mapping):
+    """
+    Posições (no cabeçalho detectado) das colunas incluídas pelo mapeamento, para que os
+    leitores convertam apenas essas colunas. None quando não há mapeamento (todas são lidas).
+    """
+    if not header_mapping:
+        return None
+    return [i for i, col_name in enumerate(header_names)
+            if (header_mapping.get((col_name, file_path, sheet_name)) or {}).get("include", False)]
+
+def _detect_headers(pre_read_dfs: list, n_preread_rows: int = 20) -> list:
+    """Versão em lote de _detect_header: uma única detecção vetorizada para todas as pré-leituras."""
+    results = [(0, [])] * len(pre_read_dfs)
+    valid_positions = [i for i, pre_read_df in enumerate(pre_read_dfs) if pre_read_df is not None and not pre_read_df.is_empty()]
+    header_indices = _find_header_row_indices([pre_read_dfs[i] for i in valid_positions], n_preread_rows)
+    for position, header_row_index in zip(valid_positions, header_indices):
+        header_names_raw = [str(h) if h is not None else f"column_{i}" for i, h in enumerate(pre_read_dfs[position].row(header_row_index))]
+        results[position] = (header_row_index, _make_headers_unique(header_names_raw))
+    return results
+
+def _detect_header(pre_read_df: pl.DataFrame, n_preread_rows: int = 20):
+    """Retorna (índice da linha de cabeçalho, nomes únicos do cabeçalho) de uma pré-leitura."""
+    return _detect_headers([pre_read_df], n_preread_rows)[0]
+
+def _date_format_family(date_format: str) -> str:
+    """Parte de data de um formato de PROFILE_DATE_FORMATS (ex.: "%d/%m/%Y" para "%d/%m/%Y %H:%M")."""
+    return re.split(r"[ T]", date_format, maxsplit=1)[0]
+
+def _profile_columns(sample_df: pl.DataFrame) -> list:
+    """
+    Perfil de todas as colunas (texto) de uma amostra de uma só vez: os valores preenchidos
+    viram uma tabela longa (coluna, valor) e cada teste de tipo é uma conversão não estrita
+    agregada por coluna (todos os valores convertidos = tipo aceito). O formato de data de
+    cada coluna é o primeiro de PROFILE_DATE_FORMATS que converte o seu primeiro valor
+    (como na inferência do Polars); a coluna é de data se todos os seus valores seguirem
+    um formato da mesma família (mesma parte de data: separador e ordem dos campos), ou
+    seja, datas com e sem hora podem se misturar, mas "2024-01-05" e "31/12/2023" não.
+
+    Retorna, por coluna: dtype (Int64, Float64, Datetime ou String, nessa prioridade),
+    null_ratio, distinct_ratio (valores distintos / preenchidos), min_length, max_length e
+    date_format.
+    """
+    if sample_df.width == 0:
+        return []
+    value = pl.col("value")
+    values_df = (
+        sample_df.select([pl.col(name).cast(pl.String).alias(str(position)) for position, name in enumerate(sample_df.columns)])
+        .unpivot(variable_name="column", value_name="value")
+        .filter(value.str.strip_chars() != "") # Nulos e textos em branco não contam
+    )
+    column_stats = values_df.group_by("column").agg(
+        pl.len().alias("valid_count"),
+        value.n_unique().alias("distinct_count"),
+        value.str.len_chars().min().alias("min_length"),
+        value.str.len_chars().max().alias("max_length"),
+        value.cast(pl.Int64, strict=False).is_not_null().all().alias("is_int"),
+        value.cast(pl.Float64, strict=False).is_not_null().all().alias("is_float"),
+        value.first().alias("first_value"),
+    )
+    # Formato candidato de cada coluna não numérica, pelo primeiro valor
+    date_candidates = column_stats.filter(~pl.col("is_int") & ~pl.col("is_float")).select(
+        "column", pl.coalesce([pl.when(pl.col("first_value").str.strptime(pl.Datetime, date_format, strict=False).is_not_null())
+                               .then(pl.lit(date_format)) for date_format in PROFILE_DATE_FORMATS]).alias("date_format"),
+    ).drop_nulls("date_format")
+    # Conferência em todos os valores: as conversões são feitas por formato candidato (poucos), não por coluna
+    parsed_parts = []
+    for (date_format,), format_values_df in values_df.join(date_candidates, on="column").partition_by("date_format", as_dict=True).items():
+        family_formats = [family_format for family_format in PROFILE_DATE_FORMATS if _date_format_family(family_format) == _date_format_family(date_format)]
+        parsed_parts.append(format_values_df.with_columns(
+            pl.any_horizontal([value.str.strptime(pl.Datetime, family_format, strict=False).is_not_null() for family_format in family_formats]).alias("parsed")))
+    date_formats = {}
+    if parsed_parts:
+        date_columns = pl.concat(parsed_parts).group_by("column").agg(pl.col("date_format").first(), pl.col("parsed").all())
+        date_formats = {int(column): date_format for column, date_format, parsed in date_columns.iter_rows() if parsed}
+
+    null_counts = sample_df.null_count().row(0)
+    stats_by_position = {int(row["column"]): row for row in column_stats.iter_rows(named=True)}
+    profiles = []
+    for position, null_count in enumerate(null_counts):
+        profile = {"dtype": pl.String, "null_ratio": null_count / sample_df.height if sample_df.height else 0.0,
+                   "distinct_ratio": 0.0, "min_length": None, "max_length": None, "date_format": date_formats.get(position)}
+        stats = stats_by_position.get(position)
+        if stats is not None:
+            profile.update(distinct_ratio=stats["distinct_count"] / stats["valid_count"],
+                           min_length=stats["min_length"], max_length=stats["max_length"])
+            if stats["is_int"]:
+                profile["dtype"] = pl.Int64
+            elif stats["is_float"]:
+                profile["dtype"] = pl.Float64
+            elif profile["date_format"] is not None:
+                profile["dtype"] = pl.Datetime
+        profiles.append(profile)
+    return profiles
+
+class CsvSource:
+    """
+    Leitor compartilhado de um CSV/TXT. O arquivo é aberto uma única vez: as primeiras
+    linhas vão para a detecção de cabeçalho (read_head) e a leitura dos dados continua
+    no mesmo handle, a partir da linha seguinte ao cabeçalho (read_data / scan_data).
+    Sem quote_char, cada linha do arquivo é exatamente uma linha do DataFrame.
+    """
+    def __init__(self, file_path, delimiter, encoding=DEFAULT_CSV_ENCODING, n_preread_rows=20):
+        self.file_path = file_path
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.n_preread_rows = n_preread_rows
+        self._handle = open(file_path, "rb")
+        self._head_lines = []   # Linhas brutas (bytes) lidas na pré-leitura
+        self._row_to_line = []  # Linha do DataFrame de pré-leitura -> índice em _head_lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._handle.close()
+
+    def read_head(self) -> pl.DataFrame:
+        """Lê apenas as primeiras n_preread_rows linhas do arquivo (sem cabeçalho, tudo texto)."""
+        while len(self._head_lines) < self.n_preread_rows:
+            line = self._handle.readline()
+            if not line:
+                break
+            self._head_lines.append(line)
+
+        if not any(line.strip() for line in self._head_lines):
+            return pl.DataFrame()
+        pre_read_df = _read_csv_raw(b"".join(self._head_lines), self.delimiter, self.encoding)
+
+        # Se a versão do Polars descartar linhas em branco, o índice da linha no DataFrame
+        # deixa de coincidir com o índice da linha no arquivo
+        if pre_read_df.height == len(self._head_lines):
+            self._row_to_line = list(range(len(self._head_lines)))
+        else:
+            self._row_to_line = [i for i, line in enumerate(self._head_lines) if line.rstrip(b"\r\n")]
+        return pre_read_df
+
+    def _first_data_line(self, header_row_index: int) -> int:
+        """Índice (no arquivo) da primeira linha de dados após o cabeçalho detectado."""
+        if not self._row_to_line:
+            return 0
+        return self._row_to_line[header_row_index] + 1
+
+    def read_data(self, header_row_index: int) -> pl.DataFrame:
+        """
+        Continua a leitura do handle a partir da linha seguinte ao cabeçalho, sem voltar
+        ao início do arquivo. Deve ser chamado após read_head().
+        """
+        first_data_line = self._first_data_line(header_row_index)
+        self._handle.seek(sum(len(line) for line in self._head_lines[:first_data_line]))
+        data = self._handle.read()
+        if not data.strip():
+            return pl.DataFrame()
+        return _read_csv_raw(data, self.delimiter, self.encoding)
+
+    def iter_data(self, header_row_index: int, columns=None, n_columns=None, batch_bytes=None):
+        """
+        Como read_data, mas em lotes de ~batch_bytes (sempre terminados em fim de linha), para
+        que cada lote seja decodificado, transformado e filtrado antes da leitura do próximo.
+        Todos os lotes têm as colunas do primeiro, como em uma leitura única. Com columns
+        (posições entre as n_columns do cabeçalho), apenas essas colunas são convertidas.
+        Sem batch_bytes, vale CSV_READ_BATCH_BYTES.
+        """
+        batch_bytes = batch_bytes or CSV_READ_BATCH_BYTES
+        first_data_line = self._first_data_line(header_row_index)
+        self._handle.seek(sum(len(line) for line in self._head_lines[:first_data_line]))
+        schema = None
+        if columns is not None:
+            schema = {f"column_{i + 1}": pl.String for i in range(n_columns)}
+        pending = b""
+        while True:
+            chunk = self._handle.read(batch_bytes)
+            data = pending + chunk
+            if chunk:
+                line_end = data.rfind(b"\n") + 1
+                if line_end == 0:
+                    pending = data
+                    continue
+                data, pending = data[:line_end], data[line_end:]
+            if data.strip():
+                raw_batch = _read_csv_raw(data, self.delimiter, self.encoding, schema=schema, columns=columns)
+                schema = schema or raw_batch.schema
+                yield raw_batch
+            if not chunk:
+                break
+
+    def scan_data(self, header_row_index: int) -> pl.LazyFrame:
+        """Plano lazy dos dados a partir da linha seguinte ao cabeçalho (somente UTF-8)."""
+        return pl.scan_csv(self.file_path, has_header=False, skip_rows=self._first_data_line(header_row_index), separator=self.delimiter, encoding=self.encoding, ignore_errors=True, infer_schema=False, quote_char=None, truncate_ragged_lines=True)
+
+def _header_read_options(file_path, delimiter, encoding, n_preread_rows=20) -> list:
+    """Opções de leitura que influenciam a detecção de cabeçalho de um arquivo (parte da chave do cache)."""
+    if file_path.lower().endswith((".csv", ".txt")):
+        return [delimiter, encoding, n_preread_rows]
+    return [n_preread_rows]
+
+class HeaderCache:
+    """
+    Cache persistente (JSON) da análise de cabeçalhos, por arquivo/aba: linha do
+    cabeçalho, nomes únicos e o perfil de cada coluna. Cada entrada guarda a impressão
+    digital do arquivo (tamanho e data de modificação) e as opções de leitura; se
+    qualquer uma mudar, a entrada é ignorada e refeita na próxima análise.
+    """
+    VERSION = 8
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.entries = {}
+        self._dirty = False
+        try:
+            if cache_path and os.path.exists(cache_path):
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    cache_data = json.load(f)
+                if cache_data.get("version") == self.VERSION:
+                    self.entries = cache_data.get("entries", {})
+        except Exception:
+            self.entries = {} # Cache ilegível: recomeça do zero
+
+    @staticmethod
+    def _key(file_path, sheet_name):
+        return f"{os.path.abspath(file_path)}|{sheet_name or ''}"
+
+    @staticmethod
+    def _fingerprint(file_path, read_options):
+        stat = os.stat(file_path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "read_options": list(read_options)}
+
+    def get(self, file_path, sheet_name, read_options):
+        """Retorna a entrada do arquivo/aba, ou None se não existir ou estiver desatualizada."""
+        entry = self.entries.get(self._key(file_path, sheet_name))
+        if entry is None:
+            return None
+        try:
+            if entry.get("fingerprint") != self._fingerprint(file_path, read_options):
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def put(self, file_path, sheet_name, read_options, header_row_index, header_names, columns):
+        """Grava (em memória) o resultado da análise; columns = [{name, normalized_name, dtype, null_ratio}]."""
+        try:
+            fingerprint = self._fingerprint(file_path, read_options)
+        except OSError:
+            return
+        self.entries[self._key(file_path, sheet_name)] = {
+            "fingerprint": fingerprint,
+            "header_row_index": header_row_index,
+            "header_names": header_names,
+            "columns": columns,
+        }
+        self._dirty = True
+
+    def save(self):
+        """Grava o cache no disco (de forma atômica), descartando entradas de arquivos que não existem mais."""
+        if not self.cache_path or not self._dirty:
+            return
+        self.entries = {key: entry for key, entry in self.entries.items() if os.path.exists(key.rsplit("|", 1)[0])}
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self.VERSION, "entries": self.entries}, f, ensure_ascii=False)
+        os.replace(temp_path, self.cache_path)
+        self._dirty = False
+
+def _source_transform(raw_columns, header_names, file_path, sheet_name, header_mapping, final_name_to_type_str, log):
+    """
+    Prepara a transformação dos dados brutos de uma fonte: nomes do cabeçalho detectado,
+    mapeamento de nomes (com coalesce) e tipagem definida pelo usuário. Retorna uma função
+    LazyFrame -> LazyFrame, aplicável ao plano inteiro ou a cada lote lido, ou None (após
+    registrar o motivo no log) quando a fonte deve ser pulada.
+    """
+    description = _describe_source(file_path, sheet_name)
+
+    # Renomear as colunas com os nomes que detectamos
+    rename_map = {old_name: new_name for old_name, new_name in zip(raw_columns, header_names)}
+    original_columns = [rename_map.get(col_name, col_name) for col_name in raw_columns]
+
+    # --- 1. Aplicar Mapeamento de Nomes e Filtro de Colunas (com Coalesce) ---
+    select_expressions = None # Sem mapeamento: todas as colunas são mantidas
+    final_columns = original_columns
+    if header_mapping:
+        # Agrupar colunas de origem por seu nome final de destino
+        final_name_to_source = defaultdict(list)
+        for original_col_name in original_columns:
+            mapping_info = header_mapping.get((original_col_name, file_path, sheet_name))
+            if mapping_info and mapping_info.get("include", False):
+                final_name_to_source[mapping_info.get("final_name")].append(original_col_name)
+
+        # Se apenas uma coluna de origem existe, faz um alias simples.
+        # Se mais de uma, usa coalesce para combinar os dados.
+        select_expressions = []
+        for final_name, original_cols_list in final_name_to_source.items():
+            if not original_cols_list:
+                continue
+            log(f"Combinando colunas {original_cols_list} em '{final_name}' para {description}", LogLevel.INFO)
+            if len(original_cols_list) > 1:
+                select_expressions.append(pl.coalesce(original_cols_list).alias(final_name))
+            else:
+                select_expressions.append(pl.col(original_cols_list[0]).alias(final_name))
+
+        if not select_expressions:
+            log(f"Nenhuma coluna do arquivo {description} corresponde ao mapeamento. Pulando.", LogLevel.WARNING)
+            return None
+        final_columns = list(final_name_to_source)
+
+    if not final_columns:
+        log(f"Nenhuma coluna restante em {description} após mapeamento de nomes. Pulando.", LogLevel.WARNING)
+        return None
+
+    # --- 2. Aplicar Tipagem Especificada pelo Usuário ---
+    casting_expressions = None
+    if header_mapping:
+        casting_expressions = []
+        for final_col_name in final_columns:
+            type_str = final_name_to_type_str.get(final_col_name)
+            polars_type = TYPE_STRING_TO_POLARS.get(type_str) if type_str != DATA_TYPES_OPTIONS[0] else None
+            if polars_type:
+                log(f"Convertendo coluna '{final_col_name}' para {type_str} em {description}", LogLevel.INFO)
+                casting_expressions.append(pl.col(final_col_name).cast(polars_type, strict=False))
+            else: # "Automático/String" ou tipo não mapeado: manter como está
+                casting_expressions.append(pl.col(final_col_name))
+
+    def transform(lf_data):
+        lf_typed = lf_data.rename(rename_map)
+        if select_expressions is not None:
+            # Projeção: no plano lazy, apenas as colunas selecionadas chegam a ser lidas
+            lf_typed = lf_typed.select(select_expressions)
+        if casting_expressions is not None:
+            lf_typed = lf_typed.select(casting_expressions)
+        return lf_typed
+    return transform
+
+def _transform_batches(raw_batches, header_names, file_path, sheet_name, header_mapping, final_name_to_type_str, filter_compiler, log, batch_dir=None):
+    """
+    Aplica a transformação da fonte e os filtros a cada lote bruto assim que ele é lido.
+    Com batch_dir, cada lote resultante é gravado em seu próprio arquivo Parquet nessa
+    pasta e descartado da memória: o plano retornado (pl.scan_parquet dos lotes) fica
+    limitado a um lote por vez. Sem batch_dir, os lotes mantidos são concatenados em
+    memória. Retorna None quando a fonte deve ser pulada.
+    """
+    description = _describe_source(file_path, sheet_name)
+    transform = None
+    filter_expressions = []
+    kept_batches = []
+    rows_read = rows_kept = 0
+    for raw_batch in raw_batches:
+        if transform is None:
+            transform = _source_transform(raw_batch.columns, header_names, file_path, sheet_name, header_mapping, final_name_to_type_str, log)
+            if transform is None:
+                return None
+            if filter_compiler:
+                filter_expressions = filter_compiler.expressions_for(transform(raw_batch.lazy()).collect_schema(), description, log)
+        batch_plan = transform(raw_batch.lazy())
+        if filter_expressions:
+            batch_plan = batch_plan.filter(filter_expressions)
+        kept_batch = batch_plan.collect()
+        rows_read += raw_batch.height
+        rows_kept += kept_batch.height
+        if batch_dir is None:
+            kept_batches.append(kept_batch)
+        elif kept_batch.height or not kept_batches: # O primeiro lote é gravado mesmo vazio: guarda o schema
+            batch_path = os.path.join(batch_dir, f"lote_{len(kept_batches):05d}.parquet")
+            kept_batch.write_parquet(batch_path)
+            kept_batches.append(batch_path)
+
+    if transform is None or rows_read == 0:
+        log(f"Dados vazios ou erro ao ler {description}. Pulando.", LogLevel.WARNING)
+        return None
+    if filter_expressions:
+        log(f"Filtro aplicado durante a leitura de {description}. Linhas restantes: {rows_kept} de {rows_read}.", LogLevel.INFO)
+    if batch_dir is not None:
+        return pl.scan_parquet(kept_batches)
+    df_kept = pl.concat(kept_batches) if len(kept_batches) > 1 else kept_batches[0]
+    return df_kept.lazy()
+
+def _build_source_plan(file_path, sheet_name, delimiter, encoding, header_mapping, final_name_to_type_str, log, cached_header=None, filter_compiler=None, excel_engine=None, batch_dir=None):
+    """
+    Monta o plano lazy (pl.LazyFrame) de uma fonte - um CSV/TXT ou uma aba de Excel -
+    com a leitura a partir do cabeçalho detectado, o mapeamento de nomes (com coalesce),
+    a tipagem definida pelo usuário e os filtros (FilterCompiler).
+
+    Para CSV/TXT em UTF-8 o arquivo é apenas escaneado (pl.scan_csv): a leitura real
+    acontece no collect(), já com as colunas e linhas podadas pelo otimizador do Polars.
+    Nas demais codificações o arquivo é decodificado em lotes, e cada lote é transformado
+    e filtrado antes da leitura do próximo; o mesmo vale para as abas de Excel, lidas pelo
+    motor excel_engine (padrão: o mais rápido disponível, ver dataflow.excel); com
+    batch_dir, os lotes transformados vão para o disco (ver _transform_batches).
+    cached_header = (índice, nomes) vindo do HeaderCache dispensa a detecção de cabeçalho.
+    Retorna None (após registrar o motivo no log) quando a fonte deve ser pulada.
+    """
+    description = _describe_source(file_path, sheet_name)
+    n_preread_rows = 20
+    lf_data = None
+    header_names = []
+
+    if file_path.lower().endswith((".csv", ".txt")):
+        # Pré-leitura e dados saem do mesmo handle: o arquivo não é lido duas vezes
+        with CsvSource(file_path, delimiter, encoding, n_preread_rows) as csv_source:
+            pre_read_df = csv_source.read_head() # Também mapeia linhas do arquivo para iter_data/scan_data
+            header_row_index, header_names = cached_header or _detect_header(pre_read_df, n_preread_rows)
+            if encoding not in NATIVE_CSV_ENCODINGS:
+                # Projeção: só as colunas incluídas no mapeamento são convertidas em cada lote
+                column_indices = _included_column_indices(header_names, file_path, sheet_name, header_mapping)
+                if column_indices == []:
+                    log(f"Nenhuma coluna do arquivo {description} corresponde ao mapeamento. Pulando.", LogLevel.WARNING)
+                    return None
+                raw_batches = csv_source.iter_data(header_row_index, column_indices, len(header_names))
+                if column_indices is not None:
+                    header_names = [header_names[i] for i in column_indices]
+                return _transform_batches(raw_batches, header_names, file_path, sheet_name,
+                                          header_mapping, final_name_to_type_str, filter_compiler, log, batch_dir)
+            # O Polars começa a ler direto da linha seguinte ao cabeçalho (skip_rows)
+            lf_data = csv_source.scan_data(header_row_index)
+
+    elif file_path.lower().endswith((".xlsx", ".xls")):
+        # A pasta de trabalho é aberta uma única vez para a pré-leitura e os dados de todas as suas abas
+        workbook = cached_workbook(file_path, excel_engine)
+        if cached_header:
+            header_row_index, header_names = cached_header
+        else:
+            pre_read_df = workbook.read_head(sheet_name, n_preread_rows)
+            header_row_index, header_names = _detect_header(pre_read_df, n_preread_rows)
+        # Projeção: só as colunas incluídas no mapeamento são convertidas
+        column_indices = _included_column_indices(header_names, file_path, sheet_name, header_mapping)
+        if column_indices == []:
+            log(f"Nenhuma coluna do arquivo {description} corresponde ao mapeamento. Pulando.", LogLevel.WARNING)
+            return None
+        # Lotes a partir da linha seguinte ao cabeçalho, descartando as linhas em branco
+        raw_batches = (raw_batch.filter(~pl.all_horizontal(pl.all().is_null()))
+                       for raw_batch in workbook.iter_data(sheet_name, header_row_index + 1, column_indices))
+        if column_indices is not None:
+            header_names = [header_names[i] for i in column_indices]
+        return _transform_batches(raw_batches, header_names, file_path, sheet_name,
+                                  header_mapping, final_name_to_type_str, filter_compiler, log, batch_dir)
+
+    if lf_data is None:
+        log(f"Dados vazios ou erro ao ler {description}. Pulando.", LogLevel.WARNING)
+        return None
+
+    transform = _source_transform(lf_data.collect_schema().names(), header_names, file_path, sheet_name, header_mapping, final_name_to_type_str, log)
+    if transform is None:
+        return None
+    lf_typed = transform(lf_data)
+
+    # --- Filtros (com lógica hierárquica E/OU) ---
+    if filter_compiler:
+        filter_expressions = filter_compiler.expressions_for(lf_typed.collect_schema(), description, log)
+        if filter_expressions:
+            # O predicado é empurrado para a leitura pelo otimizador do Polars
+            lf_typed = lf_typed.filter(filter_expressions)
+            log(f"Filtro incluído no plano de {description}.", LogLevel.INFO)
+
+    return lf_typed
+
+def _read_filter_value_list(file_path) -> pl.Series:
+    """
+    Lê a lista de valores do operador "Está na lista (arquivo)": a primeira coluna de um
+    Parquet, ou a primeira coluna de um CSV/TXT (um valor por linha; o separador ; , tab
+    ou | é detectado na primeira linha). Retorna os valores únicos, como texto e sem brancos.
+    """
+    if file_path.lower().endswith(".parquet"):
+        values = pl.read_parquet(file_path, columns=[0]).to_series().cast(pl.String)
+    else:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            first_line = f.readline()
+        separator = next((candidate for candidate in (";", "\t", "|", ",") if candidate in first_line), ";")
+        values = pl.read_csv(file_path, has_header=False, separator=separator, columns=[0], infer_schema=False,
+                             encoding="utf8-lossy", quote_char=None, truncate_ragged_lines=True).to_series()
+    values = values.str.strip_chars()
+    return values.filter(values != "").unique()
+
+class FilterCompiler:
+    """
+    Compila as regras do FilterDialog uma única vez e gera as expressões Polars de cada
+    schema. Regras na mesma coluna são unidas com OU (inclusão) / E (exclusão) e as
+    expressões retornadas devem ser combinadas com E. Várias regras "Igual a" /
+    "Diferente de" na mesma coluna viram uma única busca em hash (is_in) e várias
+    "Contém" / "Não contém" uma única busca multi-padrão (str.contains_any). As listas
+    do operador "Está na lista (arquivo)" são lidas uma única vez e entram na mesma busca
+    em hash das regras "Igual a" da coluna.
+
+    As expressões ficam em cache pelos tipos das colunas filtradas: fontes com o mesmo
+    schema reaproveitam as expressões (e os literais já convertidos) sem recompilar.
+    """
+    # Definir quais operadores são para exclusão
+    EXCLUSION_OPERATORS = {"Diferente de", "Não contém"}
+
+    def __init__(self, filter_rules):
+        self.rules_by_column = {} # {coluna: [(operador, valor sem espaços nas pontas)]}
+        for rule in filter_rules or []:
+            col_name, operator, value = rule.get("column"), rule.get("operator"), rule.get("value")
+            # Pular regras incompletas
+            if not col_name or operator is None or value is None:
+                continue
+            if operator in OPERATORS_NO_VALUE:
+                value = None
+            elif operator == "Entre":
+                if not (isinstance(value, list) and len(value) == 2 and value[0].strip() and value[1].strip()):
+                    continue
+                value = (value[0].strip(), value[1].strip())
+            elif isinstance(value, str) and value.strip():
+                value = value.strip()
+            else:
+                continue
+            self.rules_by_column.setdefault(col_name, []).append((operator, value))
+        self._expressions_by_schema = {}
+        self._value_lists = {} # {caminho: Series de valores} das regras com lista em arquivo
+
+    def __bool__(self):
+        return bool(self.rules_by_column)
+
+    def expressions_for(self, schema, description, log) -> list:
+        """Expressões de filtro (a combinar com E) para uma fonte com o schema informado."""
+        schema_key = tuple((col_name, schema[col_name]) for col_name in self.rules_by_column if col_name in schema)
+        expressions = self._expressions_by_schema.get(schema_key)
+        if expressions is None:
+            expressions = []
+            for col_name, col_type in schema_key:
+                col_final_expr = self._compile_column(col_name, col_type, description, log)
+                if col_final_expr is not None:
+                    expressions.append(col_final_expr)
+            self._expressions_by_schema[schema_key] = expressions
+        return expressions
+
+    def _compile_column(self, col_name, col_type, description, log):
+        polars_col = pl.col(col_name)
+        inclusion_exprs, exclusion_exprs = [], []
+        equal_values, not_equal_values, contains_patterns, not_contains_patterns = [], [], [], []
+        equal_value_lists = []
+
+        # 1. Separar regras em Inclusão e Exclusão (listas de valores são combinadas depois)
+        for operator, value in self.rules_by_column[col_name]:
+            try:
+                if operator == "Está em branco": inclusion_exprs.append(polars_col.is_null())
+                elif operator == "Não está em branco": inclusion_exprs.append(polars_col.is_not_null())
+                elif operator == "Entre":
+                    lit_min = pl.lit(value[0]).cast(col_type, strict=False)
+                    lit_max = pl.lit(value[1]).cast(col_type, strict=False)
+                    inclusion_exprs.append(polars_col.is_between(lit_min, lit_max))
+                elif operator == "Igual a": equal_values.append(value)
+                elif operator == OPERATOR_VALUE_FILE: equal_value_lists.append(self._value_list(value, log))
+                elif operator == "Diferente de": not_equal_values.append(value)
+                elif operator == "Maior que": inclusion_exprs.append(polars_col > pl.lit(value).cast(col_type, strict=False))
+                elif operator == "Menor que": inclusion_exprs.append(polars_col < pl.lit(value).cast(col_type, strict=False))
+                elif col_type == pl.String:
+                    if operator == "Contém": contains_patterns.append(value)
+                    elif operator == "Não contém": not_contains_patterns.append(value)
+                    elif operator == "Começa com": inclusion_exprs.append(polars_col.str.starts_with(value))
+                    elif operator == "Termina com": inclusion_exprs.append(polars_col.str.ends_with(value))
+            except Exception as e_filter:
+                log(f"Não foi possível aplicar a regra de filtro '{col_name} {operator} {value}' em {description}: {e_filter}", LogLevel.WARNING)
+
+        try:
+            if equal_values or equal_value_lists:
+                inclusion_exprs.append(self._equals_any(polars_col, col_type, equal_values, equal_value_lists))
+            if not_equal_values:
+                exclusion_exprs.append(~self._equals_any(polars_col, col_type, not_equal_values))
+            if contains_patterns:
+                inclusion_exprs.append(self._contains_any(polars_col, contains_patterns))
+            if not_contains_patterns:
+                exclusion_exprs.append(~self._contains_any(polars_col, not_contains_patterns))
+        except Exception as e_filter:
+            log(f"Não foi possível aplicar as regras de filtro da coluna '{col_name}' em {description}: {e_filter}", LogLevel.WARNING)
+
+        # 2. Construir a expressão final para esta coluna
+        # Combinar todas as expressões de inclusão com OU (OR)
+        final_inclusion_expr = pl.any_horizontal(inclusion_exprs) if len(inclusion_exprs) > 1 else (inclusion_exprs[0] if inclusion_exprs else None)
+        # Combinar todas as expressões de exclusão com E (AND)
+        final_exclusion_expr = pl.all_horizontal(exclusion_exprs) if len(exclusion_exprs) > 1 else (exclusion_exprs[0] if exclusion_exprs else None)
+
+        # Juntar inclusão e exclusão com E (AND)
+        if final_inclusion_expr is not None and final_exclusion_expr is not None:
+            return final_inclusion_expr & final_exclusion_expr
+        return final_inclusion_expr if final_inclusion_expr is not None else final_exclusion_expr
+
+    def _value_list(self, file_path, log) -> pl.Series:
+        """Valores de um arquivo de lista, lidos uma única vez por execução."""
+        if file_path not in self._value_lists:
+            self._value_lists[file_path] = _read_filter_value_list(file_path)
+            log(f"Lista de filtro carregada de '{os.path.basename(file_path)}': {self._value_lists[file_path].len()} valor(es) único(s).", LogLevel.INFO)
+        return self._value_lists[file_path]
+
+    @staticmethod
+    def _equals_any(polars_col, col_type, values, value_lists=()):
+        """
+        Igualdade com qualquer um dos valores (e das listas em arquivo): comparação direta
+        para um valor, busca em hash para vários.
+        """
+        if len(values) == 1 and not value_lists:
+            return polars_col == pl.lit(values[0]).cast(col_type, strict=False)
+        all_values = pl.concat([pl.Series(values, dtype=pl.String), *value_lists])
+        typed_values = all_values.cast(col_type, strict=False).unique()
+        return polars_col.is_in(typed_values.implode())
+
+    @staticmethod
+    def _contains_any(polars_col, patterns):
+        """Contém qualquer um dos textos (literal): Aho-Corasick quando há vários padrões."""
+        if len(patterns) == 1:
+            return polars_col.str.contains(patterns[0], literal=True)
+        return polars_col.str.contains_any(list(dict.fromkeys(patterns)))
+
+def _global_target_type(dtypes_set: set):
+    """
+    Tipo alvo de uma coluna a partir dos tipos que ela tem nas fontes, e o motivo (para o log).
+    Retorna (None, motivo) quando a coluna é só Null ou de tipos não cobertos: fica como está.
+    """
+    is_int_present = any(t.is_integer() for t in dtypes_set)
+    is_float_present = any(t.is_float() for t in dtypes_set)
+    is_string_present = any(t == pl.String or t == pl.Utf8 for t in dtypes_set)
+    is_temporal_present = any(t.is_temporal() for t in dtypes_set)
+    is_boolean_present = any(t == pl.Boolean for t in dtypes_set)
+
+    # Regra de Prioridade para determinar o tipo alvo:
+    if is_string_present: # Se String estiver presente, tudo vira String
+        return pl.String, "String (devido à presença de String)"
+    if is_temporal_present and (is_int_present or is_float_present or is_boolean_present): # Temporal com outros não-string -> String
+        return pl.String, "String (conflito Temporal com Numérico/Booleano)"
+    if is_boolean_present and (is_int_present or is_float_present): # Booleano com Numérico -> String
+        return pl.String, "String (conflito Booleano com Numérico)"
+    if is_float_present: # Se Float estiver presente (e não String), tudo vira Float
+        return pl.Float64, "Decimal (Float) (devido à presença de Float ou Int+Float)"
+    if is_int_present: # Int64 também acomoda Booleanos como 0/1
+        return pl.Int64, "Inteiro"
+    if is_temporal_present: # Apenas Temporal (e talvez Null): o primeiro tipo temporal encontrado
+        first_temporal_type = next((t for t in dtypes_set if t.is_temporal()), pl.Date)
+        return first_temporal_type, f"{first_temporal_type} (apenas Temporal)"
+    if is_boolean_present: # Apenas Booleano (e talvez Null)
+        return pl.Boolean, "Booleano"
+    return None, "sem tipo alvo (apenas Null ou tipo não coberto)"
+
+def _resolve_global_schema(source_schemas: list):
+    """
+    Resolve, só a partir dos schemas das fontes, o schema global da consolidação: as colunas
+    na ordem de primeira aparição (a mesma do concat diagonal), o tipo alvo de cada uma e as
+    colunas em conflito (tipos diferentes entre fontes) com o motivo da escolha.
+    """
+    column_types = {} # {coluna: {tipos}}, na ordem de primeira aparição
+    for schema in source_schemas:
+        for col_name, dtype in schema.items():
+            column_types.setdefault(col_name, set()).add(dtype)
+
+    target_types = {}
+    conflicts = []
+    for col_name, dtypes_set in column_types.items():
+        target_type, reason = _global_target_type(dtypes_set)
+        if target_type is not None:
+            target_types[col_name] = target_type
+        if len(dtypes_set - {pl.Null}) > 1:
+            conflicts.append((col_name, reason))
+    return list(column_types), target_types, conflicts
+
+def _concat_source_plans(plans: list):
+    """Concatena os planos harmonizados das fontes com a coluna "Origem" no final. Retorna (plano, colunas)."""
+    consolidated_plan = pl.concat(plans, how="diagonal")
+    consolidated_columns = consolidated_plan.collect_schema().names()
+    if "Origem" in consolidated_columns:
+        consolidated_columns = [col for col in consolidated_columns if col != "Origem"] + ["Origem"]
+        consolidated_plan = consolidated_plan.select(consolidated_columns)
+    return consolidated_plan, consolidated_columns
+
+def _harmonize_plan(plan, schema, column_order: list, target_types: dict):
+    """
+    Alinha uma fonte ao schema global: converte apenas as colunas cujo tipo difere do alvo e
+    acrescenta as ausentes como nulos já tipados, na ordem global. Fontes que já estão no
+    formato final são devolvidas sem nenhuma etapa extra no plano.
+    Retorna (plano, nº de conversões, nº de colunas ausentes preenchidas).
+    """
+    expressions = []
+    cast_count = 0
+    missing_count = 0
+    for col_name in column_order:
+        target_type = target_types.get(col_name)
+        current_type = schema.get(col_name)
+        if current_type is None:
+            expressions.append(pl.lit(None, dtype=target_type or pl.Null).alias(col_name))
+            missing_count += 1
+        elif target_type is not None and current_type != target_type:
+            expressions.append(pl.col(col_name).cast(target_type, strict=False))
+            cast_count += 1
+        else:
+            expressions.append(pl.col(col_name))
+    if not cast_count and not missing_count and list(schema.keys()) == column_order:
+        return plan, 0, 0
+    return plan.select(expressions), cast_count, missing_count
+
+def _dedup_key_hash(key_columns: list) -> pl.Expr:
+    """Hash de 64 bits (UInt64) das colunas-chave de duplicatas: usado apenas para distribuir as chaves em partições."""
+    return pl.struct(key_columns).hash(seed=0).alias("__chave_duplicata__")
+
+def _first_occurrence_mask(key_plan: pl.LazyFrame, key_columns: list, spill_dir=None, budget_rows=DEDUP_MEMORY_BUDGET_ROWS) -> pl.Series:
+    """
+    Máscara (Boolean) da primeira ocorrência de cada chave, na ordem das linhas de key_plan
+    (as colunas-chave). As chaves são comparadas pelos próprios valores, não por um hash.
+    Sem spill_dir, é calculada em uma única passada na memória. Com spill_dir, as chaves
+    são gravadas uma vez em Parquet e redistribuídas, em lotes de budget_rows linhas, em
+    uma subpasta por partição do hash; cada partição é lida uma única vez, e só ela fica na
+    memória. O hash decide apenas a partição: chaves iguais sempre caem na mesma, então uma
+    colisão não remove linhas, só aumenta uma partição.
+    """
+    first_distinct = pl.struct(key_columns).is_first_distinct()
+    if spill_dir is None:
+        return key_plan.select(first_distinct).collect().to_series()
+
+    keys_path = os.path.join(spill_dir, "chaves_duplicatas.parquet")
+    key_plan.select(key_columns).sink_parquet(keys_path)
+    n_rows = pl.scan_parquet(keys_path).select(pl.len()).collect().item()
+    if n_rows <= budget_rows:
+        return pl.scan_parquet(keys_path).select(first_distinct).collect().to_series()
+
+    n_partitions = -(-n_rows // budget_rows)
+    for batch_number, offset in enumerate(range(0, n_rows, budget_rows)):
+        keys_batch = (pl.scan_parquet(keys_path).slice(offset, budget_rows)
+                      .with_row_index("__linha", offset=offset)
+                      .with_columns((_dedup_key_hash(key_columns) % n_partitions).alias("__particao"))
+                      .collect())
+        for (partition,), partition_keys in keys_batch.partition_by("__particao", as_dict=True, include_key=False).items():
+            partition_dir = os.path.join(spill_dir, f"particao_{partition:05d}")
+            os.makedirs(partition_dir, exist_ok=True)
+            partition_keys.write_parquet(os.path.join(partition_dir, f"lote_{batch_number:05d}.parquet"))
+        del keys_batch
+
+    duplicate_rows = []
+    for partition_dir in sorted(glob.glob(os.path.join(spill_dir, "particao_*"))):
+        # Lotes na ordem de gravação: dentro da partição, as linhas seguem a ordem original
+        batch_paths = sorted(glob.glob(os.path.join(partition_dir, "lote_*.parquet")))
+        duplicate_rows.append(
+            pl.scan_parquet(batch_paths)
+            .filter(~first_distinct)
+            .select(pl.col("__linha").cast(pl.UInt64))
+            .collect()
+            .to_series()
+        )
+    return pl.repeat(True, n_rows, dtype=pl.Boolean, eager=True).scatter(pl.concat(duplicate_rows), False)
+
+class DuplicateKeyIndex:
+    """
+    Índice persistente das chaves de duplicatas já emitidas em execuções anteriores. Cada
+    execução bem-sucedida acrescenta um arquivo Parquet (parte) com as chaves novas e a
+    "Origem" da primeira ocorrência; a consulta lê apenas as colunas-chave das partes, sem
+    reabrir as saídas antigas. As chaves são gravadas como texto, para não depender do tipo
+    resolvido em cada execução.
+    """
+    META_FILE_NAME = "indice.json"
+
+    def __init__(self, index_dir, key_columns):
+        self.index_dir = index_dir
+        self.key_columns = list(key_columns)
+        self.pending_keys = None
+        meta_path = os.path.join(index_dir, self.META_FILE_NAME)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get("version") != KEY_INDEX_VERSION:
+                raise ValueError(f"Índice de chaves em '{index_dir}' tem versão não suportada.")
+            if meta.get("key_columns") != self.key_columns:
+                raise ValueError(f"Índice de chaves em '{index_dir}' usa as colunas {meta.get('key_columns')}, "
+                                 f"diferentes das atuais {self.key_columns}. Use outro índice ou as mesmas colunas-chave.")
+
+    def _part_paths(self) -> list:
+        return sorted(glob.glob(os.path.join(self.index_dir, "parte_*.parquet")))
+
+    def _key_expressions(self) -> list:
+        return [pl.col(col_name).cast(pl.String) for col_name in self.key_columns]
+
+    def key_count(self) -> int:
+        part_paths = self._part_paths()
+        return pl.scan_parquet(part_paths).select(pl.len()).collect().item() if part_paths else 0
+
+    def seen_mask(self, frame: pl.DataFrame) -> pl.Series:
+        """Máscara (Boolean) das linhas de `frame` cuja chave já está no índice."""
+        part_paths = self._part_paths()
+        if not part_paths:
+            return pl.Series("__ja_emitida__", [False] * frame.height, dtype=pl.Boolean)
+        seen_rows = (frame.lazy().select(self._key_expressions()).with_row_index("__linha")
+                     .join(pl.scan_parquet(part_paths).select(self.key_columns), on=self.key_columns, how="semi", nulls_equal=True)
+                     .select(pl.col("__linha").cast(pl.UInt64))
+                     .collect().to_series())
+        return pl.repeat(False, frame.height, dtype=pl.Boolean, eager=True).scatter(seen_rows, True).alias("__ja_emitida__")
+
+    def stage(self, new_rows: pl.DataFrame):
+        """Separa as chaves novas (já sem repetições) para gravação após o sucesso da execução."""
+        origin = [pl.col("Origem").cast(pl.String)] if "Origem" in new_rows.columns else [pl.lit(None, dtype=pl.String).alias("Origem")]
+        self.pending_keys = new_rows.select(self._key_expressions() + origin)
+
+    def commit(self) -> int:
+        """Grava as chaves pendentes como uma nova parte do índice. Retorna quantas foram gravadas."""
+        if self.pending_keys is None or self.pending_keys.is_empty():
+            return 0
+        os.makedirs(self.index_dir, exist_ok=True)
+        part_name = f"parte_{datetime.datetime.now():%Y%m%d_%H%M%S_%f}.parquet"
+        temp_path = os.path.join(self.index_dir, part_name + ".tmp")
+        self.pending_keys.write_parquet(temp_path, compression='zstd')
+        os.replace(temp_path, os.path.join(self.index_dir, part_name))
+        meta_path = os.path.join(self.index_dir, self.META_FILE_NAME)
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"version": KEY_INDEX_VERSION, "key_columns": self.key_columns}, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+        written = self.pending_keys.height
+        self.pending_keys = None
+        return written
+
+def _pivot_rules_for_schema(aggregations: list, column_names: list, log) -> list:
+    """Regras de agregação válidas para as colunas consolidadas: [(coluna, operação, nome do resultado)]."""
+    rules = []
+    for rule in aggregations:
+        col_name = rule['column']
+        op_str = rule['operation']
+        if col_name not in column_names:
+            log(f"Coluna '{col_name}' da regra de resumo não encontrada. Pulando.", LogLevel.WARNING)
+            continue
+        if op_str in PIVOT_OPERATIONS:
+            rules.append((col_name, op_str, f"{col_name}_{op_str.replace(' ', '_')}"))
+    return rules
+
+def _pivot_partial_expressions(rules: list) -> list:
+    """
+    Agregados parciais, calculados por fonte e combináveis entre si: soma, contagem,
+    mínimo e máximo; a média vira soma + contagem e a contagem única, o conjunto de valores.
+    """
+    expressions = []
+    for index, (col_name, op_str, _) in enumerate(rules):
+        column = pl.col(col_name)
+        if op_str == "Soma":
+            expressions.append(column.sum().alias(f"__p{index}_soma"))
+        elif op_str == "Contagem":
+            expressions.append(column.count().alias(f"__p{index}_contagem"))
+        elif op_str == "Mínimo":
+            expressions.append(column.min().alias(f"__p{index}_min"))
+        elif op_str == "Máximo":
+            expressions.append(column.max().alias(f"__p{index}_max"))
+        elif op_str == "Média":
+            expressions.append(column.cast(pl.Float64).sum().alias(f"__p{index}_soma"))
+            expressions.append(column.count().alias(f"__p{index}_contagem"))
+        elif op_str == "Contagem Única":
+            expressions.append(column.unique().alias(f"__p{index}_valores"))
+    return expressions
+
+def _pivot_merge_expressions(rules: list) -> list:
+    """Combina os agregados parciais de todas as fontes no resultado final de cada regra."""
+    expressions = []
+    for index, (_, op_str, result_name) in enumerate(rules):
+        if op_str == "Soma":
+            expressions.append(pl.col(f"__p{index}_soma").sum().alias(result_name))
+        elif op_str == "Contagem":
+            expressions.append(pl.col(f"__p{index}_contagem").sum().cast(pl.UInt32).alias(result_name))
+        elif op_str == "Mínimo":
+            expressions.append(pl.col(f"__p{index}_min").min().alias(result_name))
+        elif op_str == "Máximo":
+            expressions.append(pl.col(f"__p{index}_max").max().alias(result_name))
+        elif op_str == "Média":
+            total, count = pl.col(f"__p{index}_soma").sum(), pl.col(f"__p{index}_contagem").sum()
+            expressions.append(pl.when(count > 0).then(total / count).alias(result_name))
+        elif op_str == "Contagem Única":
+            expressions.append(pl.col(f"__p{index}_valores").explode(empty_as_null=False).n_unique().cast(pl.UInt32).alias(result_name))
+    return expressions
+
+def _pivot_definitions(pivot_rules) -> list:
+    """
+    Tabelas de resumo configuradas, como [{name, group_by, aggregations}]. Aceita o formato
+    com várias tabelas ({"pivots": [...], "only_pivot"}) e o antigo, de uma tabela só
+    ({"group_by", "aggregations", "only_pivot"}), que vira a tabela "Tabela_Resumo".
+    Tabelas sem agrupamento ou sem cálculos são ignoradas.
+    """
+    if not pivot_rules:
+        return []
+    raw_definitions = pivot_rules.get("pivots")
+    if raw_definitions is None:
+        raw_definitions = [dict(pivot_rules, name=DEFAULT_PIVOT_NAME)]
+    return [{"name": definition.get("name") or f"{DEFAULT_PIVOT_NAME}_{index + 1}",
+             "group_by": list(definition["group_by"]), "aggregations": list(definition["aggregations"])}
+            for index, definition in enumerate(raw_definitions)
+            if definition.get("group_by") and definition.get("aggregations")]
+
+def _build_pivot_plans(input_plans: list, pivot_specs: list) -> list:
+    """
+    Planos das tabelas de resumo, pivot_specs = [(group_by, regras)]. Tabelas com o mesmo
+    agrupamento compartilham um único group_by por plano de entrada (com os parciais de
+    todas elas, sem repetir cálculos iguais); os parciais são combinados por grupo e cada
+    tabela seleciona as suas colunas. Executados juntos (pl.collect_all), os planos leem
+    as entradas uma única vez.
+    """
+    rules_by_group_by = {} # {tuple(group_by): [regras únicas]}, na ordem de aparição
+    for group_by_cols, rules in pivot_specs:
+        shared_rules = rules_by_group_by.setdefault(tuple(group_by_cols), [])
+        shared_rules.extend(rule for rule in rules if rule not in shared_rules)
+
+    merged_by_group_by = {}
+    for group_by_key, shared_rules in rules_by_group_by.items():
+        group_by_cols = list(group_by_key)
+        partial_expressions = _pivot_partial_expressions(shared_rules)
+        partial_plans = [plan.lazy().group_by(group_by_cols).agg(partial_expressions) for plan in input_plans]
+        partials = partial_plans[0] if len(partial_plans) == 1 else pl.concat(partial_plans, how="vertical_relaxed")
+        merged_by_group_by[group_by_key] = partials.group_by(group_by_cols).agg(_pivot_merge_expressions(shared_rules))
+
+    return [merged_by_group_by[tuple(group_by_cols)]
+            .select(group_by_cols + [result_name for _, _, result_name in rules])
+            .sort(group_by_cols)
+            for group_by_cols, rules in pivot_specs]
+
+def _xlsx_sheet_name(name: str, used_names: set) -> str:
+    """Nome de aba válido no Excel (até 31 caracteres, sem []:*?/\\) e único no arquivo."""
+    base_name = re.sub(r"[\[\]:*?/\\]", "_", str(name)).strip("'")[:31] or DEFAULT_PIVOT_NAME
+    sheet_name, suffix = base_name, 1
+    while sheet_name.lower() in used_names:
+        suffix += 1
+        sheet_name = f"{base_name[:31 - len(str(suffix)) - 1]}_{suffix}"
+    used_names.add(sheet_name.lower())
+    return sheet_name
+
+def _split_for_xlsx_sheets(df: pl.DataFrame, base_sheet_name: str) -> list:
+    """Divide o DataFrame em blocos que cabem em uma aba do Excel: [(nome_da_aba, bloco), ...]."""
+    if df.height <= XLSX_MAX_ROWS_PER_SHEET:
+        return [(base_sheet_name, df)]
+    num_chunks = (df.height + XLSX_MAX_ROWS_PER_SHEET - 1) // XLSX_MAX_ROWS_PER_SHEET
+    return [(f"{base_sheet_name}_{i+1}", df.slice(i * XLSX_MAX_ROWS_PER_SHEET, XLSX_MAX_ROWS_PER_SHEET)) for i in range(num_chunks)]
+
+def _excel_serial_date(col_name: str, dtype) -> pl.Expr:
+    """
+    Converte Date/Datetime para o número de série do Excel de forma vetorizada, com o
+    mesmo cálculo do XlsxWriter (época 1899-12-31 e o dia 29/02/1900 fictício do Excel).
+    """
+    column = pl.col(col_name)
+    if isinstance(dtype, pl.Datetime) and dtype.time_zone is not None:
+        column = column.dt.replace_time_zone(None)
+    microseconds = (column.cast(pl.Datetime("us")) - pl.lit(datetime.datetime(1899, 12, 31))).dt.total_microseconds()
+    days = microseconds // 86_400_000_000
+    if dtype == pl.Date:
+        serial = days.cast(pl.Float64)
+    else:
+        remainder = microseconds - days * 86_400_000_000
+        serial = days + ((remainder // 1_000_000) + (remainder % 1_000_000) / 1e6) / 86_400
+    return pl.when(serial > 59).then(serial + 1).otherwise(serial).alias(col_name)
+
+def _estimate_column_widths(df: pl.DataFrame, sample_rows=None) -> dict:
+    """
+    Calcula o maior comprimento de texto de cada coluna (ou do nome, se maior) em uma
+    única consulta. Com sample_rows, examina apenas as primeiras e últimas sample_rows
+    linhas e mais sample_rows linhas aleatórias. Retorna {coluna: comprimento}.
+    """
+    if df.width == 0:
+        return {}
+    sample_df = df
+    if sample_rows and df.height > 3 * sample_rows:
+        middle_df = df.slice(sample_rows, df.height - 2 * sample_rows).sample(n=sample_rows, seed=0)
+        sample_df = pl.concat([df.head(sample_rows), middle_df, df.tail(sample_rows)])
+    text_lengths = sample_df.select(pl.all().cast(pl.String).str.len_chars().max()).row(0)
+    return {col: max(len(str(col)), length or 1) for col, length in zip(df.columns, text_lengths)}
+
+def _prepare_for_xlsx(df: pl.DataFrame) -> pl.DataFrame:
+    """Converte tipos que o XlsxWriter não escreve diretamente (Decimal, listas, etc.) e datas para número de série."""
+    conversions = []
+    for col_name, dtype in df.schema.items():
+        if isinstance(dtype, pl.Decimal):
+            conversions.append(pl.col(col_name).cast(pl.Float64))
+        elif dtype == pl.Date or isinstance(dtype, pl.Datetime):
+            # As abas não aplicam formato de data às células: o XlsxWriter gravaria o mesmo número
+            conversions.append(_excel_serial_date(col_name, dtype))
+        elif not (dtype.is_numeric() or dtype.is_temporal() or dtype == pl.Boolean or dtype == pl.String):
+            conversions.append(pl.col(col_name).cast(pl.String))
+    return df.with_columns(conversions) if conversions else df
+
+def _xlsx_column_writer(worksheet, dtype):
+    """Escolhe o método de escrita do XlsxWriter para uma coluna, evitando o despacho genérico de write()."""
+    if dtype == pl.Boolean:
+        return worksheet.write_boolean
+    if dtype.is_numeric():
+        return worksheet.write_number
+    if dtype.is_temporal():
+        return worksheet.write_datetime
+    return worksheet.write_string # Texto é gravado literalmente (sem conversão implícita para fórmula/URL)
+
+def _is_excel_path(file_path: str) -> bool:
+    return file_path.lower().endswith((".xlsx", ".xls"))
+
+def _group_ingest_tasks(sources, max_workers) -> list:
+    """
+    Agrupa as fontes [(arquivo, aba)] em tarefas de leitura (listas de índices, na ordem
+    de entrada): cada CSV/TXT é uma tarefa e as abas de uma pasta de trabalho ficam
+    juntas, para que o arquivo seja aberto uma única vez. Se houver menos tarefas que
+    max_workers, as pastas de trabalho com mais abas são divididas em mais tarefas.
+    """
+    tasks = []
+    sheets_by_workbook = {}
+    for index, (file_path, _) in enumerate(sources):
+        if _is_excel_path(file_path):
+            sheets_by_workbook.setdefault(file_path, []).append(index)
+        else:
+            tasks.append([index])
+    chunks_by_workbook = dict.fromkeys(sheets_by_workbook, 1)
+    while chunks_by_workbook and len(tasks) + sum(chunks_by_workbook.values()) < max_workers:
+        file_path = max(chunks_by_workbook, key=lambda path: len(sheets_by_workbook[path]) / chunks_by_workbook[path])
+        if chunks_by_workbook[file_path] >= len(sheets_by_workbook[file_path]):
+            break
+        chunks_by_workbook[file_path] += 1
+    for file_path, indices in sheets_by_workbook.items():
+        chunk_size = -(-len(indices) // chunks_by_workbook[file_path])
+        tasks.extend(indices[start:start + chunk_size] for start in range(0, len(indices), chunk_size))
+    return sorted(tasks)
+
+def _read_sheet_names(file_path: str) -> list:
+    """Nomes das abas de um arquivo Excel, sem carregar os dados das planilhas (ver read_sheet_names)."""
+    if not _is_excel_path(file_path):
+        return []
+    return read_sheet_names(file_path)
+
+@contextlib.contextmanager
+def _ingest_process_environment(n_processes: int):
+    """
+    Divide os núcleos entre os processos de leitura: POLARS_MAX_THREADS precisa estar no
+    ambiente antes de o processo filho importar o Polars, por isso é definido no processo
+    principal enquanto o pool pode criar processos (na criação por spawn, o filho herda o
+    ambiente do pai) e restaurado ao final.
+    """
+    previous_value = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = str(max(1, (os.cpu_count() or 1) // n_processes))
+    try:
+        yield
+    finally:
+        if previous_value is None:
+            os.environ.pop("POLARS_MAX_THREADS", None)
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous_value
+
+def _ingest_source(file_path, sheet_name, options, materialize, fragment_path=None):
+    """
+    Lê e transforma uma fonte (arquivo CSV/TXT ou aba de Excel): leitura, mapeamento,
+    tipagem, filtros e coluna "Origem". Roda nos pools do ConsolidationWorker, por isso
+    não emite sinais: retorna (resultado, logs), com logs como (mensagem, LogLevel.name).
+    O resultado é um DataFrame quando materialize=True, um LazyFrame caso contrário, ou
+    None se a fonte foi pulada. Com fragment_path, o plano é gravado em Parquet (streaming)
+    e o resultado é o caminho do fragmento. Os lotes lidos em Python (Excel e CSV fora de
+    UTF-8) vão para uma subpasta de options["batch_dir"], quando definida. Um plano que
+    continua lazy tem as primeiras linhas executadas aqui, para que uma fonte ilegível
+    seja pulada já na leitura, e não apenas na execução do plano consolidado.
+    """
+    logs = []
+    def log(message, level=LogLevel.INFO):
+        logs.append((message, level.name))
+
+    description = _describe_source(file_path, sheet_name)
+    try:
+        cached_header = options["cached_headers"].get((file_path, sheet_name))
+        batch_dir = tempfile.mkdtemp(prefix="lotes_", dir=options["batch_dir"]) if options.get("batch_dir") else None
+        source_plan = _build_source_plan(file_path, sheet_name, options["delimiter"], options["encoding"], options["header_mapping"], options["final_name_to_type_str"], log, cached_header, options["filter_compiler"], options["excel_engine"], batch_dir)
+        if source_plan is None:
+            return None, logs
+        if not materialize and not fragment_path:
+            source_plan.head(SOURCE_VALIDATION_ROWS).collect()
+
+        if materialize:
+            source_plan = source_plan.collect().lazy()
+
+        # --- Adicionar Coluna de Origem ---
+        file_name_only = os.path.basename(file_path)
+        source_name = f"{file_name_only} ({sheet_name})" if sheet_name else file_name_only
+        source_plan = source_plan.with_columns(pl.lit(source_name).alias("Origem"))
+        if fragment_path:
+            source_plan.sink_parquet(fragment_path)
+            fragment_rows = pl.scan_parquet(fragment_path).select(pl.len()).collect().item()
+            log(f"Fragmento de {description} gravado: {fragment_rows} linha(s).", LogLevel.INFO)
+            return fragment_path, logs
+        return (source_plan.collect() if materialize else source_plan), logs
+
+    except Exception as e:
+        log(f"Erro ao processar (ler/mapear/tipar) {description}: {e}", LogLevel.ERROR)
+        return None, logs
+
+def _ingest_task(task_items, options):
+    """
+    Lê em sequência as fontes de uma tarefa de leitura com _ingest_source, para que as abas
+    de uma mesma pasta de trabalho reaproveitem o arquivo aberto (fechado ao final).
+    task_items = [(arquivo, aba, materialize, fragment_path)]; retorna [(resultado, logs)].
+    """
+    try:
+        return [_ingest_source(file_path, sheet_name, options, materialize, fragment_path)
+                for file_path, sheet_name, materialize, fragment_path in task_items]
+    finally:
+        close_cached_workbooks()
+
+class ConsolidationJob:
+    """
+    Pipeline completo de consolidação (leitura, mapeamento, tipagem, filtros,
+    harmonização, duplicatas, resumo e escrita), sem dependência de Qt. O andamento
+    é informado pelos callbacks on_log(mensagem, LogLevel), on_progress(percentual),
+    on_progress_text(texto) e on_finished(sucesso, mensagem), todos opcionais.
+    """
+    def __init__(self, files_to_process, output_path, output_format, header_mapping, filter_rules, delimiter, pivot_rules, duplicates_config=None, encoding=DEFAULT_CSV_ENCODING, engine_mode="lazy", max_workers=DEFAULT_MAX_WORKERS, width_sample_rows=None, header_cache_path=None, incremental_dir=None,
+                 dedup_memory_rows=DEDUP_MEMORY_BUDGET_ROWS, excel_engine=None, on_log=None, on_progress=None, on_progress_text=None, on_finished=None):
+        self.files_to_process = files_to_process 
+        self.output_path = output_path
+        self.output_format = output_format
+        self.header_mapping = header_mapping
+        self.filter_rules = filter_rules
+        self.pivot_rules = pivot_rules
+        self.duplicates_config = duplicates_config or {}
+        self.delimiter = delimiter
+        self.encoding = encoding
+        # "lazy": um plano por fonte, materializado uma única vez após a concatenação.
+        # "eager": cada fonte é materializada assim que lida (erros isolados por arquivo).
+        self.engine_mode = engine_mode
+        self.max_workers = max(1, int(max_workers or 1))
+        self.fragment_dir = None # Pasta temporária dos fragmentos Parquet (lotes lidos em Python e fontes do modo streaming)
+        self.width_sample_rows = width_sample_rows # Se definido, larguras das colunas XLSX estimadas por amostragem
+        self.header_cache_path = header_cache_path # Cache da análise de cabeçalhos (HeaderCache), se houver
+        self.incremental_dir = incremental_dir # Pasta persistente dos fragmentos do modo incremental, se ativo
+        self.dedup_memory_rows = dedup_memory_rows # Acima deste número de linhas, as chaves de duplicatas vão para o disco
+        self.excel_engine = excel_engine # Motor de leitura de Excel ("calamine"/"openpyxl"); None = o mais rápido disponível
+        self.key_index = None # DuplicateKeyIndex, quando a comparação com execuções anteriores está ativa
+        self.rows_to_write = 0 # Contadores de progresso da escrita XLSX
+        self.rows_written = 0
+        self.is_running = True
+        self.on_log = on_log
+        self.on_progress = on_progress
+        self.on_progress_text = on_progress_text
+        self.on_finished = on_finished
+
+        # Mapa {nome_final: tipo escolhido}, o mesmo para todas as fontes
+        self.final_name_to_type_str = {}
+        for original_h, map_details in (self.header_mapping or {}).items():
+            if map_details.get("include"):
+                self.final_name_to_type_str[map_details.get("final_name", original_h)] = map_details.get("type_str")
+
+    def _log(self, message, level=LogLevel.INFO):
+        if self.on_log:
+            self.on_log(message, level)
+
+    def _progress(self, percent):
+        if self.on_progress:
+            self.on_progress(percent)
+
+    def _progress_text(self, text):
+        if self.on_progress_text:
+            self.on_progress_text(text)
+
+    def _finish(self, success, message):
+        if self.on_finished:
+            self.on_finished(success, message)
+
+    def _load_cached_headers(self, sources):
+        """Cabeçalhos já detectados na análise (HeaderCache) e ainda válidos: {(arquivo, aba): (índice, nomes)}."""
+        if not self.header_cache_path:
+            return {}
+        header_cache = HeaderCache(self.header_cache_path)
+        cached_headers = {}
+        for file_path, sheet_name in sources:
+            entry = header_cache.get(file_path, sheet_name, _header_read_options(file_path, self.delimiter, self.encoding))
+            if entry is not None:
+                cached_headers[(file_path, sheet_name)] = (entry["header_row_index"], entry["header_names"])
+        if cached_headers:
+            self._log(f"Cabeçalhos de {len(cached_headers)} de {len(sources)} arquivo(s)/aba(s) reaproveitados do cache de análise.", LogLevel.INFO)
+        return cached_headers
+
+    def _ingest_sources(self, sources, fragment_paths=None):
+        """
+        Processa as fontes com até max_workers tarefas simultâneas: Excel em processos
+        (a leitura é presa ao GIL) e CSV/TXT em threads (o Polars libera o GIL). As abas
+        de uma pasta de trabalho são lidas na mesma tarefa (_group_ingest_tasks).
+        Os logs de cada fonte são emitidos quando ela termina; os planos são
+        devolvidos na ordem de entrada, independentemente da ordem de conclusão,
+        com None nas fontes puladas. Com fragment_paths (um por fonte), cada plano é
+        gravado no seu fragmento Parquet e o resultado é a leitura desse fragmento.
+        """
+        options = {
+            "delimiter": self.delimiter,
+            "encoding": self.encoding,
+            "header_mapping": self.header_mapping,
+            "final_name_to_type_str": self.final_name_to_type_str,
+            "filter_compiler": FilterCompiler(self.filter_rules),
+            "cached_headers": self._load_cached_headers(sources),
+            "excel_engine": self.excel_engine,
+            "batch_dir": self.fragment_dir,
+        }
+        results = [None] * len(sources)
+        use_processes = self.max_workers > 1 and any(_is_excel_path(file_path) for file_path, _ in sources)
+        self._log(f"Lendo {len(sources)} arquivo(s)/aba(s) com até {self.max_workers} tarefa(s) em paralelo...", LogLevel.INFO)
+
+        thread_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        process_pool = None
+        process_environment = contextlib.ExitStack()
+        if use_processes:
+            # Os processos são criados sob demanda (a cada submit): o ambiente vale até o fim do pool
+            process_environment.enter_context(_ingest_process_environment(self.max_workers))
+            process_pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = {}
+            for task_indices in _group_ingest_tasks(sources, self.max_workers):
+                in_process = use_processes and _is_excel_path(sources[task_indices[0]][0])
+                task_items = []
+                for index in task_indices:
+                    file_path, sheet_name = sources[index]
+                    fragment_path = fragment_paths[index] if fragment_paths else None
+                    if fragment_path is None and in_process and self.engine_mode != "eager" and self.fragment_dir:
+                        # Resultados de processos voltam gravados em fragmento, e não como um DataFrame inteiro
+                        fragment_path = os.path.join(self.fragment_dir, f"fonte_{index:05d}.parquet")
+                    # Sem pasta de fragmentos, resultados de processos precisam voltar materializados (DataFrame)
+                    materialize = fragment_path is None and (in_process or self.engine_mode == "eager")
+                    task_items.append((file_path, sheet_name, materialize, fragment_path))
+                pool = process_pool if in_process else thread_pool
+                futures[pool.submit(_ingest_task, task_items, options)] = task_indices
+
+            processed_items = 0
+            for future in as_completed(futures):
+                if not self.is_running:
+                    break
+                task_indices = futures[future]
+                try:
+                    task_results = future.result()
+                except Exception as e: # Ex.: processo filho encerrado abruptamente
+                    task_results = [(None, [(f"Erro ao processar (ler/mapear/tipar) {_describe_source(*sources[index])}: {e}", LogLevel.ERROR.name)])
+                                    for index in task_indices]
+                for index, (result, logs) in zip(task_indices, task_results):
+                    for message, level_name in logs:
+                        self._log(message, LogLevel[level_name])
+                    if isinstance(result, pl.DataFrame):
+                        result = result.lazy()
+                    elif isinstance(result, str): # Fragmento Parquet gravado no modo streaming
+                        result = pl.scan_parquet(result)
+                    results[index] = result
+
+                processed_items += len(task_indices)
+                self._progress(int((processed_items / len(sources)) * 100))
+        finally:
+            thread_pool.shutdown(wait=True, cancel_futures=True)
+            if process_pool is not None:
+                process_pool.shutdown(wait=True, cancel_futures=True)
+            process_environment.close()
+
+        return results
+
+    def _incremental_config_hash(self, file_path, sheet_name):
+        """
+        Hash de tudo o que define o fragmento de uma fonte: mapeamento da fonte, tipos,
+        filtros (com tamanho e data de modificação dos arquivos de lista), opções de leitura
+        e o motor de Excel que lê a fonte.
+        """
+        source_mapping = sorted([original_col_name, mapping_info] for (original_col_name, mapping_file, mapping_sheet), mapping_info in self.header_mapping.items()
+                                if mapping_file == file_path and mapping_sheet == sheet_name)
+        value_files = {}
+        for rule in self.filter_rules or []:
+            if rule.get("operator") == OPERATOR_VALUE_FILE and rule.get("value"):
+                try:
+                    stat = os.stat(rule["value"])
+                    value_files[rule["value"]] = [stat.st_size, stat.st_mtime_ns]
+                except OSError:
+                    value_files[rule["value"]] = None
+        excel_engine = None
+        if _is_excel_path(file_path):
+            try:
+                excel_engine = resolve_excel_engine(file_path, self.excel_engine)
+            except ValueError:
+                pass # Sem motor instalado a leitura falha de qualquer forma
+        config = {
+            "version": INCREMENTAL_MANIFEST_VERSION,
+            "read_options": _header_read_options(file_path, self.delimiter, self.encoding),
+            "mapping": source_mapping,
+            "types": self.final_name_to_type_str,
+            "filters": self.filter_rules,
+            "value_files": value_files,
+            "excel_engine": excel_engine,
+        }
+        return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _ingest_incremental(self, sources):
+        """
+        Consolidação incremental: reaproveita os fragmentos Parquet (já mapeados, tipados,
+        filtrados e com "Origem") das fontes que não mudaram desde a última execução,
+        processa apenas as novas ou alteradas e remove os fragmentos de fontes excluídas.
+        O manifesto guarda, por fonte, tamanho, data de modificação e o hash da configuração.
+        """
+        os.makedirs(self.incremental_dir, exist_ok=True)
+        manifest_path = os.path.join(self.incremental_dir, INCREMENTAL_MANIFEST_FILE_NAME)
+        manifest_sources = {}
+        try:
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get("version") == INCREMENTAL_MANIFEST_VERSION:
+                    manifest_sources = manifest.get("sources", {})
+        except Exception as e:
+            self._log(f"Manifesto incremental ilegível ({e}). Todas as fontes serão reprocessadas.", LogLevel.WARNING)
+
+        plans = [None] * len(sources)
+        pending_indices, pending_fragments, pending_entries = [], [], {}
+        current_keys = set()
+        for index, (file_path, sheet_name) in enumerate(sources):
+            source_key = f"{os.path.abspath(file_path)}|{sheet_name or ''}"
+            current_keys.add(source_key)
+            fragment_name = f"{hashlib.sha1(source_key.encode('utf-8')).hexdigest()[:16]}.parquet"
+            fragment_path = os.path.join(self.incremental_dir, fragment_name)
+            try:
+                stat = os.stat(file_path)
+                entry = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "config_hash": self._incremental_config_hash(file_path, sheet_name),
+                    "fragment": fragment_name,
+                }
+            except OSError:
+                entry = None # A leitura vai registrar o erro
+            if entry is not None and manifest_sources.get(source_key) == entry and os.path.exists(fragment_path):
+                plans[index] = pl.scan_parquet(fragment_path)
+                continue
+            pending_indices.append(index)
+            pending_fragments.append(fragment_path)
+            pending_entries[index] = (source_key, entry)
+
+        # Fontes que saíram da pasta/seleção: o fragmento é descartado
+        for source_key in set(manifest_sources) - current_keys:
+            removed_entry = manifest_sources.pop(source_key)
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.incremental_dir, removed_entry["fragment"]))
+
+        self._log(f"Modo incremental: {len(sources) - len(pending_indices)} fonte(s) reaproveitada(s), {len(pending_indices)} a processar.", LogLevel.INFO)
+        if pending_indices:
+            pending_sources = [sources[index] for index in pending_indices]
+            for index, plan in zip(pending_indices, self._ingest_sources(pending_sources, pending_fragments)):
+                plans[index] = plan
+                source_key, entry = pending_entries[index]
+                if plan is not None and entry is not None:
+                    manifest_sources[source_key] = entry
+                else: # Fonte pulada ou com erro: será tentada de novo na próxima execução
+                    manifest_sources.pop(source_key, None)
+
+        if self.is_running:
+            temp_path = manifest_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": INCREMENTAL_MANIFEST_VERSION, "sources": manifest_sources}, f, ensure_ascii=False)
+            os.replace(temp_path, manifest_path)
+        return plans
+
+    def _write_xlsx_sheet(self, workbook, sheet_name, df, header_formats, data_format, max_lengths, autofilter=True):
+        """
+        Escreve um DataFrame em uma nova aba: cabeçalho formatado, painel congelado,
+        larguras de coluna e autofiltro. Os dados são escritos em lotes de colunas, com o
+        método de escrita de cada coluna escolhido uma única vez a partir do tipo Polars.
+        write_column não serve no modo constant_memory, em que as linhas são gravadas em
+        ordem. write_row passa cada célula pelo despacho genérico de write() e não sai mais
+        rápido que o write_* tipado por célula (ver tests/bench_xlsx_writer.py).
+        """
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.freeze_panes('A2')
+        worksheet.set_zoom(70)
+        worksheet.hide_gridlines(2)
+        for col_idx, col_name in enumerate(df.columns):
+            worksheet.write_string(0, col_idx, col_name, header_formats[col_idx])
+            width = min(max_lengths.get(col_name, len(col_name)) + 2, 60)
+            worksheet.set_column(col_idx, col_idx, width, data_format)
+        if autofilter:
+            worksheet.autofilter(0, 0, df.height, df.width - 1)
+
+        df = _prepare_for_xlsx(df)
+        column_writers = [_xlsx_column_writer(worksheet, dtype) for dtype in df.dtypes]
+        row_idx = 1
+        for batch in df.iter_slices(XLSX_WRITE_BATCH_ROWS):
+            # Converte cada coluna do lote de uma vez (buffers Arrow -> listas Python)
+            batch_columns = [series.to_list() for series in batch.iter_columns()]
+            for row_values in zip(*batch_columns):
+                for col_idx, (write_cell, value) in enumerate(zip(column_writers, row_values)):
+                    if value is not None: # Células nulas ficam vazias
+                        write_cell(row_idx, col_idx, value)
+                row_idx += 1
+                self.rows_written += 1
+                if self.rows_written % 5000 == 0:
+                    self._progress_text(f"Escrevendo linha {self.rows_written:,} de {self.rows_to_write:,}...")
+
+    def _streaming_blockers(self):
+        """Retorna os motivos que impedem a gravação em streaming (lista vazia se for possível)."""
+        blockers = []
+        if self.output_format not in ("CSV", "Parquet"):
+            blockers.append(f"formato {self.output_format}")
+        return blockers
+
+    def _duplicate_mask(self, key_plan: pl.LazyFrame, key_columns: list, n_rows: int) -> pl.Series:
+        """Máscara de primeira ocorrência; acima do orçamento de memória, usa uma pasta temporária ao lado da saída."""
+        if n_rows <= self.dedup_memory_rows:
+            return _first_occurrence_mask(key_plan, key_columns)
+        self._log(f"{n_rows:,} chaves excedem o limite em memória ({self.dedup_memory_rows:,}). Processando as chaves em partições no disco...", LogLevel.INFO)
+        spill_dir = tempfile.mkdtemp(prefix=".dataflow_duplicatas_", dir=os.path.dirname(os.path.abspath(self.output_path)))
+        try:
+            return _first_occurrence_mask(key_plan, key_columns, spill_dir, self.dedup_memory_rows)
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    def _open_key_index(self, key_columns):
+        """Abre o índice persistente de chaves, se configurado em duplicates_config["use_key_index"]."""
+        if not (key_columns and self.duplicates_config.get("use_key_index")):
+            return None
+        index_dir = self.duplicates_config.get("key_index_path") or _key_index_dir(self.output_path)
+        key_index = DuplicateKeyIndex(index_dir, key_columns)
+        self._log(f"Índice de chaves de execuções anteriores: {index_dir} ({key_index.key_count():,} chaves).", LogLevel.INFO)
+        return key_index
+
+    def _apply_key_index(self, keep_mask: pl.Series, key_frame: pl.DataFrame) -> pl.Series:
+        """Descarta também as linhas com chave já emitida em execuções anteriores e separa as chaves novas."""
+        if self.key_index is None:
+            return keep_mask
+        seen_mask = self.key_index.seen_mask(key_frame)
+        previously_emitted = (keep_mask & seen_mask).sum()
+        keep_mask = keep_mask & ~seen_mask
+        self.key_index.stage(key_frame.filter(keep_mask))
+        self._log(f"{previously_emitted} linhas já emitidas em execuções anteriores foram removidas (índice de chaves).", LogLevel.INFO)
+        return keep_mask
+
+    def _commit_key_index(self, detail_written=True):
+        """
+        Grava as chaves novas no índice, apenas depois que a saída foi salva com sucesso e
+        somente se o detalhe consolidado foi gravado (com "apenas resumo", nenhuma linha foi emitida).
+        """
+        if self.key_index is None:
+            return
+        if not detail_written:
+            self.key_index.pending_keys = None
+            self._log("Índice de chaves não atualizado: apenas a tabela de resumo foi gravada.", LogLevel.INFO)
+            return
+        try:
+            written = self.key_index.commit()
+            self._log(f"{written} chave(s) nova(s) acrescentada(s) ao índice de chaves.", LogLevel.INFO)
+        except Exception as e:
+            self._log(f"Não foi possível atualizar o índice de chaves: {e}. As linhas desta execução podem ser emitidas novamente.", LogLevel.WARNING)
+
+    def _drop_duplicates_streaming(self, consolidated_plan, key_columns):
+        """
+        Remove duplicatas sem materializar a base: só as colunas-chave são lidas para calcular
+        a máscara (acima do orçamento de memória, direto para o disco), e a gravação em
+        streaming descarta as linhas repetidas pelo número da linha.
+        """
+        self._log(f"Removendo duplicatas com base nas chaves: {', '.join(key_columns)}...", LogLevel.INFO)
+        n_rows = consolidated_plan.select(pl.len()).collect(engine="streaming").item()
+        keep_mask = self._duplicate_mask(consolidated_plan.select(key_columns), key_columns, n_rows)
+        self._log(f"{(~keep_mask).sum()} linhas duplicadas foram removidas. Linhas restantes: {keep_mask.sum()}", LogLevel.SUCCESS)
+        if self.key_index is not None:
+            index_columns = key_columns + (["Origem"] if "Origem" in consolidated_plan.collect_schema().names() else [])
+            keep_mask = self._apply_key_index(keep_mask, consolidated_plan.select(index_columns).collect(engine="streaming"))
+        duplicate_rows = pl.select(pl.int_range(0, keep_mask.len(), dtype=pl.UInt64).filter(~keep_mask)).to_series()
+        if duplicate_rows.is_empty():
+            return consolidated_plan
+        return (consolidated_plan.with_row_index("__linha__")
+                .filter(~pl.col("__linha__").cast(pl.UInt64).is_in(duplicate_rows.implode()))
+                .drop("__linha__"))
+
+    def _pivot_requested(self) -> bool:
+        return bool(_pivot_definitions(self.pivot_rules))
+
+    def _isolate_failing_sources(self, plans, descriptions):
+        """
+        No modo lazy, os arquivos só são lidos por inteiro na execução do plano final. Se ela
+        falhar, cada plano é gravado sozinho (em streaming) em um fragmento Parquet: apenas as
+        fontes com erro são puladas, e as demais seguem a partir dos seus fragmentos.
+        Retorna (planos, descrições) das fontes válidas.
+        """
+        valid_plans, valid_descriptions = [], []
+        for index, (plan, description) in enumerate(zip(plans, descriptions)):
+            fragment_path = os.path.join(self.fragment_dir, f"isolada_{index:05d}.parquet")
+            try:
+                plan.sink_parquet(fragment_path)
+            except Exception as e:
+                self._log(f"Erro ao processar (ler/mapear/tipar) {description}: {e}. Fonte ignorada.", LogLevel.ERROR)
+                continue
+            valid_plans.append(pl.scan_parquet(fragment_path))
+            valid_descriptions.append(description)
+        return valid_plans, valid_descriptions
+
+    def _compute_pivots(self, input_plans, column_names, streaming=False, source_descriptions=None):
+        """
+        Calcula todas as tabelas de resumo em uma única passada pelos planos informados (um
+        por fonte, ou o consolidado), combinando agregados parciais. Com source_descriptions
+        (planos lazy, um por fonte), uma falha isola as fontes com erro e o cálculo é refeito
+        com as demais. Retorna [(nome, group_by, DataFrame)], ou None se não houver regra
+        válida ou em caso de erro.
+        """
+        pivot_definitions = _pivot_definitions(self.pivot_rules)
+        self._log(f"Criando {len(pivot_definitions)} Tabela(s) de Resumo...", LogLevel.INFO)
+        try:
+            pivot_specs = []
+            for definition in pivot_definitions:
+                rules = _pivot_rules_for_schema(definition['aggregations'], column_names, self._log)
+                if rules:
+                    pivot_specs.append((definition, rules))
+            if not pivot_specs:
+                return None
+            pivot_groups = [(definition['group_by'], rules) for definition, rules in pivot_specs]
+            try:
+                pivot_dfs = pl.collect_all(_build_pivot_plans(input_plans, pivot_groups), engine="streaming" if streaming else "auto")
+            except Exception as e_sources:
+                if not source_descriptions:
+                    raise
+                self._log(f"Falha ao ler as fontes do resumo ({e_sources}). Lendo as fontes uma a uma para isolar o erro...", LogLevel.WARNING)
+                input_plans, _ = self._isolate_failing_sources(input_plans, source_descriptions)
+                if not input_plans:
+                    raise
+                pivot_dfs = pl.collect_all(_build_pivot_plans(input_plans, pivot_groups), engine="streaming" if streaming else "auto")
+            self._log("Tabela(s) de resumo criada(s) com sucesso.", LogLevel.SUCCESS)
+            return [(definition['name'], definition['group_by'], pivot_df) for (definition, _), pivot_df in zip(pivot_specs, pivot_dfs)]
+        except Exception as e_pivot:
+            self._log(f"Erro ao criar tabela de resumo: {e_pivot}. O resultado do resumo não será salvo.", LogLevel.ERROR)
+            return None
+
+    def _pivot_output_path(self, index, pivot_name) -> str:
+        """Arquivo de cada tabela de resumo em CSV/Parquet: a primeira no arquivo de saída, as demais ao lado dele."""
+        if index == 0:
+            return self.output_path
+        stem, extension = os.path.splitext(self.output_path)
+        safe_name = re.sub(r'[<>:"/\\|?*]', "_", pivot_name)
+        return f"{stem}_{safe_name}{extension}"
+
+    def _sink_consolidated(self, consolidated_plan):
+        """
+        Grava o plano consolidado direto no arquivo de saída, em lotes, pelo motor de streaming
+        do Polars. As fontes chegam como fragmentos Parquet gravados lote a lote na leitura,
+        então nenhuma fonte precisa estar inteira na memória.
+        """
+        self._log(f"Gravando em streaming: {self.output_path}", LogLevel.INFO)
+        try:
+            if self.output_format == "CSV":
+                consolidated_plan.sink_csv(self.output_path, separator='|')
+            else:
+                consolidated_plan.sink_parquet(self.output_path, compression='zstd')
+        except Exception as e:
+            self._log(f"Erro ao gravar em streaming: {e}", LogLevel.ERROR)
+            self._finish(False, f"Erro ao salvar: {e}")
+            return
+        self._commit_key_index()
+        self._progress(100)
+        self._log(f"Concluído! Salvo em: {self.output_path}", LogLevel.SUCCESS)
+        self._finish(True, f"Salvo em: {self.output_path}")
+
+    def run(self):
+        try:
+            self._log("Iniciando processo de consolidação...", LogLevel.INFO)
+            if self.engine_mode == "streaming":
+                blockers = self._streaming_blockers()
+                if blockers:
+                    self._log(f"Streaming indisponível ({', '.join(blockers)}). Usando o motor lazy.", LogLevel.WARNING)
+                    self.engine_mode = "lazy"
+            # Fragmentos ficam ao lado da saída: mesmo disco, que já precisa comportar o resultado
+            self.fragment_dir = tempfile.mkdtemp(prefix=".dataflow_fragmentos_", dir=os.path.dirname(os.path.abspath(self.output_path)))
+            self._log(f"Motor de consolidação: {self.engine_mode}.", LogLevel.INFO)
+            try:
+                self.key_index = self._open_key_index(self.duplicates_config.get("key_columns", []))
+            except ValueError as e:
+                self._log(str(e), LogLevel.ERROR)
+                self._finish(False, str(e))
+                return
+            sources = []
+            for file_path, selected_sheets in self.files_to_process:
+                sheets_to_iterate = selected_sheets if selected_sheets is not None else [None]
+                sources.extend((file_path, sheet_name) for sheet_name in sheets_to_iterate)
+            if not sources:
+                self._log("Nenhum item válido para processar.", LogLevel.WARNING)
+                self._finish(False, "Nenhum item para processar.")
+                return
+
+            # --- Leitura, Mapeamento, Tipagem, Filtros e Origem (um plano por arquivo/aba) ---
+            if self.incremental_dir:
+                source_plans = self._ingest_incremental(sources)
+            else:
+                # No modo incremental, os fragmentos persistentes já servem de entrada para o streaming
+                fragment_paths = [os.path.join(self.fragment_dir, f"fonte_{index:05d}.parquet") for index in range(len(sources))] if self.engine_mode == "streaming" else None
+                source_plans = self._ingest_sources(sources, fragment_paths)
+            source_descriptions = [_describe_source(*source) for source, plan in zip(sources, source_plans) if plan is not None]
+            source_plans = [plan for plan in source_plans if plan is not None]
+
+            if not self.is_running:
+                 self._log("Consolidação cancelada.", LogLevel.WARNING)
+                 self._finish(False, "Cancelado"); return
+
+            if not source_plans:
+                self._log("Nenhum dado após processamento.", LogLevel.WARNING)
+                self._finish(False, "Nenhum dado processado."); return
+
+            # --- Harmonização de Tipos (Pós-Tipagem do Usuário e Mapeamento) ---
+            # O schema global sai só dos schemas das fontes (sem ler dados); cada plano recebe
+            # apenas as conversões de que precisa e as colunas ausentes já como nulos tipados.
+            self._log("Harmonizando tipos (2ª passagem) entre arquivos processados...", LogLevel.INFO)
+            source_schemas = [plan.collect_schema() for plan in source_plans]
+            column_order, global_target_types, type_conflicts = _resolve_global_schema(source_schemas)
+            for col_name, reason in type_conflicts:
+                self._log(f"Coluna '{col_name}': tipos diferentes entre as fontes. Tipo alvo global {reason}.", LogLevel.INFO)
+
+            harmonized_plans = []
+            total_casts = total_missing = adjusted_sources = 0
+            for plan, schema in zip(source_plans, source_schemas):
+                harmonized_plan, cast_count, missing_count = _harmonize_plan(plan, schema, column_order, global_target_types)
+                harmonized_plans.append(harmonized_plan)
+                total_casts += cast_count
+                total_missing += missing_count
+                adjusted_sources += harmonized_plan is not plan
+            self._log(f"Esquema global: {len(column_order)} coluna(s), {len(type_conflicts)} com conflito de tipo. "
+                      f"{adjusted_sources} de {len(source_plans)} fonte(s) ajustada(s): {total_casts} conversão(ões) "
+                      f"e {total_missing} coluna(s) ausente(s) preenchida(s) com nulos.", LogLevel.INFO)
+            # --- Fim Harmonização (2ª passagem) ---
+
+            self._log("Concatenando dados processados...", LogLevel.INFO)
+            try:
+                consolidated_plan, consolidated_columns = _concat_source_plans(harmonized_plans)
+                # No modo lazy, uma fonte com erro só aparece na execução: ela é isolada e pulada
+                lazy_descriptions = source_descriptions if self.engine_mode == "lazy" else None
+
+                key_columns = self.duplicates_config.get("key_columns", [])
+                # Sem remoção de duplicatas, o resumo é agregado fonte a fonte e os parciais combinados
+                pivot_input_plans = harmonized_plans if not key_columns else None
+                pivot_tables = None # [(nome, group_by, DataFrame)] das tabelas de resumo
+                pivot_attempted = False
+
+                if self.engine_mode == "streaming":
+                    if key_columns:
+                        consolidated_plan = self._drop_duplicates_streaming(consolidated_plan, key_columns)
+                    if self._pivot_requested():
+                        # Em CSV/Parquet, apenas o resumo é gravado: o detalhe nunca é materializado
+                        pivot_tables = self._compute_pivots(pivot_input_plans or [consolidated_plan], consolidated_columns, streaming=True)
+                        pivot_attempted = True
+                    if pivot_tables is None:
+                        self._sink_consolidated(consolidated_plan)
+                        return
+                    consolidated_df = None
+                else:
+                    # O detalhe só é necessário se for gravado: XLSX sem "apenas resumo", ou sem resumo
+                    detail_needed = not self._pivot_requested() or (self.output_format == "XLSX" and not self.pivot_rules.get("only_pivot", False))
+                    if not detail_needed and pivot_input_plans is not None:
+                        pivot_tables = self._compute_pivots(pivot_input_plans, consolidated_columns, source_descriptions=lazy_descriptions)
+                        pivot_attempted = True
+                        detail_needed = pivot_tables is None # Sem resumo, o detalhe volta a ser a saída
+
+                    consolidated_df = None
+                    if detail_needed or key_columns:
+                        # Única materialização do plano completo (no modo lazy, é aqui que os arquivos são lidos)
+                        if self.engine_mode == "lazy":
+                            self._log("Executando o plano de consolidação...", LogLevel.INFO)
+                        try:
+                            consolidated_df = consolidated_plan.collect()
+                        except Exception as e_collect:
+                            if not lazy_descriptions:
+                                raise
+                            self._log(f"Falha ao executar o plano de consolidação ({e_collect}). Lendo as fontes uma a uma para isolar o erro...", LogLevel.WARNING)
+                            harmonized_plans, _ = self._isolate_failing_sources(harmonized_plans, lazy_descriptions)
+                            if not harmonized_plans:
+                                raise
+                            consolidated_df = _concat_source_plans(harmonized_plans)[0].collect()
+                
+                # --- Remoção de duplicatas ---
+                removed_duplicates_df = None
+                generate_report = self.duplicates_config.get("generate_report", False)
+                if key_columns and consolidated_df is not None: # No streaming, já removidas na gravação
+                    self._log(f"Removendo duplicatas com base nas chaves: {', '.join(key_columns)}...", LogLevel.INFO)
+                    # Uma única passada sobre o hash das chaves; mantidas e removidas saem da mesma máscara
+                    keep_mask = self._duplicate_mask(consolidated_df.lazy(), key_columns, consolidated_df.height)
+                    self._log(f"{(~keep_mask).sum()} linhas duplicadas foram removidas. Linhas restantes: {keep_mask.sum()}", LogLevel.SUCCESS)
+                    keep_mask = self._apply_key_index(keep_mask, consolidated_df)
+                    if generate_report and self.output_format == "XLSX": # A aba de removidas só existe no XLSX
+                        removed_duplicates_df = consolidated_df.filter(~keep_mask)
+                    consolidated_df = consolidated_df.filter(keep_mask)
+                    if removed_duplicates_df is not None and not removed_duplicates_df.is_empty():
+                        self._log(f"Uma aba com as {removed_duplicates_df.height} linhas removidas será gerada.", LogLevel.INFO)
+                
+                # --- Aplicar Regras da Tabela de Resumo (Pivot) ---
+                if self._pivot_requested() and not pivot_attempted:
+                    pivot_tables = self._compute_pivots([consolidated_df.lazy()], consolidated_df.columns)
+                # --- FIM DO BLOCO DE PIVOT --
+            except Exception as e: 
+                 self._log(f"Erro concatenação final: {e}", LogLevel.ERROR)
+                 self._finish(False, f"Erro concatenação: {e}"); return
+            if self.output_format == "XLSX":
+                illegal_xml_chars_re = r"[\u0000-\u0008\u000B\u000C\u000E-\u001F]"
+                # Sanitiza ambos os dataframes
+                if consolidated_df is not None:
+                    consolidated_df = consolidated_df.with_columns(
+                        pl.col(pl.String).str.replace_all(illegal_xml_chars_re, "")
+                    )
+                if pivot_tables is not None:
+                    pivot_tables = [(pivot_name, group_by_cols, pivot_df.with_columns(
+                        pl.col(pl.String).str.replace_all(illegal_xml_chars_re, "")
+                    )) for pivot_name, group_by_cols, pivot_df in pivot_tables]
+            
+            self._log(f"Salvando: {self.output_path}", LogLevel.INFO)
+            only_pivot = self.pivot_rules.get("only_pivot", False)
+
+            if self.output_format == "XLSX":
+                try:
+                    import xlsxwriter
+                    # constant_memory: cada linha é descarregada no disco assim que a próxima começa
+                    workbook = xlsxwriter.Workbook(self.output_path, {'use_zip64': True, 'constant_memory': True, 'nan_inf_to_errors': True})
+                    
+                    # Formatos
+                    header_format = workbook.add_format({'font_name': 'Aptos', 'bold': True, 'font_color': 'white', 'bg_color': '#000000', 'border': 1, 'align': 'center', 'valign': 'vcenter'})
+                    data_format = workbook.add_format({'font_name': 'Aptos'})
+                    group_by_header_format = workbook.add_format({'font_name': 'Aptos', 'bold': True, 'font_color': 'white', 'bg_color': '#000000', 'border': 1, 'align': 'center', 'valign': 'vcenter'})
+
+                    self.rows_to_write = (consolidated_df.height if consolidated_df is not None and not only_pivot else 0) + sum(pivot_df.height for _, _, pivot_df in pivot_tables or [])
+                    self.rows_written = 0
+
+                    # 1. Escrever as Tabelas de Resumo, se existirem (uma aba por tabela)
+                    used_sheet_names = {"dados_consolidados", "duplicatas_removidas"}
+                    for pivot_name, group_by_cols, pivot_df in pivot_tables or []:
+                        sheet_name = _xlsx_sheet_name(pivot_name, used_sheet_names)
+                        self._log(f"Escrevendo aba '{sheet_name}'...", LogLevel.INFO)
+                        header_formats = [group_by_header_format if col_name in group_by_cols else header_format for col_name in pivot_df.columns]
+                        max_lengths_pivot = _estimate_column_widths(pivot_df, self.width_sample_rows)
+                        self._write_xlsx_sheet(workbook, sheet_name, pivot_df, header_formats, data_format, max_lengths_pivot, autofilter=False)
+                    if not only_pivot:
+                        # 2. Escrever os Dados Consolidados 
+                        self._log("Escrevendo aba(s) de 'Dados_Consolidados'...", LogLevel.INFO)
+                        max_lengths_consolidated = _estimate_column_widths(consolidated_df, self.width_sample_rows)
+                        if removed_duplicates_df is not None and not removed_duplicates_df.is_empty():
+                            self._log("Escrevendo aba 'Duplicatas_Removidas'...", LogLevel.INFO)
+                            duplicates_header_format = workbook.add_format({'font_name': 'Aptos', 'bold': True, 'font_color': 'white', 'bg_color': '#C00000', 'border': 1, 'align': 'center', 'valign': 'vcenter'}) # Cabeçalho vermelho
+                            max_lengths_duplicates = _estimate_column_widths(removed_duplicates_df, self.width_sample_rows)
+                            for sheet_name, df_chunk in _split_for_xlsx_sheets(removed_duplicates_df, "Duplicatas_Removidas"):
+                                self._write_xlsx_sheet(workbook, sheet_name, df_chunk, [duplicates_header_format] * df_chunk.width, data_format, max_lengths_duplicates)
+
+                        for sheet_name, df_chunk in _split_for_xlsx_sheets(consolidated_df, "Dados_Consolidados"):
+                            self._write_xlsx_sheet(workbook, sheet_name, df_chunk, [header_format] * df_chunk.width, data_format, max_lengths_consolidated)
+                        
+                        self._progress_text(f"Finalizando escrita de {self.rows_to_write:,} linhas...")
+                    workbook.close()
+
+                except Exception as e_save_excel:
+                    self._log(f"Erro ao salvar arquivo Excel com XlsxWriter: {e_save_excel}", LogLevel.ERROR)
+                    self._finish(False, f"Erro ao salvar Excel: {e_save_excel}")
+                    return
+
+            elif self.output_format in ["CSV", "Parquet"]:
+                # Com resumo, apenas as tabelas de resumo são gravadas (uma por arquivo)
+                outputs = [(self._pivot_output_path(index, pivot_name), pivot_df) for index, (pivot_name, _, pivot_df) in enumerate(pivot_tables)] if pivot_tables is not None else [(self.output_path, consolidated_df)]
+                for output_path, df_to_save in outputs:
+                    if pivot_tables is not None:
+                        self._log(f"Salvando resultado da Tabela de Resumo em {self.output_format}: {output_path}", LogLevel.INFO)
+                    if self.output_format == "CSV":
+                        df_to_save.write_csv(output_path, separator='|')
+                    elif self.output_format == "Parquet":
+                        df_to_save.write_parquet(output_path, compression='zstd')
+
+            # O detalhe é gravado no XLSX sem "apenas resumo" e, em CSV/Parquet, quando não há resumo
+            self._commit_key_index(detail_written=not only_pivot if self.output_format == "XLSX" else pivot_tables is None)
+            self._progress(100)
+            self._log(f"Concluído! Salvo em: {self.output_path}", LogLevel.SUCCESS)
+            self._finish(True, f"Salvo em: {self.output_path}")
+
+        except Exception as e:
+            self._log(f"Erro inesperado consolidação: {e}", LogLevel.ERROR)
+            self._finish(False, f"Erro: {e}")
+        finally:
+            if self.fragment_dir:
+                shutil.rmtree(self.fragment_dir, ignore_errors=True)
+                self.fragment_dir = None
+
+    def stop(self): # stop() permanece o mesmo
+        self.is_running = False
+        self._log("Tentativa de parada da consolidação solicitada...", LogLevel.INFO)
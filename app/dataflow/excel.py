@@ -0,0 +1,654 @@
+"""
+Leitores de planilhas Excel (.xlsx/.xls) com motor plugável.
+
+O motor padrão é o mais rápido disponível: calamine (via fastexcel), que lê .xlsx e .xls.
+Sem ele, arquivos .xlsx são lidos pelo openpyxl em modo read_only, linha a linha e em
+lotes. Uma pasta de trabalho é aberta uma única vez (ExcelWorkbook) e atende a todas as
+suas abas: os nomes das abas, a pré-leitura do cabeçalho e a leitura dos dados usam o
+mesmo arquivo aberto (ZIP, strings compartilhadas e estilos interpretados uma só vez).
+
+As leituras são brutas: sem cabeçalho, com as colunas nomeadas column_1, column_2, ... e
+sem descartar linhas em branco, para que cada linha do DataFrame seja uma linha da aba.
+As bibliotecas de Excel só são importadas quando uma pasta de trabalho é aberta.
+"""
+import os
+import zipfile
+import itertools
+import threading
+import posixpath
+import importlib.util
+from abc import ABC, abstractmethod
+import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+import polars as pl
+
+# Motores de leitura, do mais rápido para o mais lento
+EXCEL_ENGINES = ("calamine", "openpyxl")
+
+# Linhas usadas pelo calamine para inferir o tipo de cada coluna (o mesmo padrão do pl.read_excel)
+CALAMINE_SCHEMA_SAMPLE_ROWS = 100
+
+# Linhas da pré-leitura que definem as colunas de uma aba (a mesma pré-leitura da detecção de cabeçalho)
+HEAD_ROWS = 20
+
+# Linhas do XML da aba, além da pré-leitura, examinadas para achar a faixa de colunas quando
+# <dimension> não existe ou vai além das colunas da pré-leitura (motores sem a faixa do calamine)
+USED_COLUMNS_SAMPLE_ROWS = 1000
+
+# Linhas por lote na leitura em streaming do openpyxl
+OPENPYXL_BATCH_ROWS = 50_000
+
+# Arquivos lidos ao mesmo tempo na listagem das abas (leitura leve: só o índice de abas)
+SHEET_NAMES_MAX_WORKERS = 8
+
+# Pastas de trabalho mantidas abertas por thread (as abas de um arquivo são lidas em sequência)
+WORKBOOK_CACHE_SIZE = 2
+
+def available_excel_engines(file_path=None) -> list:
+    """Motores instalados capazes de ler o arquivo (ou qualquer planilha, sem file_path), do mais rápido ao mais lento."""
+    engines = []
+    if importlib.util.find_spec("fastexcel"):
+        engines.append("calamine")
+    if (file_path is None or file_path.lower().endswith(".xlsx")) and importlib.util.find_spec("openpyxl"):
+        engines.append("openpyxl")
+    return engines
+
+def resolve_excel_engine(file_path, engine=None) -> str:
+    """Motor usado para o arquivo: o informado, se disponível para ele, senão o mais rápido disponível."""
+    engines = available_excel_engines(file_path)
+    if not engines:
+        raise ValueError(f"Nenhum leitor de Excel disponível para '{os.path.basename(file_path)}'. Instale fastexcel (ou openpyxl para .xlsx).")
+    return engine if engine in engines else engines[0]
+
+def _xml_tag(element) -> str:
+    """Nome do elemento XML sem o namespace (o OOXML estrito usa outros namespaces)."""
+    return element.tag.rsplit("}", 1)[-1]
+
+def _xlsx_part_path(base_part, target) -> str:
+    """Caminho, dentro do ZIP, do alvo de uma relação da parte base_part."""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+def _xlsx_relationships(archive, part) -> dict:
+    """Relações de uma parte do pacote: {id: (tipo, caminho do alvo)}."""
+    rels_part = posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+    if rels_part not in archive.NameToInfo:
+        return {}
+    return {rel.get("Id"): (rel.get("Type", ""), _xlsx_part_path(part, rel.get("Target", "")))
+            for rel in ElementTree.fromstring(archive.read(rels_part))}
+
+def _xlsx_workbook_index(archive):
+    """
+    Índice da pasta de trabalho (xl/workbook.xml, localizado pelo diretório central do ZIP):
+    (caminho da parte, [(aba, id da relação)], sistema de datas 1904). A leitura para no
+    fim da lista de abas; planilhas, estilos e strings não são abertos.
+    """
+    workbook_part = "xl/workbook.xml"
+    if workbook_part not in archive.NameToInfo:
+        # Caminho não padrão: segue a relação officeDocument do pacote
+        package_rels = _xlsx_relationships(archive, "")
+        workbook_part = next(target for rel_type, target in package_rels.values() if rel_type.endswith("/officeDocument"))
+    sheets = []
+    date1904 = False
+    with archive.open(workbook_part) as workbook_xml:
+        for event, element in ElementTree.iterparse(workbook_xml, events=("end",)):
+            tag = _xml_tag(element)
+            if tag == "sheet":
+                rel_id = next((value for key, value in element.attrib.items() if key.endswith("}id")), None)
+                sheets.append((element.get("name"), rel_id))
+            elif tag == "workbookPr":
+                date1904 = element.get("date1904", "0").lower() in ("1", "true")
+            elif tag == "sheets":
+                break # O restante (nomes definidos, cálculo) não interessa
+            element.clear()
+    return workbook_part, sheets, date1904
+
+def _xlsx_sheet_names(file_path) -> list:
+    """Nomes das abas de um .xlsx lidos só do índice da pasta de trabalho."""
+    with zipfile.ZipFile(file_path) as archive:
+        return [sheet_name for sheet_name, _ in _xlsx_workbook_index(archive)[1]]
+
+def _xls_sheet_names(file_path) -> list:
+    """Nomes das abas de um .xls lidos só do diretório BIFF (registros BOUNDSHEET), sem carregar as planilhas."""
+    if not importlib.util.find_spec("xlrd"):
+        # Sem xlrd, a lista vem do calamine (que interpreta o arquivo inteiro)
+        resolve_excel_engine(file_path)
+        import fastexcel
+        return list(fastexcel.read_excel(file_path).sheet_names)
+    import xlrd
+    workbook = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        return workbook.sheet_names()
+    finally:
+        workbook.release_resources()
+
+_sheet_names_cache = {} # {(caminho, tamanho, data de modificação): [abas]}
+
+def read_sheet_names(file_path) -> list:
+    """Nomes das abas de um arquivo Excel, em cache pela impressão digital do arquivo (tamanho e data de modificação)."""
+    stat = os.stat(file_path)
+    cache_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    sheet_names = _sheet_names_cache.get(cache_key)
+    if sheet_names is None:
+        sheet_names = _xls_sheet_names(file_path) if file_path.lower().endswith(".xls") else _xlsx_sheet_names(file_path)
+        _sheet_names_cache[cache_key] = sheet_names
+    return list(sheet_names)
+
+def iter_sheet_names(file_paths, max_workers=SHEET_NAMES_MAX_WORKERS):
+    """
+    Lê os nomes das abas de vários arquivos ao mesmo tempo e devolve, na ordem de entrada,
+    (arquivo, abas, erro) - com abas = [] e a exceção em erro quando a leitura falha.
+    Interromper a iteração cancela as leituras ainda não iniciadas.
+    """
+    file_paths = list(file_paths)
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(file_paths))))
+    try:
+        futures = [pool.submit(read_sheet_names, file_path) for file_path in file_paths]
+        for file_path, future in zip(file_paths, futures):
+            try:
+                yield file_path, future.result(), None
+            except Exception as e:
+                yield file_path, [], e
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def open_workbook(file_path, engine=None) -> "ExcelWorkbook":
+    """Abre a pasta de trabalho com o motor informado (ou o mais rápido disponível)."""
+    engine = resolve_excel_engine(file_path, engine)
+    if engine == "calamine":
+        return _CalamineWorkbook(file_path)
+    return _OpenpyxlWorkbook(file_path)
+
+# Formatos internos de data e hora do Excel (numFmtId), com a mesma regra do calamine
+_BUILTIN_DATE_FORMAT_IDS = {14, 15, 16, 17, 18, 19, 20, 21, 22, 45, 46, 47}
+
+def _is_date_format(format_code: str) -> bool:
+    """
+    Se um formato de número personalizado é de data/hora (mesma regra do calamine): procura
+    d, m, y, h ou s fora de aspas, colchetes e caracteres escapados, ou AM/PM, ou horas
+    decorridas ([h], [m], [s]). Só a primeira seção (antes de ';') é considerada.
+    """
+    escaped = in_quotes = am_pm = elapsed = False
+    brackets = 0
+    previous = " "
+    for char in format_code:
+        if escaped:
+            escaped = False
+        elif char in "_\\":
+            escaped = True
+        elif in_quotes:
+            in_quotes = char != '"'
+        elif char == '"':
+            in_quotes = True
+        elif char == ";":
+            return False
+        elif char == "[":
+            brackets += 1
+        elif char == "]":
+            if brackets == 1 and elapsed:
+                return True
+            brackets = max(0, brackets - 1)
+        elif brackets == 0 and not am_pm and char in "aA":
+            am_pm = True
+        elif brackets == 0 and am_pm and char in "pmPM/":
+            return True
+        elif brackets == 0 and not am_pm and char in "dmhysDMHYS":
+            return True
+        elif not (elapsed and char.lower() == previous.lower()):
+            elapsed = previous == "[" and char in "mhsMHS"
+        previous = char
+    return False
+
+def _datetime_text(value: datetime) -> str:
+    """Data e hora no formato de texto do calamine (milissegundos só quando houver)."""
+    text = value.strftime("%Y-%m-%d %H:%M:%S")
+    return f"{text}.{value.microsecond // 1000:03d}" if value.microsecond else text
+
+def _number_text(value: float) -> str:
+    """Número no formato de texto do calamine: até 9 casas decimais, sem zeros à direita nem notação científica."""
+    return f"{value:.9f}".rstrip("0").rstrip(".")
+
+def _serial_datetime_text(serial: float, date1904: bool) -> str:
+    """Data serial do Excel como texto, com a mesma conversão do calamine (inclusive o 29/02/1900 fictício)."""
+    if date1904:
+        serial += 1462
+    elif serial < 60:
+        serial += 1
+    try:
+        return _datetime_text(datetime(1899, 12, 30) + timedelta(milliseconds=round(serial * 86_400_000)))
+    except OverflowError:
+        return _number_text(serial)
+
+def _column_index(cell_reference: str) -> int:
+    """Posição (a partir de 0) da coluna de uma referência de célula como 'AB12'."""
+    index = 0
+    for char in cell_reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - 64)
+    return index - 1
+
+class _XlsxPackage:
+    """
+    Leitura direta (ZIP + XML) do início das abas de um .xlsx: só as primeiras linhas da
+    aba, os estilos de data e o prefixo necessário da tabela de strings compartilhadas são
+    interpretados, e cada parte uma única vez por pasta de trabalho. Os textos seguem o
+    formato do calamine (números, datas e booleanos), de modo que a amostra é a mesma
+    que o calamine produziria.
+    """
+    def __init__(self, file_path):
+        self._archive = zipfile.ZipFile(file_path)
+        self._workbook_part, sheets, self._date1904 = _xlsx_workbook_index(self._archive)
+        relationships = _xlsx_relationships(self._archive, self._workbook_part)
+        self._sheet_parts = {sheet_name: relationships.get(rel_id, ("", None))[1] for sheet_name, rel_id in sheets}
+        parts_by_type = {rel_type.rsplit("/", 1)[-1]: target for rel_type, target in relationships.values()}
+        self._styles_part = parts_by_type.get("styles")
+        self._shared_strings_part = parts_by_type.get("sharedStrings")
+        self._date_styles = None
+        self._shared_strings = []
+        self._shared_strings_reader = None
+        self._dimensions = {} # {aba: referência de <dimension>}
+
+    def close(self):
+        if self._shared_strings_reader is not None:
+            self._shared_strings_reader.close()
+        self._archive.close()
+
+    def _load_date_styles(self) -> list:
+        """Para cada estilo de célula (cellXfs), se o formato de número é de data/hora."""
+        if self._styles_part is None or self._styles_part not in self._archive.NameToInfo:
+            return []
+        custom_formats = {}
+        format_ids = []
+        in_cell_xfs = False
+        with self._archive.open(self._styles_part) as styles_xml:
+            for event, element in ElementTree.iterparse(styles_xml, events=("start", "end")):
+                tag = _xml_tag(element)
+                if event == "start":
+                    in_cell_xfs = in_cell_xfs or tag == "cellXfs"
+                elif tag == "numFmt":
+                    custom_formats[int(element.get("numFmtId", -1))] = element.get("formatCode", "")
+                elif tag == "xf" and in_cell_xfs:
+                    format_ids.append(int(element.get("numFmtId", 0)))
+                elif tag == "cellXfs":
+                    break
+        return [_is_date_format(custom_formats[format_id]) if format_id in custom_formats else format_id in _BUILTIN_DATE_FORMAT_IDS
+                for format_id in format_ids]
+
+    def _iter_shared_strings(self):
+        with self._archive.open(self._shared_strings_part) as shared_strings_xml:
+            for event, element in ElementTree.iterparse(shared_strings_xml, events=("end",)):
+                if _xml_tag(element) == "si":
+                    # Texto simples (<t>) ou rico (<r><t>); a pronúncia (<rPh>) é ignorada
+                    yield "".join(text_element.text or "" for child in element if _xml_tag(child) in ("t", "r")
+                                  for text_element in child.iter() if _xml_tag(text_element) == "t")
+                    element.clear()
+
+    def _shared_string(self, index: int) -> str:
+        """String compartilhada pelo índice, lendo a tabela só até onde for preciso."""
+        if self._shared_strings_reader is None:
+            self._shared_strings_reader = self._iter_shared_strings()
+        while len(self._shared_strings) <= index:
+            self._shared_strings.append(next(self._shared_strings_reader))
+        return self._shared_strings[index]
+
+    def _cell_text(self, cell_type, value_text, style_index):
+        if cell_type == "s":
+            return self._shared_string(int(value_text))
+        if cell_type in ("str", "inlineStr", "d"):
+            return value_text or None
+        if cell_type == "b":
+            return "true" if value_text in ("1", "true") else "false"
+        if cell_type == "e":
+            return None # Erros (#N/D, #DIV/0!...) são lidos como vazios pelo calamine
+        value = float(value_text)
+        if self._date_styles is None:
+            self._date_styles = self._load_date_styles()
+        if style_index < len(self._date_styles) and self._date_styles[style_index]:
+            return _serial_datetime_text(value, self._date1904)
+        return _number_text(value)
+
+    def _iter_rows(self, sheet_name):
+        """
+        Linhas do XML da aba: (índice da linha, [(posição da coluna, tipo, valor, estilo)]),
+        só com as células que têm valor (células de erro contam, como no calamine). A faixa
+        declarada em <dimension> é guardada ao passar por ela.
+        """
+        sheet_part = self._sheet_parts.get(sheet_name)
+        if sheet_part is None:
+            raise ValueError(f"Aba '{sheet_name}' não encontrada.")
+        row_index = -1
+        with self._archive.open(sheet_part) as sheet_xml:
+            for event, element in ElementTree.iterparse(sheet_xml, events=("end",)):
+                tag = _xml_tag(element)
+                if tag == "dimension":
+                    self._dimensions[sheet_name] = element.get("ref")
+                    continue
+                if tag == "sheetData":
+                    break
+                if tag != "row":
+                    continue
+                row_index = int(element.get("r")) - 1 if element.get("r") else row_index + 1
+                cells = []
+                column_index = -1
+                for cell in element:
+                    if _xml_tag(cell) != "c":
+                        continue
+                    column_index = _column_index(cell.get("r")) if cell.get("r") else column_index + 1
+                    cell_type = cell.get("t", "n")
+                    value_text = None
+                    for child in cell:
+                        child_tag = _xml_tag(child)
+                        if child_tag == "v":
+                            value_text = child.text
+                        elif child_tag == "is":
+                            value_text = "".join(text_element.text or "" for text_element in child.iter() if _xml_tag(text_element) == "t")
+                    if value_text is None or (value_text == "" and cell_type != "s"):
+                        continue
+                    cells.append((column_index, cell_type, value_text, int(cell.get("s", 0))))
+                element.clear()
+                yield row_index, cells
+
+    def read_rows(self, sheet_name, n_rows):
+        """
+        As n_rows primeiras linhas da aba, a partir da primeira linha com algum valor (como o
+        calamine): (índice dessa linha na aba, [{posição da coluna: texto}]). A leitura do
+        XML da aba para assim que as n_rows linhas são lidas.
+        """
+        first_row = None
+        rows = {}
+        last_row = None
+        for row_index, cells in self._iter_rows(sheet_name):
+            if first_row is not None and row_index >= first_row + n_rows:
+                # A aba continua: as linhas em branco até n_rows também fazem parte da amostra
+                last_row = first_row + n_rows - 1
+                break
+            if not cells:
+                continue
+            if first_row is None:
+                first_row = row_index
+            # Células de erro contam para a faixa da aba, mas são lidas como vazias
+            texts = ((column_index, self._cell_text(cell_type, value_text, style_index)) for column_index, cell_type, value_text, style_index in cells)
+            rows[row_index] = {column_index: text for column_index, text in texts if text is not None}
+        if first_row is None:
+            return None, []
+        if last_row is None:
+            last_row = max(rows)
+        return first_row, [rows.get(row, {}) for row in range(first_row, last_row + 1)]
+
+    def dimension_columns(self, sheet_name):
+        """(primeira, última) coluna declaradas em <dimension> da aba (lido por read_rows), ou None."""
+        ref = self._dimensions.get(sheet_name)
+        if not ref:
+            return None
+        corners = ref.split(":")
+        return _column_index(corners[0]), _column_index(corners[-1])
+
+    def used_columns(self, sheet_name, n_rows):
+        """
+        (primeira, última) coluna com valor nas n_rows primeiras linhas da aba, a partir da
+        primeira linha com algum valor, ou None. A leitura do XML para nessas linhas.
+        """
+        first_row = None
+        first_column = last_column = None
+        for row_index, cells in self._iter_rows(sheet_name):
+            if not cells:
+                continue
+            if first_row is None:
+                first_row = row_index
+            elif row_index >= first_row + n_rows:
+                break
+            row_columns = [column_index for column_index, _, _, _ in cells]
+            first_column = min(row_columns) if first_column is None else min(first_column, *row_columns)
+            last_column = max(row_columns) if last_column is None else max(last_column, *row_columns)
+        return (first_column, last_column) if first_row is not None else None
+
+class ExcelWorkbook(ABC):
+    """
+    Sessão de leitura de uma pasta de trabalho, aberta uma única vez: nomes das abas,
+    amostra do cabeçalho (read_head) e dados (iter_data/read_sheet) de cada aba. Cada
+    motor implementa a leitura dos dados; a sessão não deve ser usada por duas threads
+    ao mesmo tempo.
+
+    As colunas de uma aba são as da faixa usada da aba inteira, como no calamine (inclusive
+    colunas que só têm valores depois das primeiras linhas): a pré-leitura define essa
+    faixa e os dados são lidos pela posição absoluta das colunas, qualquer que seja o
+    motor. Em .xlsx a pré-leitura é feita direto no XML (_XlsxPackage) e lê apenas as
+    linhas pedidas. Quando a faixa declarada em <dimension> vai além das colunas dessas
+    linhas (ou não existe), vale a faixa do calamine; sem ela, a faixa das primeiras
+    USED_COLUMNS_SAMPLE_ROWS linhas seguintes do XML, sem percorrer a aba inteira.
+    """
+    engine = None
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._package = None
+        self._layouts = {} # {aba: (primeira linha, primeira coluna, número de colunas)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._package is not None:
+            self._package.close()
+
+    def sheet_names(self) -> list:
+        return read_sheet_names(self.file_path)
+
+    def _read_head_rows(self, sheet_name, n_rows):
+        """
+        Primeiras linhas da aba: (índice da primeira linha, [{posição da coluna: texto}],
+        (primeira, última) coluna da faixa usada da aba ou None).
+        """
+        if self._package is None:
+            self._package = _XlsxPackage(self.file_path)
+        first_row, rows = self._package.read_rows(sheet_name, n_rows)
+        if first_row is None:
+            return None, [], None
+        head_columns = [column for row in rows for column in row]
+        dimension_columns = self._package.dimension_columns(sheet_name)
+        if head_columns and dimension_columns and min(head_columns) <= dimension_columns[0] and dimension_columns[1] <= max(head_columns):
+            return first_row, rows, (min(head_columns), max(head_columns))
+        # A faixa declarada vai além das colunas das primeiras linhas (ou não existe): vale a faixa usada da aba
+        return first_row, rows, self._used_columns(sheet_name, n_rows + USED_COLUMNS_SAMPLE_ROWS)
+
+    def _used_columns(self, sheet_name, n_rows):
+        """(primeira, última) coluna com valor nas n_rows primeiras linhas da aba, ou None."""
+        return self._package.used_columns(sheet_name, n_rows)
+
+    def read_head(self, sheet_name, n_rows=HEAD_ROWS) -> pl.DataFrame:
+        """Primeiras n_rows linhas da aba, todas como texto (pré-leitura do cabeçalho)."""
+        first_row, rows, used_columns = self._read_head_rows(sheet_name, n_rows)
+        first_column, last_column = used_columns or (0, -1)
+        n_columns = last_column - first_column + 1
+        self._layouts[sheet_name] = (first_row, first_column, n_columns)
+        return pl.DataFrame({f"column_{i + 1}": [row.get(first_column + i) for row in rows] for i in range(n_columns)},
+                            schema={f"column_{i + 1}": pl.String for i in range(n_columns)})
+
+    def iter_data(self, sheet_name, skip_rows=0, columns=None):
+        """
+        Linhas da aba a partir de skip_rows (contadas da primeira linha da pré-leitura), em
+        lotes com as mesmas colunas. Com columns (posições na pré-leitura), apenas essas
+        colunas são convertidas.
+        """
+        if sheet_name not in self._layouts:
+            self.read_head(sheet_name, HEAD_ROWS)
+        first_row, first_column, n_columns = self._layouts[sheet_name]
+        positions = [first_column + i for i in (range(n_columns) if columns is None else columns)]
+        if first_row is None or not positions:
+            yield pl.DataFrame()
+            return
+        yield from self._iter_positions(sheet_name, first_row + skip_rows, skip_rows, positions)
+
+    @abstractmethod
+    def _iter_positions(self, sheet_name, first_row, skip_rows, positions):
+        """Lotes com as colunas nas posições absolutas informadas, a partir da linha first_row da aba."""
+
+    def read_sheet(self, sheet_name, columns=None) -> pl.DataFrame:
+        """A aba inteira, em um único DataFrame."""
+        batches = list(self.iter_data(sheet_name, 0, columns))
+        return pl.concat(batches) if len(batches) > 1 else batches[0]
+
+def _refine_calamine_dtypes(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Mesmo ajuste de tipos feito pelo pl.read_excel: colunas float só com inteiros viram
+    Int64 e colunas de data e hora só com meia-noite viram Date.
+    """
+    type_checks = []
+    for col_name, dtype in df.schema.items():
+        if dtype.is_float():
+            type_checks.append((pl.col(col_name).floor().eq_missing(pl.col(col_name)) & pl.col(col_name).is_not_nan(), pl.col(col_name).cast(pl.Int64)))
+        elif dtype == pl.Datetime:
+            type_checks.append((pl.col(col_name).dt.time().eq(time(0, 0, 0)), pl.col(col_name).cast(pl.Date)))
+    if not type_checks:
+        return df
+    apply_cast = df.select(check.all(ignore_nulls=True) for check, _ in type_checks).row(0)
+    downcasts = [cast for apply, (_, cast) in zip(apply_cast, type_checks) if apply]
+    return df.with_columns(downcasts) if downcasts else df
+
+class _CalamineWorkbook(ExcelWorkbook):
+    """
+    Leitura pelo calamine (fastexcel). O calamine interpreta a aba inteira a cada leitura,
+    mas só as colunas pedidas são convertidas. O arquivo só é aberto pelo calamine na
+    leitura dos dados (ou na pré-leitura de .xls).
+    """
+    engine = "calamine"
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        self._reader = None
+
+    def _calamine_reader(self):
+        if self._reader is None:
+            import fastexcel
+            self._reader = fastexcel.read_excel(self.file_path)
+        return self._reader
+
+    def _read_head_rows(self, sheet_name, n_rows):
+        if self.file_path.lower().endswith(".xlsx"):
+            return super()._read_head_rows(sheet_name, n_rows)
+        # .xls: o calamine converte só as n_rows linhas (a aba inteira é interpretada)
+        sheet = self._calamine_reader().load_sheet(sheet_name, header_row=None, n_rows=n_rows, dtypes="string")
+        column_positions = [column.absolute_index for column in sheet.selected_columns]
+        rows = [{position: value for position, value in zip(column_positions, row) if value is not None}
+                for row in sheet.to_polars().rows()]
+        if not rows:
+            return None, [], None
+        return 0, rows, (min(column_positions), max(column_positions))
+
+    def _used_columns(self, sheet_name, n_rows):
+        # A faixa do calamine já cobre a aba inteira (o leitor é reaproveitado na leitura dos dados)
+        sheet = self._calamine_reader().load_sheet(sheet_name, header_row=None, n_rows=0, dtypes="string")
+        column_positions = [column.absolute_index for column in sheet.selected_columns]
+        return (min(column_positions), max(column_positions)) if column_positions else None
+
+    def _iter_positions(self, sheet_name, first_row, skip_rows, positions):
+        # Os tipos são inferidos sobre a aba inteira (como no pl.read_excel) antes do corte
+        wanted_positions = set(positions)
+        sheet = self._calamine_reader().load_sheet(
+            sheet_name, header_row=None, schema_sample_rows=CALAMINE_SCHEMA_SAMPLE_ROWS,
+            use_columns=lambda column: column.absolute_index in wanted_positions)
+        df = sheet.to_polars()
+        series_by_position = dict(zip((column.absolute_index for column in sheet.selected_columns), df.get_columns()))
+        # Colunas da pré-leitura que o calamine não encontrou (vazias na aba) ficam nulas
+        df = pl.DataFrame([series_by_position[position].alias(f"column_{i + 1}") if position in series_by_position
+                           else pl.Series(f"column_{i + 1}", [None] * sheet.height, dtype=pl.String)
+                           for i, position in enumerate(positions)])
+        if df.is_empty():
+            df = df.cast({pl.Null: pl.String})
+        yield _refine_calamine_dtypes(df).slice(skip_rows)
+
+# Valores de erro que o openpyxl devolve como texto (o calamine os lê como nulos)
+_EXCEL_ERROR_VALUES = frozenset({"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"})
+
+def _cell_text(value, date1904=False):
+    """Texto de uma célula lida pelo openpyxl, no mesmo formato usado pelo calamine."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return None if value in _EXCEL_ERROR_VALUES else value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return _datetime_text(value)
+    if isinstance(value, time):
+        # Só a hora: o calamine a mostra no dia-base do sistema de datas da pasta de trabalho
+        seconds = value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1_000_000
+        return _serial_datetime_text(seconds / 86_400, date1904)
+    if isinstance(value, timedelta):
+        return _serial_datetime_text(value / timedelta(days=1), date1904)
+    if isinstance(value, float):
+        return _number_text(value)
+    return str(value)
+
+class _OpenpyxlWorkbook(ExcelWorkbook):
+    """
+    Leitura em streaming pelo openpyxl (read_only), somente .xlsx: as linhas são lidas e
+    convertidas em lotes de OPENPYXL_BATCH_ROWS, todas as colunas como texto. O openpyxl
+    (que carrega as strings compartilhadas ao abrir) só é aberto na leitura dos dados.
+    """
+    engine = "openpyxl"
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        self._workbook = None
+
+    def close(self):
+        super().close()
+        if self._workbook is not None:
+            self._workbook.close()
+
+    def _iter_positions(self, sheet_name, first_row, skip_rows, positions, batch_rows=OPENPYXL_BATCH_ROWS):
+        if self._workbook is None:
+            import openpyxl
+            self._workbook = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
+        date1904 = self._workbook.epoch != datetime(1899, 12, 30)
+        rows = self._workbook[sheet_name].iter_rows(min_row=first_row + 1, max_col=max(positions) + 1, values_only=True)
+        schema = {f"column_{i + 1}": pl.String for i in range(len(positions))}
+        while True:
+            batch = list(itertools.islice(rows, batch_rows))
+            # Linhas em branco no fim da aba não contam (o calamine para na última linha com valor)
+            if len(batch) < batch_rows:
+                while batch and all(value is None for value in batch[-1]):
+                    batch.pop()
+            yield pl.DataFrame({column_name: [_cell_text(row[position], date1904) if position < len(row) else None for row in batch]
+                                for column_name, position in zip(schema, positions)}, schema=schema)
+            if len(batch) < batch_rows:
+                break
+
+_workbook_cache = OrderedDict() # {(thread, caminho, tamanho, data de modificação, motor): ExcelWorkbook}
+_workbook_cache_lock = threading.Lock()
+
+def cached_workbook(file_path, engine=None) -> ExcelWorkbook:
+    """
+    Pasta de trabalho aberta e mantida em cache (por thread): as abas de um mesmo arquivo,
+    lidas em sequência, reaproveitam o arquivo já aberto. Feche com close_cached_workbooks().
+    """
+    stat = os.stat(file_path)
+    cache_key = (threading.get_ident(), os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, resolve_excel_engine(file_path, engine))
+    with _workbook_cache_lock:
+        workbook = _workbook_cache.pop(cache_key, None)
+    if workbook is None:
+        workbook = open_workbook(file_path, cache_key[-1])
+    with _workbook_cache_lock:
+        _workbook_cache[cache_key] = workbook
+        thread_keys = [key for key in _workbook_cache if key[0] == cache_key[0]]
+        evicted = [_workbook_cache.pop(key) for key in thread_keys[:-WORKBOOK_CACHE_SIZE]]
+    for old_workbook in evicted:
+        old_workbook.close()
+    return workbook
+
+def close_cached_workbooks():
+    """Fecha as pastas de trabalho em cache desta thread."""
+    thread_id = threading.get_ident()
+    with _workbook_cache_lock:
+        workbooks = [_workbook_cache.pop(key) for key in list(_workbook_cache) if key[0] == thread_id]
+    for workbook in workbooks:
+        workbook.close()
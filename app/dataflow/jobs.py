@@ -0,0 +1,175 @@
+"""
+Definição de job de consolidação (JSON): pasta-modelo, mapeamento de cabeçalhos,
+filtros, resumo, duplicatas, delimitador/codificação e regras de abas.
+
+O job é exportado pela interface ("Arquivo > Exportar Job...") e executado sem Qt pela
+linha de comando. Os arquivos são gravados relativos à pasta, para que o mesmo job
+possa ser aplicado a outra pasta com arquivos de mesmo layout.
+"""
+import os
+import glob
+import json
+from collections import defaultdict
+
+from .engine import (
+    DATA_TYPES_OPTIONS, DEFAULT_CSV_ENCODING, LogLevel, CsvSource, HeaderCache,
+    _detect_header, _describe_source, _header_read_options, _normalize_header_name,
+)
+from .excel import cached_workbook, close_cached_workbooks, iter_sheet_names
+
+JOB_FILE_VERSION = 1
+SUPPORTED_FILE_PATTERNS = ("*.xlsx", "*.csv", "*.xls", "*.txt")
+
+def list_folder_files(folder_path: str) -> list:
+    """Arquivos suportados da pasta, na mesma ordem listada pela interface."""
+    found_files_paths = []
+    for pattern in SUPPORTED_FILE_PATTERNS:
+        found_files_paths.extend(glob.glob(os.path.join(folder_path, pattern)))
+    return found_files_paths
+
+def build_job_definition(folder_path, header_mapping, filter_rules, pivot_rules, duplicates_config, delimiter,
+                         encoding=DEFAULT_CSV_ENCODING, sheet_selection_rules=None, sheet_selections=None,
+                         output_format="XLSX", engine_mode="lazy", incremental=False, width_sample_rows=None) -> dict:
+    """Monta o dicionário (serializável em JSON) do job a partir do estado da interface."""
+    def relative(file_path):
+        return os.path.relpath(file_path, folder_path)
+
+    mapping_entries = [
+        {"column": original_col_name, "file": relative(file_path), "sheet": sheet_name,
+         "final_name": map_info.get("final_name"), "type_str": map_info.get("type_str", DATA_TYPES_OPTIONS[0]),
+         "include": bool(map_info.get("include", False))}
+        for (original_col_name, file_path, sheet_name), map_info in (header_mapping or {}).items()
+    ]
+    sheet_rules = None
+    if sheet_selection_rules:
+        sheet_rules = {"mode": sheet_selection_rules.get("mode", "include"),
+                       "names": sorted(sheet_selection_rules.get("names", []))}
+    return {
+        "version": JOB_FILE_VERSION,
+        "folder": os.path.abspath(folder_path),
+        "delimiter": delimiter,
+        "encoding": encoding,
+        "sheet_rules": sheet_rules,
+        "sheet_selections": {relative(file_path): [sheet for sheet, checked in sheets.items() if checked]
+                             for file_path, sheets in (sheet_selections or {}).items()},
+        "header_mapping": mapping_entries,
+        "filter_rules": list(filter_rules or []),
+        "pivot_rules": dict(pivot_rules or {}),
+        "duplicates_config": dict(duplicates_config or {}),
+        "output": {"format": output_format, "engine_mode": engine_mode, "incremental": bool(incremental),
+                   "width_sample_rows": width_sample_rows},
+    }
+
+def save_job(job_path: str, job: dict):
+    with open(job_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False, indent=4)
+
+def load_job(job_path: str) -> dict:
+    """Lê um job salvo. Levanta ValueError se o arquivo não for um job reconhecido."""
+    with open(job_path, 'r', encoding='utf-8') as f:
+        job = json.load(f)
+    if not isinstance(job, dict) or job.get("version") != JOB_FILE_VERSION:
+        raise ValueError(f"Arquivo de job inválido ou de versão não suportada: {job_path}")
+    width_sample_rows = (job.get("output") or {}).get("width_sample_rows")
+    if width_sample_rows is not None and (type(width_sample_rows) is not int or width_sample_rows < 1):
+        raise ValueError(f"width_sample_rows deve ser um inteiro positivo: {width_sample_rows!r}")
+    return job
+
+def resolve_files_to_process(job: dict, folder_path: str, log) -> list:
+    """
+    Lista [(arquivo, abas ou None)] da pasta, com as mesmas regras da interface: regras
+    globais de abas (incluir/excluir por nome) quando existirem, senão a seleção de abas
+    salva por arquivo. Arquivos Excel sem aba selecionada são pulados.
+    """
+    sheet_rules = job.get("sheet_rules")
+    sheet_selections = job.get("sheet_selections") or {}
+    folder_files = list_folder_files(folder_path)
+    # Com regras de abas, os nomes das abas de todos os arquivos Excel são lidos em paralelo
+    sheet_names_by_file = {}
+    if sheet_rules:
+        excel_paths = [file_path for file_path in folder_files if file_path.lower().endswith((".xlsx", ".xls"))]
+        sheet_names_by_file = {file_path: (file_sheets, error) for file_path, file_sheets, error in iter_sheet_names(excel_paths)}
+    files_to_process = []
+    for file_path in folder_files:
+        file_name = os.path.basename(file_path)
+        if file_path.lower().endswith((".xlsx", ".xls")):
+            selected_sheets = []
+            if sheet_rules:
+                file_sheets, error = sheet_names_by_file[file_path]
+                if error is not None:
+                    log(f"Erro ao ler abas do arquivo {file_name}: {error}", LogLevel.WARNING)
+                    continue
+                rule_names = set(sheet_rules.get("names", []))
+                if sheet_rules.get("mode", "include") == "include":
+                    selected_sheets = [s for s in file_sheets if s in rule_names]
+                else:
+                    selected_sheets = [s for s in file_sheets if s not in rule_names]
+            else:
+                selected_sheets = list(sheet_selections.get(os.path.relpath(file_path, folder_path), []))
+            if not selected_sheets:
+                log(f"Nenhuma aba selecionada para o arquivo Excel '{file_name}'. Será pulado.", LogLevel.INFO)
+                continue
+            files_to_process.append((file_path, selected_sheets))
+        else:
+            files_to_process.append((file_path, None))
+    return files_to_process
+
+def _read_source_header_names(file_path, sheet_name, delimiter, encoding, header_cache, excel_engine=None) -> list:
+    """Nomes de cabeçalho de uma fonte (do cache de análise, se atualizado, ou detectados)."""
+    read_options = _header_read_options(file_path, delimiter, encoding)
+    cached_entry = header_cache.get(file_path, sheet_name, read_options) if header_cache else None
+    if cached_entry:
+        return cached_entry["header_names"]
+    n_preread_rows = 20
+    if file_path.lower().endswith((".csv", ".txt")):
+        with CsvSource(file_path, delimiter, encoding, n_preread_rows) as csv_source:
+            pre_read_df = csv_source.read_head()
+    else:
+        pre_read_df = cached_workbook(file_path, excel_engine).read_head(sheet_name, n_preread_rows)
+    return _detect_header(pre_read_df, n_preread_rows)[1]
+
+def resolve_header_mapping(job: dict, folder_path: str, files_to_process: list, log, header_cache_path=None, excel_engine=None) -> dict:
+    """
+    Converte o mapeamento do job para o formato do ConsolidationJob
+    ({(coluna, arquivo, aba): {final_name, type_str, include}}) na pasta informada.
+
+    Fontes que não constam do job (arquivos novos) são mapeadas pelo nome da coluna:
+    primeiro o nome exato, depois o nome normalizado, desde que todas as entradas do job
+    com esse nome concordem na regra. Colunas sem correspondência ficam de fora.
+    """
+    header_mapping = {}
+    rules_by_name = defaultdict(set)
+    rules_by_normalized_name = defaultdict(set)
+    for entry in job.get("header_mapping", []):
+        rule = (entry.get("final_name"), entry.get("type_str", DATA_TYPES_OPTIONS[0]), bool(entry.get("include", False)))
+        file_path = os.path.join(folder_path, entry["file"])
+        header_mapping[(entry["column"], file_path, entry.get("sheet"))] = {
+            "final_name": rule[0], "type_str": rule[1], "include": rule[2]}
+        rules_by_name[entry["column"]].add(rule)
+        rules_by_normalized_name[_normalize_header_name(entry["column"])].add(rule)
+
+    mapped_sources = {(file_path, sheet_name) for _, file_path, sheet_name in header_mapping}
+    header_cache = HeaderCache(header_cache_path) if header_cache_path else None
+    delimiter = job.get("delimiter", ";")
+    encoding = job.get("encoding", DEFAULT_CSV_ENCODING)
+    for file_path, sheets in files_to_process:
+        for sheet_name in (sheets or [None]):
+            if (file_path, sheet_name) in mapped_sources:
+                continue
+            description = _describe_source(file_path, sheet_name)
+            try:
+                header_names = _read_source_header_names(file_path, sheet_name, delimiter, encoding, header_cache, excel_engine)
+            except Exception as e:
+                log(f"Erro ao ler o cabeçalho de {description}: {e}", LogLevel.WARNING)
+                continue
+            matched_count = 0
+            for original_col_name in header_names:
+                candidate_rules = rules_by_name.get(original_col_name) or rules_by_normalized_name.get(_normalize_header_name(original_col_name))
+                if candidate_rules and len(candidate_rules) == 1:
+                    final_name, type_str, include = next(iter(candidate_rules))
+                    header_mapping[(original_col_name, file_path, sheet_name)] = {
+                        "final_name": final_name, "type_str": type_str, "include": include}
+                    matched_count += 1
+            log(f"{description} não consta do job: {matched_count} de {len(header_names)} coluna(s) mapeadas pelo nome.", LogLevel.INFO)
+    close_cached_workbooks()
+    return header_mapping
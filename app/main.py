@@ -2,12 +2,10 @@ import sys
 import os
 import glob
 import polars as pl
-import openpyxl 
-import xlrd
 import json
-import re
-from unidecode import unidecode
-from collections import defaultdict, Counter
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
@@ -15,150 +13,62 @@ from PySide6.QtWidgets import (
     QComboBox, QProgressBar, QTextEdit, QFileDialog, QTabWidget, 
     QTableView, QDialogButtonBox, QTableWidget, QDialog, QTableWidgetItem,
     QCheckBox, QHeaderView, QScrollArea, QGroupBox, QAbstractItemView, QStyle,
-    QInputDialog
+    QInputDialog, QSpinBox, QMessageBox
 )
 from PySide6.QtCore import Qt, QThread, Signal , QAbstractTableModel
 from PySide6.QtGui import QColor, QPalette, QIcon, QAction, QTextCursor
 from PySide6.QtSvgWidgets import QSvgWidget
 from PySide6.QtWidgets import QRadioButton
-from enum import Enum
-
-# Definir os tipos de dados que o usuário pode escolher
-DATA_TYPES_OPTIONS = ["Automático/String", "Inteiro", "Decimal (Float)", "Data", "Booleano"]
-# Mapeamento para tipos Polars (pode ser um dict global ou dentro do worker)
-TYPE_STRING_TO_POLARS = {
-    "Automático/String": pl.String,
-    "Inteiro": pl.Int64,
-    "Decimal (Float)": pl.Float64,
-    "Data": pl.Date, # ou pl.Datetime se precisar de hora
-    "Booleano": pl.Boolean
-}
-# --- Constantes para as Opções de Filtro ---
-OPERATOR_OPTIONS = [
-    "Igual a",
-    "Diferente de",
-    "Contém",
-    "Não contém",
-    "Começa com",
-    "Termina com",
-    "Maior que",
-    "Menor que",
-    "Entre",
-    "Está em branco",
-    "Não está em branco",
-]
-# Operadores que não precisam de um campo de valor
-OPERATORS_NO_VALUE = {"Está em branco", "Não está em branco"}
 
-CONFIG_FILE_NAME = "config_consolidador.json" # Nome do arquivo de configuração
+from dataflow.engine import (
+    ConsolidationJob, CsvSource, DATA_TYPES_OPTIONS, DEFAULT_CSV_ENCODING, DEFAULT_MAX_WORKERS, DEFAULT_PIVOT_NAME,
+    HEADER_CACHE_FILE_NAME, HeaderCache, LogLevel, OPERATORS_NO_VALUE, OPERATOR_OPTIONS, OPERATOR_VALUE_FILE,
+    PROFILE_DTYPES, _detect_header, _detect_headers, _profile_columns, _header_read_options, _incremental_store_dir,
+    _normalize_header_name, _pivot_definitions, _read_sheet_names,
+)
+from dataflow.excel import available_excel_engines, iter_sheet_names, open_workbook
+from dataflow.jobs import build_job_definition, save_job
+
+# Codificações de leitura para .CSV e .TXT (rótulo na interface -> encoding do Polars)
+# Apenas UTF-8 é lido nativamente pelo Polars (scan_csv); as demais são decodificadas em Python.
+CSV_ENCODING_OPTIONS = {
+    "Latin-1 (ISO-8859-1)": "latin-1",
+    "UTF-8": "utf8-lossy",
+}
 
-def _normalize_header_name(header_name: str) -> str:
-    if not isinstance(header_name, str):
-        header_name = str(header_name)
-    
-    # 1. Remove acentos (ex: "Endereço" -> "Endereco")
-    text = unidecode(header_name)
-    # 2. Converte para minúsculas
-    text = text.lower()
-    # 3. Substitui separadores comuns por espaço (para depois lidar com "valorICMS" vs "valor_ICMS")
-    text = re.sub(r'[._-]+', ' ', text)
-    # 4. Adiciona espaço antes de letras maiúsculas (camelCase -> camel Case)
-    text = re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', text)
-    # 5. Remove todos os caracteres não alfanuméricos e junta tudo
-    text = re.sub(r'[^a-z0-9]', '', text)
-    return text
-
-def _find_header_row_index(df_sample: pl.DataFrame, max_rows_to_check: int = 20) -> int:
-    """
-    Analisa as primeiras N linhas de um DataFrame e retorna o índice da linha
-    que tem a maior probabilidade de ser o cabeçalho, usando uma heurística de
-    transição de tipos.
-    """
-    best_score = -999
-    header_row_index = 0
-    rows_to_check = min(df_sample.height, max_rows_to_check)
-
-    # Nós só podemos checar até a penúltima linha, pois sempre olhamos para a linha seguinte
-    for i in range(rows_to_check - 1):
-        row_current = df_sample.row(i)
-        row_next = df_sample.row(i + 1)
-        
-        # --- Cálculo da Pontuação da Linha Atual (baseado na lógica anterior) ---
-        base_score = 0
-        string_count = 0
-        null_count = 0
-        numeric_string_count = 0
-        
-        for value in row_current:
-            if value is None: null_count += 1
-            elif isinstance(value, str) and value.strip():
-                string_count += 1
-                if value.strip().isnumeric(): numeric_string_count += 1
-        
-        num_cells = len(row_current)
-        non_null_cells = num_cells - null_count
+# Modos do motor de consolidação (rótulo na interface -> modo do ConsolidationWorker)
+ENGINE_MODE_OPTIONS = {
+    "Lazy (otimizado)": "lazy",
+    "Eager (arquivo a arquivo)": "eager",
+    "Streaming (CSV/Parquet, baixa memória)": "streaming",
+}
 
-        if non_null_cells == 0:
-            base_score = -100
-        else:
-            uniqueness_ratio = len(set(v for v in row_current if v is not None)) / non_null_cells
-            string_ratio = string_count / non_null_cells
-            numeric_string_ratio = numeric_string_count / non_null_cells
-            base_score += uniqueness_ratio * 3
-            base_score += string_ratio * 3
-            base_score -= numeric_string_ratio * 5
-            base_score -= (null_count / num_cells) * 2
-
-        # --- NOVA HEURÍSTICA: Pontuação por Transição de Tipos ---
-        transition_score = 0
-        for j in range(num_cells):
-            type_current = type(row_current[j])
-            type_next = type(row_next[j])
-            
-            # Recompensa fortemente a transição de Texto para Número
-            if type_current is str and type_next in (int, float):
-                transition_score += 1
-            # Penaliza levemente se os tipos são iguais (exceto None)
-            elif type_current is not None and type_current == type_next:
-                transition_score -= 0.2
-
-        transition_bonus = (transition_score / num_cells) * 5 # Bônus forte
-        
-        # Combina as pontuações
-        final_score = base_score + transition_bonus
-        
-        if final_score > best_score:
-            best_score = final_score
-            header_row_index = i
-            
-    return header_row_index
+# Leitores de planilhas Excel (rótulo na interface -> motor; None usa o mais rápido instalado)
+EXCEL_ENGINE_OPTIONS = {
+    "Automático": None,
+    "Calamine (rápido)": "calamine",
+    "openpyxl (só .xlsx)": "openpyxl",
+}
 
-def _make_headers_unique(header_names: list) -> list:
-    """
-    Garante que todos os nomes de cabeçalho em uma lista sejam únicos
-    """
-    counts = Counter(header_names)
-    duplicates = {name for name, count in counts.items() if count > 1}
-    if not duplicates:
-            return header_names
-    new_headers = []
-    running_counts = Counter()
-    for name in header_names:
-        if name in duplicates:
-            running_counts[name] += 1
-            new_headers.append(f"{name}_{running_counts[name]}")
-        else:
-            new_headers.append(name)
-    return new_headers
+CONFIG_FILE_NAME = "config_consolidador.json" # Nome do arquivo de configuração
 
-class LogLevel(Enum):
-    INFO = "[INFO]"
-    WARNING = "[AVISO]"
-    ERROR = "[ERRO]"
-    SUCCESS = "[SUCESSO]"
+def _get_app_dir() -> str:
+    """Pasta da aplicação, onde ficam a configuração e os caches."""
+    # Salvar na pasta do usuário (mais robusto) ou na pasta da aplicação
+    # Usar AppData ou .config no Linux/macOS é o ideal, mas para simplicidade:
+    try:
+        # Tenta obter o diretório do script
+        return os.path.dirname(os.path.abspath(sys.argv[0]))
+    except:
+        # Fallback para o diretório de trabalho atual se sys.argv[0] não for confiável (ex: PyInstaller one-file)
+        return os.getcwd()
 
 class PivotDialog(QDialog):
-    """Um diálogo para configurar a operação de tabela dinâmica (pivot)."""
+    """
+    Um diálogo para configurar as tabelas de resumo (pivot). Cada tabela tem nome,
+    agrupamento e cálculos próprios; todas são calculadas na mesma consolidação e
+    gravadas em abas (XLSX) ou arquivos (CSV/Parquet) separados.
+    """
     def __init__(self, all_headers, numeric_headers, existing_rules=None, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Configurar Tabela de Resumo (Dinâmica)")
@@ -168,9 +78,32 @@ class PivotDialog(QDialog):
         self.numeric_headers = numeric_headers
         self.operations = ["Soma", "Média", "Contagem", "Mínimo", "Máximo", "Contagem Única"]
 
+        # Tabelas configuradas ({name, group_by, aggregations}) e a exibida nos widgets
+        self.pivot_tables = [{"name": DEFAULT_PIVOT_NAME, "group_by": [], "aggregations": []}]
+        self.current_table_index = 0
+
         # Layout Principal
         main_layout = QVBoxLayout(self)
 
+        # --- SEÇÃO DE TABELAS ---
+        tables_box = QGroupBox("Tabelas de Resumo")
+        tables_layout = QHBoxLayout(tables_box)
+        tables_layout.addWidget(QLabel("Tabela:"))
+        self.table_combo = QComboBox()
+        self.table_combo.addItem(DEFAULT_PIVOT_NAME)
+        self.table_combo.currentIndexChanged.connect(self.switch_table)
+        tables_layout.addWidget(self.table_combo, 1)
+        self.new_table_button = QPushButton("Nova Tabela")
+        self.new_table_button.clicked.connect(self.add_table)
+        tables_layout.addWidget(self.new_table_button)
+        self.rename_table_button = QPushButton("Renomear")
+        self.rename_table_button.clicked.connect(self.rename_table)
+        tables_layout.addWidget(self.rename_table_button)
+        self.remove_table_button = QPushButton("Remover")
+        self.remove_table_button.clicked.connect(self.remove_table)
+        tables_layout.addWidget(self.remove_table_button)
+        main_layout.addWidget(tables_box)
+
         # --- SEÇÃO DE AGRUPAMENTO (COM A MELHORIA DE UI) ---
         group_by_box = QGroupBox("1. Agrupar por (Linhas)")
         group_by_v_layout = QVBoxLayout(group_by_box)
@@ -219,7 +152,7 @@ class PivotDialog(QDialog):
         agg_layout.addWidget(self.agg_table)
         main_layout.addWidget(agg_box)
 
-        self.only_pivot_checkbox = QCheckBox("Gerar apenas a Tabela de Resumo (ignorar dados consolidados na saída)")
+        self.only_pivot_checkbox = QCheckBox("Gerar apenas as Tabelas de Resumo (ignorar dados consolidados na saída)")
         main_layout.addWidget(self.only_pivot_checkbox)
 
         # --- Botões Finais (sem alterações) ---
@@ -233,7 +166,7 @@ class PivotDialog(QDialog):
         if existing_rules:
             self.populate_from_rules(existing_rules)
         else:
-            self.add_aggregation_row()
+            self._show_table(0)
     
     def update_group_by_display(self):
         """NOVO: Atualiza o painel da direita para espelhar a seleção de agrupamento."""
@@ -270,57 +203,129 @@ class PivotDialog(QDialog):
             col_combo.setCurrentText(rule.get("column", ""))
             op_combo.setCurrentText(rule.get("operation", ""))
 
-    def populate_from_rules(self, rules):
-        """Preenche o diálogo com regras existentes."""
-        # Limpa o que já existe
+    def _read_table_widgets(self):
+        """Lê o agrupamento e os cálculos exibidos nos widgets."""
+        group_by_cols = [item.text() for item in self.group_by_list.selectedItems()]
+        
+        aggregations = []
+        for row in range(self.agg_table.rowCount()):
+            col_combo = self.agg_table.cellWidget(row, 0)
+            op_combo = self.agg_table.cellWidget(row, 1)
+            
+            if col_combo and op_combo and col_combo.currentText():
+                aggregations.append({
+                    "column": col_combo.currentText(),
+                    "operation": op_combo.currentText()
+                })
+        return group_by_cols, aggregations
+
+    def _store_current_table(self):
+        """Guarda o conteúdo dos widgets na tabela atualmente exibida."""
+        group_by_cols, aggregations = self._read_table_widgets()
+        self.pivot_tables[self.current_table_index].update(group_by=group_by_cols, aggregations=aggregations)
+
+    def _show_table(self, index):
+        """Exibe nos widgets o agrupamento e os cálculos da tabela `index`."""
+        self.current_table_index = index
+        table = self.pivot_tables[index]
         self.group_by_list.clearSelection()
         while self.agg_table.rowCount() > 0:
             self.agg_table.removeRow(0)
 
-        # Popula agrupamentos
-        for item_text in rules.get("group_by", []):
+        for item_text in table["group_by"]:
             items = self.group_by_list.findItems(item_text, Qt.MatchExactly)
             if items:
                 items[0].setSelected(True)
-        
         self.update_group_by_display()
-        # Popula agregações
-        for rule in rules.get("aggregations", []):
+
+        for rule in table["aggregations"]:
             self.add_aggregation_row(rule)
+        if not table["aggregations"]:
+            self.add_aggregation_row() # Adiciona uma linha em branco
+        self.remove_table_button.setEnabled(len(self.pivot_tables) > 1)
+
+    def _reset_tables(self, tables):
+        """Substitui todas as tabelas do diálogo e exibe a primeira."""
+        self.pivot_tables = tables
+        self.table_combo.blockSignals(True)
+        self.table_combo.clear()
+        self.table_combo.addItems([table["name"] for table in tables])
+        self.table_combo.setCurrentIndex(0)
+        self.table_combo.blockSignals(False)
+        self._show_table(0)
+
+    def switch_table(self, index):
+        if index < 0 or index == self.current_table_index:
+            return
+        self._store_current_table()
+        self._show_table(index)
+
+    def _ask_table_name(self, title, suggested_name, ignored_index=None):
+        """Pede um nome de tabela não usado (exceto pela tabela `ignored_index`). Retorna None se o usuário cancelar."""
+        name, ok = QInputDialog.getText(self, title, "Nome da tabela de resumo:", text=suggested_name)
+        name = name.strip()
+        if not ok or not name:
+            return None
+        used_names = {table["name"] for i, table in enumerate(self.pivot_tables) if i != ignored_index}
+        if name in used_names:
+            QMessageBox.warning(self, "Nome em uso", f"Já existe uma tabela chamada '{name}'.")
+            return None
+        return name
+
+    def add_table(self):
+        name = self._ask_table_name("Nova Tabela de Resumo", f"{DEFAULT_PIVOT_NAME}_{len(self.pivot_tables) + 1}")
+        if name is None:
+            return
+        self._store_current_table()
+        self.pivot_tables.append({"name": name, "group_by": [], "aggregations": []})
+        self.table_combo.addItem(name)
+        self.table_combo.setCurrentIndex(len(self.pivot_tables) - 1)
+
+    def rename_table(self):
+        name = self._ask_table_name("Renomear Tabela de Resumo", self.pivot_tables[self.current_table_index]["name"], self.current_table_index)
+        if name is None:
+            return
+        self.pivot_tables[self.current_table_index]["name"] = name
+        self.table_combo.setItemText(self.current_table_index, name)
+
+    def remove_table(self):
+        if len(self.pivot_tables) <= 1:
+            return
+        self._store_current_table()
+        del self.pivot_tables[self.current_table_index]
+        self._reset_tables(self.pivot_tables)
+
+    def populate_from_rules(self, rules):
+        """Preenche o diálogo com regras existentes (uma ou várias tabelas)."""
+        tables = _pivot_definitions(rules) or [{"name": DEFAULT_PIVOT_NAME, "group_by": [], "aggregations": []}]
+        self._reset_tables(tables)
         self.only_pivot_checkbox.setChecked(rules.get("only_pivot", False))
         
 
     def clear_rules(self):
-        """Limpa todas as seleções e regras no diálogo."""
-        self.group_by_list.clearSelection()
-        while self.agg_table.rowCount() > 0:
-            self.agg_table.removeRow(0)
-        self.add_aggregation_row() # Adiciona uma linha em branco
+        """Limpa todas as tabelas, seleções e regras no diálogo."""
+        self._reset_tables([{"name": DEFAULT_PIVOT_NAME, "group_by": [], "aggregations": []}])
         
     def get_rules(self):
-        """Lê os widgets e retorna um dicionário com as regras de pivot."""
-        group_by_cols = [item.text() for item in self.group_by_list.selectedItems()]
-        
-        aggregations = []
-        for row in range(self.agg_table.rowCount()):
-            col_combo = self.agg_table.cellWidget(row, 0)
-            op_combo = self.agg_table.cellWidget(row, 1)
-            
-            if col_combo and op_combo and col_combo.currentText():
-                aggregations.append({
-                    "column": col_combo.currentText(),
-                    "operation": op_combo.currentText()
-                })
-        
-        # Só retorna regras se o usuário definiu agrupamentos e agregações
-        if not group_by_cols or not aggregations:
+        """
+        Lê os widgets e retorna um dicionário com as regras de pivot. Uma única tabela com o
+        nome padrão usa o formato antigo ({group_by, aggregations, only_pivot}); várias
+        tabelas usam {"pivots": [...], "only_pivot"}.
+        """
+        self._store_current_table()
+        # Só mantém as tabelas em que o usuário definiu agrupamentos e agregações
+        tables = [dict(table) for table in self.pivot_tables if table["group_by"] and table["aggregations"]]
+        if not tables:
             return {}
 
-        return {
-            "group_by": group_by_cols,
-            "aggregations": aggregations,
-            "only_pivot": self.only_pivot_checkbox.isChecked() 
-        }
+        only_pivot = self.only_pivot_checkbox.isChecked()
+        if len(tables) == 1 and tables[0]["name"] == DEFAULT_PIVOT_NAME:
+            return {
+                "group_by": tables[0]["group_by"],
+                "aggregations": tables[0]["aggregations"],
+                "only_pivot": only_pivot
+            }
+        return {"pivots": tables, "only_pivot": only_pivot}
 
 class FilterDialog(QDialog):
     def __init__(self, final_headers, existing_filters=None, parent=None):
@@ -388,24 +393,28 @@ class FilterDialog(QDialog):
         and_label = QLabel(" e ")
         value2_edit = QLineEdit()
         value2_edit.setPlaceholderText("Valor Máximo")
+        browse_button = QPushButton("..."); browse_button.setFixedWidth(30)
+        browse_button.setToolTip("Selecionar o arquivo com a lista de valores (CSV, TXT ou Parquet; primeira coluna).")
         
         remove_button = QPushButton("X"); remove_button.setFixedWidth(30)
         
         row_layout.addWidget(column_combo)
         row_layout.addWidget(operator_combo)
         row_layout.addWidget(value1_edit)
+        row_layout.addWidget(browse_button)
         row_layout.addWidget(and_label)
         row_layout.addWidget(value2_edit)
         row_layout.addWidget(remove_button)
 
         # Guarda as referências aos widgets da linha para fácil acesso
-        row_widgets = {"widget": row_widget, "op_combo": operator_combo, "val1": value1_edit, "and_label": and_label, "val2": value2_edit}
+        row_widgets = {"widget": row_widget, "op_combo": operator_combo, "val1": value1_edit, "browse": browse_button, "and_label": and_label, "val2": value2_edit}
         self.filter_rows.append(row_widgets)
 
         self.filters_layout.addWidget(row_widget)
 
         # Conecta o botão de remover
         remove_button.clicked.connect(lambda: self.remove_filter_row(row_widgets))
+        browse_button.clicked.connect(lambda: self._browse_value_file(row_widgets))
         # Conecta a mudança do operador à lógica de visibilidade
         operator_combo.currentTextChanged.connect(lambda text: self._on_operator_changed(text, row_widgets))
         
@@ -426,11 +435,21 @@ class FilterDialog(QDialog):
         """Ajusta a visibilidade dos campos de valor com base no operador."""
         is_between = (text == "Entre")
         is_no_value = (text in OPERATORS_NO_VALUE)
+        is_value_file = (text == OPERATOR_VALUE_FILE)
         
         row_widgets["val1"].setVisible(not is_no_value)
+        row_widgets["val1"].setPlaceholderText("Arquivo com os valores (CSV, TXT ou Parquet)" if is_value_file else "Valor")
+        row_widgets["browse"].setVisible(is_value_file)
         row_widgets["and_label"].setVisible(is_between)
         row_widgets["val2"].setVisible(is_between)
 
+    def _browse_value_file(self, row_widgets):
+        """Seleciona o arquivo com a lista de valores do operador "Está na lista (arquivo)"."""
+        file_path, _ = QFileDialog.getOpenFileName(self, "Selecionar Lista de Valores", os.path.dirname(row_widgets["val1"].text()),
+                                                   "Listas de valores (*.csv *.txt *.parquet);;Todos os arquivos (*)")
+        if file_path:
+            row_widgets["val1"].setText(file_path)
+
     def remove_filter_row(self, row_widget):
         """Remove uma linha de filtro da interface e da nossa lista de referência."""
         if row_widget in self.filter_rows:
@@ -461,619 +480,25 @@ class FilterDialog(QDialog):
         return rules
 
 class ConsolidationWorker(QThread):
+    """Executa o ConsolidationJob em segundo plano, repassando o andamento como sinais Qt."""
     progress_updated = Signal(int) 
     log_message = Signal(str, LogLevel) 
     finished = Signal(bool, str) 
     progress_text_updated = Signal(str)
 
-    def __init__(self, files_to_process, output_path, output_format, header_mapping, filter_rules, delimiter, pivot_rules, duplicates_config=None):
+    def __init__(self, *args, **kwargs):
         super().__init__()
-        self.files_to_process = files_to_process 
-        self.output_path = output_path
-        self.output_format = output_format
-        self.header_mapping = header_mapping
-        self.filter_rules = filter_rules
-        self.pivot_rules = pivot_rules
-        self.duplicates_config = duplicates_config or {}
-        self.delimiter = delimiter
-        self.is_running = True
+        self.job = ConsolidationJob(*args, **kwargs,
+                                    on_log=self.log_message.emit,
+                                    on_progress=self.progress_updated.emit,
+                                    on_progress_text=self.progress_text_updated.emit,
+                                    on_finished=self.finished.emit)
 
     def run(self):
-        try:
-            self.log_message.emit("Iniciando processo de consolidação...", LogLevel.INFO)
-            all_dataframes_processed = [] 
-            
-            total_items = 0
-            for _, sheets_to_process_for_file in self.files_to_process:
-                if sheets_to_process_for_file is None: total_items += 1
-                else: total_items += len(sheets_to_process_for_file)
-            if total_items == 0:
-                self.log_message.emit("Nenhum item válido para processar.", LogLevel.WARNING)
-                self.finished.emit(False, "Nenhum item para processar.")
-                return
-            processed_items = 0
-
-            for file_path, selected_sheets in self.files_to_process:
-                if not self.is_running: break 
-                file_name = os.path.basename(file_path)
-                sheets_to_iterate = selected_sheets if selected_sheets is not None else [None]
-
-                for sheet_name in sheets_to_iterate:
-                    if not self.is_running: break 
-                    current_item_description = f"'{file_name}'" + (f" - Aba: '{sheet_name}'" if sheet_name else "")
-                    try:
-                        # ETAPA 1: Pré-leitura e Detecção do Cabeçalho
-                        n_preread_rows = 20
-                        header_row_index = 0
-                        header_names = []
-                        
-                        pre_read_df = None
-                        if file_path.lower().endswith((".csv", ".txt")):
-                            pre_read_df = pl.read_csv(source=file_path, has_header=False, n_rows=n_preread_rows, separator=self.delimiter, encoding='latin-1', ignore_errors=True, infer_schema = False, quote_char = None, truncate_ragged_lines = True)
-                        elif file_path.lower().endswith((".xlsx", ".xls")):
-                            pre_read_df = pl.read_excel(source=file_path, sheet_name=sheet_name, has_header = False).head(n_preread_rows)
-
-                        if pre_read_df is not None and not pre_read_df.is_empty():
-                            header_row_index = _find_header_row_index(pre_read_df, n_preread_rows)
-                            header_names_raw = [str(h) if h is not None else f"column_{i}" for i, h in enumerate(pre_read_df.row(header_row_index))]
-                            header_names = _make_headers_unique(header_names_raw)
-                        
-                        # --- LÓGICA DE LEITURA FINAL E ROBUSTA ---
-                        df_original = None
-                        
-                        # Ler o arquivo inteiro como dados brutos, sem cabeçalho
-                        if file_path.lower().endswith((".csv", ".txt")):
-                            df_raw_data = pl.read_csv(source=file_path, has_header=False, separator=self.delimiter, encoding='latin-1', infer_schema = False, ignore_errors = True, quote_char = None, truncate_ragged_lines = True)
-                        elif file_path.lower().endswith((".xlsx", ".xls")):
-                            df_raw_data = pl.read_excel(source=file_path, sheet_name=sheet_name, has_header = False)
-                        
-                        if df_raw_data is not None and not df_raw_data.is_empty():
-                            # Fatiar o DataFrame para remover lixo + linha do cabeçalho
-                            df_data_only = df_raw_data.slice(offset=header_row_index + 1)
-                            
-                            if not df_data_only.is_empty():
-                                # Renomear as colunas com os nomes que detectamos
-                                rename_mapping = {old_name: new_name for old_name, new_name in zip(df_data_only.columns, header_names)}
-                                df_original = df_data_only.rename(rename_mapping)
-
-                        # Sua lógica de fallback para erros de conversão no Excel pode ser integrada aqui se necessário,
-                        # mas esta leitura primária é muito mais estável.
-                        
-                        if df_original is None or df_original.is_empty():
-                            self.log_message.emit(f"Dados vazios ou erro ao ler {current_item_description}. Pulando.", LogLevel.WARNING)
-                            processed_items += 1
-                            continue
-
-                        # --- 1. Aplicar Mapeamento de Nomes e Filtro de Colunas (com Coalesce) ---
-                        df_intermediate = df_original
-                        if self.header_mapping:
-                            # 1. Agrupar colunas de origem por seu nome final de destino
-                            final_name_to_source = defaultdict(list)
-                            for original_col_name in df_original.columns:
-                                source_key = (original_col_name, file_path, sheet_name)
-                                mapping_info = self.header_mapping.get(source_key)
-                                if mapping_info and mapping_info.get("include", False):
-                                    final_name = mapping_info.get("final_name")
-                                    final_name_to_source[final_name].append(original_col_name)
-                            # final_name_to_original_map = {}
-                            # for original_name, mapping_info in self.header_mapping.items():
-                            #     if mapping_info.get("include", False):
-                            #         final_name = mapping_info.get("final_name", original_name)
-                            #         if final_name not in final_name_to_original_map:
-                            #             final_name_to_original_map[final_name] = []
-                            #         final_name_to_original_map[final_name].append(original_name)
-
-                            # 2. Construir as expressões de seleção usando coalesce quando necessário
-                            select_expressions = []
-                            df_original_columns = set(df_original.columns) # Para buscas mais rápidas
-
-                            for final_name, original_cols_list in final_name_to_source.items():
-                                # Filtrar a lista para incluir apenas as colunas que existem no DataFrame atual
-                                # existing_original_cols = [col for col in original_cols_list if col in df_original_columns]
-                                
-                                # if not existing_original_cols:
-                                #     continue # Nenhuma das colunas de origem para este nome final existe neste arquivo/aba
-
-                                # Se apenas uma coluna de origem existe, faz um alias simples.
-                                # Se mais de uma, usa coalesce para combinar os dados.
-                                if not original_cols_list:
-                                    continue
-                                if len(original_cols_list) > 1:
-                                    self.log_message.emit(f"Combinando colunas {original_cols_list} em '{final_name}' para {current_item_description}", LogLevel.INFO)
-                                    expr = pl.coalesce(original_cols_list).alias(final_name)
-                                else:
-                                    self.log_message.emit(f"Combinando colunas {original_cols_list} em '{final_name}' para {current_item_description}", LogLevel.INFO)
-                                    expr = pl.col(original_cols_list[0]).alias(final_name)
-                                
-                                select_expressions.append(expr)
-
-                            # Se, após o mapeamento, não sobrar nenhuma expressão, pular o arquivo/aba
-                            if not select_expressions:
-                                self.log_message.emit(f"Nenhuma coluna do arquivo {current_item_description} corresponde ao mapeamento. Pulando.", LogLevel.WARNING)
-                                processed_items += 1
-                                continue
-
-                            # 3. Executar a seleção no DataFrame
-                            df_intermediate = df_original.select(select_expressions)
-                        
-                        if df_intermediate.width == 0:
-                            self.log_message.emit(f"Nenhuma coluna restante em {current_item_description} após mapeamento de nomes. Pulando.", LogLevel.WARNING)
-                            processed_items += 1; continue
-                        
-                        # --- 2. Aplicar Tipagem Especificada pelo Usuário ---
-                        df_typed = df_intermediate
-                        if self.header_mapping:
-                            # Precisamos iterar sobre as colunas FINAIS do df_intermediate
-                            # e encontrar a regra de tipagem correspondente no header_mapping
-                            # (que é chaveado pelo nome ORIGINAL).
-                            
-                            # Criar um mapa reverso: {final_name: original_name_info_from_mapping}
-                            # ou mais direto: {final_name: type_str_from_mapping}
-                            final_name_to_type_str = {}
-                            for original_h, map_details in self.header_mapping.items():
-                                if map_details.get("include"):
-                                    final_name_to_type_str[map_details.get("final_name", original_h)] = map_details.get("type_str")
-
-                            casting_expressions = []
-                            for final_col_name in df_typed.columns: # Iterar sobre colunas já mapeadas/renomeadas
-                                type_str = final_name_to_type_str.get(final_col_name)
-                                
-                                if type_str and type_str != DATA_TYPES_OPTIONS[0]: # Se não for "Automático/String"
-                                    polars_type = TYPE_STRING_TO_POLARS.get(type_str)
-                                    if polars_type:
-                                        self.log_message.emit(f"Convertendo coluna '{final_col_name}' para {type_str} em {current_item_description}", LogLevel.INFO)
-                                        casting_expressions.append(pl.col(final_col_name).cast(polars_type, strict=False))
-                                    else: # Tipo string não encontrado no mapa (não deve acontecer)
-                                        casting_expressions.append(pl.col(final_col_name)) # Manter como está
-                                else: # "Automático/String" ou tipo não mapeado
-                                    casting_expressions.append(pl.col(final_col_name)) # Manter como está
-                            
-                            if casting_expressions: # Se houver alguma expressão (sempre haverá se df_typed não for vazio)
-                                df_typed = df_typed.select(casting_expressions) # .select() é mais seguro que .with_columns() para recriar
-                    
-                        # --- 4. Aplicar Filtros (com lógica hierárquica E/OU) ---
-                        df_filtered = df_typed
-                        if self.filter_rules:
-                            # from collections import defaultdict
-
-                            # Definir quais operadores são para exclusão
-                            EXCLUSION_OPERATORS = {"Diferente de", "Não contém"}
-
-                            grouped_rules = defaultdict(list)
-                            for rule in self.filter_rules:
-                                if rule.get("column"):
-                                    grouped_rules[rule["column"]].append(rule)
-
-                            final_expressions_to_and = []
-                            df_schema = df_filtered.schema
-
-                            for col_name, rules_for_col in grouped_rules.items():
-                                if col_name not in df_schema:
-                                    continue
-
-                                inclusion_exprs = []
-                                exclusion_exprs = []
-                                col_type = df_schema[col_name]
-
-                                # 1. Separar regras em Inclusão e Exclusão
-                                for rule in rules_for_col:
-                                    operator = rule.get("operator")
-                                    value = rule.get("value") # Pega o valor (pode ser string ou lista)
-
-                                    target_list = exclusion_exprs if operator in EXCLUSION_OPERATORS else inclusion_exprs
-
-                                    # Adicionado para pular regras incompletas
-                                    if operator is None or value is None:
-                                        continue
-                                    
-                                    try:
-                                        polars_col = pl.col(col_name)
-                                        expr = None
-                                        
-                                        if operator in OPERATORS_NO_VALUE:
-                                            if operator == "Está em branco": expr = polars_col.is_null()
-                                            elif operator == "Não está em branco": expr = polars_col.is_not_null()
-                                        
-                                        elif operator == "Entre":
-                                            if isinstance(value, list) and len(value) == 2:
-                                                min_val_str, max_val_str = value
-                                                # Strip é aplicado aqui, onde sabemos que são strings
-                                                if min_val_str.strip() and max_val_str.strip():
-                                                    lit_min = pl.lit(min_val_str.strip()).cast(col_type, strict=False)
-                                                    lit_max = pl.lit(max_val_str.strip()).cast(col_type, strict=False)
-                                                    expr = polars_col.is_between(lit_min, lit_max)
-
-                                        # Garante que o valor é uma string antes de usar o .strip()
-                                        elif isinstance(value, str) and value.strip():
-                                            value_str = value.strip()
-                                            lit_val = pl.lit(value_str).cast(col_type, strict=False)
-
-                                            if operator == "Igual a": expr = (polars_col == lit_val)
-                                            elif operator == "Diferente de": expr = (polars_col != lit_val)
-                                            elif operator == "Maior que": expr = (polars_col > lit_val)
-                                            elif operator == "Menor que": expr = (polars_col < lit_val)
-                                            elif col_type == pl.String:
-                                                if operator == "Contém": expr = polars_col.str.contains(value_str, literal=True)
-                                                elif operator == "Não contém": expr = ~polars_col.str.contains(value_str, literal=True)
-                                                elif operator == "Começa com": expr = polars_col.str.starts_with(value_str)
-                                                elif operator == "Termina com": expr = polars_col.str.ends_with(value_str)
-                                        
-                                        if expr is not None:
-                                            target_list.append(expr)
-
-                                    except Exception as e_filter:
-                                        self.log_message.emit(f"Não foi possível aplicar a regra de filtro '{col_name} {operator} {value}': {e_filter}", LogLevel.WARNING)
-                                
-                                # 2. Construir a expressão final para esta coluna
-                                col_final_expr = None
-                                
-                                # Combinar todas as expressões de inclusão com OU (OR)
-                                final_inclusion_expr = pl.any_horizontal(inclusion_exprs) if len(inclusion_exprs) > 1 else (inclusion_exprs[0] if inclusion_exprs else None)
-                                
-                                # Combinar todas as expressões de exclusão com E (AND)
-                                final_exclusion_expr = pl.all_horizontal(exclusion_exprs) if len(exclusion_exprs) > 1 else (exclusion_exprs[0] if exclusion_exprs else None)
-
-                                # Juntar inclusão e exclusão com E (AND)
-                                if final_inclusion_expr is not None and final_exclusion_expr is not None:
-                                    col_final_expr = final_inclusion_expr & final_exclusion_expr
-                                elif final_inclusion_expr is not None:
-                                    col_final_expr = final_inclusion_expr
-                                elif final_exclusion_expr is not None:
-                                    col_final_expr = final_exclusion_expr
-
-                                if col_final_expr is not None:
-                                    final_expressions_to_and.append(col_final_expr)
-
-                            # 3. Aplicar os filtros finais combinados com E (AND)
-                            if final_expressions_to_and:
-                                rows_before = df_filtered.height
-                                df_filtered = df_filtered.filter(final_expressions_to_and)
-                                rows_after = df_filtered.height
-                                self.log_message.emit(f"Filtro aplicado em {current_item_description}. Linhas restantes: {rows_after} de {rows_before}.", LogLevel.INFO)
-                        
-                        # --- Fim do Bloco de Filtros ---
-
-                        # --- 3. Adicionar Coluna de Origem --- 
-                        file_name_only = os.path.basename(file_path)
-                        source_name = f"{file_name_only} ({sheet_name})" if sheet_name else file_name_only
-                        
-                        df_final_for_list = df_filtered.with_columns( # <-- Usa df_filtered
-                            pl.lit(source_name).alias("Origem")
-                        )
-
-                        all_dataframes_processed.append(df_final_for_list)
-
-                    except Exception as e:
-                        self.log_message.emit(f"Erro ao processar (ler/mapear/tipar) {current_item_description}: {e}", LogLevel.ERROR)
-                    
-                    processed_items += 1
-                    progress = int((processed_items / total_items) * 100) if total_items > 0 else 0
-                    self.progress_updated.emit(progress)
-
-                if not self.is_running: break 
+        self.job.run()
 
-            if not self.is_running:
-                 self.log_message.emit("Consolidação cancelada.", LogLevel.WARNING)
-                 self.finished.emit(False, "Cancelado"); return
-
-            if not all_dataframes_processed:
-                self.log_message.emit("Nenhum dado após processamento.", LogLevel.WARNING)
-                self.finished.emit(False, "Nenhum dado processado."); return
-
-            # --- Harmonização de Tipos (Pós-Tipagem do Usuário e Mapeamento) ---
-            self.log_message.emit("Harmonizando tipos (2ª passagem) entre arquivos processados...", LogLevel.INFO)
-            
-            # 1. Coletar todos os tipos para cada nome de coluna final único
-            #    em todos os DataFrames processados.
-            column_all_types_globally = {} # {final_col_name: set_of_dtypes}
-            for df_processed in all_dataframes_processed:
-                 for col_name, dtype in df_processed.schema.items():
-                     if col_name not in column_all_types_globally:
-                         column_all_types_globally[col_name] = set()
-                     column_all_types_globally[col_name].add(dtype)
-            
-            # 2. Determinar o tipo alvo para cada coluna globalmente
-            global_target_types = {} # {final_col_name: target_polars_type}
-            for final_col_name, dtypes_set in column_all_types_globally.items():
-                is_int_present = any(t.is_integer() for t in dtypes_set)
-                is_float_present = any(t.is_float() for t in dtypes_set)
-                is_string_present = any(t == pl.String or t == pl.Utf8 for t in dtypes_set)
-                is_temporal_present = any(t.is_temporal() for t in dtypes_set)
-                is_boolean_present = any(t == pl.Boolean for t in dtypes_set)
-                is_null_present = any(t == pl.Null for t in dtypes_set) # Null type
-
-                target_type_for_col = None
-
-                # Regra de Prioridade para determinar o tipo alvo:
-                if is_string_present: # Se String estiver presente, tudo vira String
-                    target_type_for_col = pl.String
-                    self.log_message.emit(f"Coluna '{final_col_name}': Tipo alvo global String (devido à presença de String).", LogLevel.INFO)
-                elif is_temporal_present and (is_int_present or is_float_present or is_boolean_present): # Temporal com outros não-string -> String
-                    target_type_for_col = pl.String
-                    self.log_message.emit(f"Coluna '{final_col_name}': Tipo alvo global String (conflito Temporal com Numérico/Booleano).", LogLevel.INFO)
-                elif is_boolean_present and (is_int_present or is_float_present): # Booleano com Numérico -> String
-                    target_type_for_col = pl.String
-                    self.log_message.emit(f"Coluna '{final_col_name}': Tipo alvo global String (conflito Booleano com Numérico).", LogLevel.INFO)
-                elif is_float_present: # Se Float estiver presente (e não String), tudo vira Float
-                    target_type_for_col = pl.Float64
-                    self.log_message.emit(f"Coluna '{final_col_name}': Tipo alvo global Decimal (Float) (devido à presença de Float ou Int+Float).", LogLevel.INFO)
-                elif is_int_present: # Se apenas Int (e talvez Null, Boolean que pode ser Int)
-                    target_type_for_col = pl.Int64 # Se só há Int e Null, pode ser Int. Se Booleano, pode ser Int.
-                    # Se Booleano estiver presente e quisermos ser mais específicos, poderíamos ter mais regras
-                    # Mas Int64 pode acomodar Booleanos como 0/1 se o cast funcionar.
-                    self.log_message.emit(f"Coluna '{final_col_name}': Tipo alvo global Inteiro.", LogLevel.INFO)
-                elif is_temporal_present: # Apenas Temporal (e talvez Null)
-                    # Se houver múltiplos tipos temporais (Date, Datetime, Duration), escolher o mais geral (Datetime?) ou String.
-                    # Por simplicidade, se só Temporal, manter (o primeiro que encontrar, ou o mais comum).
-                    # Para ser seguro, se houver vários tipos temporais, converter para String ou o tipo mais abrangente.
-                    # Esta parte pode precisar de mais refinamento se você tiver mistura de Date, Datetime, etc.
-                    # Vamos pegar o primeiro tipo temporal encontrado como exemplo, ou default para pl.Date.
-                    first_temporal_type = next((t for t in dtypes_set if t.is_temporal()), pl.Date)
-                    target_type_for_col = first_temporal_type
-                    self.log_message.emit(f"Coluna '{final_col_name}': Tipo alvo global {first_temporal_type} (apenas Temporal).", LogLevel.INFO)
-                elif is_boolean_present: # Apenas Booleano (e talvez Null)
-                    target_type_for_col = pl.Boolean
-                    self.log_message.emit(f"Coluna '{final_col_name}': Tipo alvo global Booleano.", LogLevel.INFO)
-                # Se for apenas Null, ou tipos não cobertos, ele permanecerá None, e o cast não será aplicado abaixo
-                # ou podemos definir um default como String.
-                elif is_null_present and len(dtypes_set) == 1: # Apenas Null type
-                     # Deixar como está por enquanto, o concat pode lidar com coluna toda Null.
-                     # Ou, se quisermos ser proativos:
-                     # target_type_for_col = pl.String
-                     # self.log_message.emit(f"Coluna '{final_col_name}': Tipo alvo global String (era apenas Null).", LogLevel.INFO)
-                     pass # Não define target_type, o cast não será aplicado para esta coluna se ela for só Null
-
-                if target_type_for_col:
-                    global_target_types[final_col_name] = target_type_for_col
-            
-            # 3. Aplicar o tipo alvo global a cada DataFrame
-            harmonized_dataframes_final_pass = [] 
-            for df_to_harmonize in all_dataframes_processed:
-                 df_modified_this_pass = df_to_harmonize
-                 
-                 expressions_to_apply = []
-                 for col_name_in_df in df_to_harmonize.columns:
-                     target_type = global_target_types.get(col_name_in_df)
-                     current_type = df_to_harmonize.schema.get(col_name_in_df)
-
-                     if target_type and current_type != target_type:
-                         # Só aplicar cast se o tipo atual for diferente do alvo
-                         expressions_to_apply.append(pl.col(col_name_in_df).cast(target_type, strict=False).alias(col_name_in_df))
-                         self.log_message.emit(f"Aplicando tipo alvo '{target_type}' à coluna '{col_name_in_df}' (era '{current_type}').", LogLevel.INFO)
-                     else:
-                         # Manter a coluna como está (ou porque não há tipo alvo ou já é o tipo alvo)
-                         expressions_to_apply.append(pl.col(col_name_in_df))
-                 
-                 if expressions_to_apply: # Se houver colunas no DF (sempre deve haver se chegou aqui)
-                     df_modified_this_pass = df_to_harmonize.select(expressions_to_apply)
-                 
-                 harmonized_dataframes_final_pass.append(df_modified_this_pass)
-            
-            final_dataframes_to_concat = harmonized_dataframes_final_pass
-            # --- Fim Harmonização (2ª passagem) ---
-            # dataframes_final_pass_no_null_type = []
-            # for df in dataframes_final_pass_no_null_type:
-            #     expression_for_null_cast = []
-            #     needs_null_type_casting = False
-            #     for col_name in df.columns:
-            #         if df[col_name].dtype == pl.Null:
-            #             expression_for_null_cast.append(pl.col(col_name).cast(pl.String).alias(col_name))
-            #             needs_null_type_casting = True
-            #         else:
-            #             expression_for_null_cast.append(pl.col(col_name))
-            #     if needs_null_type_casting and expression_for_null_cast:
-            #         dataframes_final_pass_no_null_type.append(df.select(expression_for_null_cast))
-            #     else:
-            #         final_dataframes_to_concat = dataframes_final_pass_no_null_type
-            self.log_message.emit("Concatenando dados processados...", LogLevel.INFO)
-            try:
-                consolidated_df = pl.concat(final_dataframes_to_concat, how="diagonal")
-                # --- Reordenar Coluna "Origem" para o Final ---
-                if "Origem" in consolidated_df.columns:
-                    # Pega todas as colunas, exceto "Origem"
-                    all_other_columns = [col for col in consolidated_df.columns if col != "Origem"]
-                    # Cria a nova ordem com "Origem" no final
-                    new_column_order = all_other_columns + ["Origem"]
-                    # Seleciona as colunas na nova ordem
-                    consolidated_df = consolidated_df.select(new_column_order)
-                
-                # --- Remoção de duplicatas ---
-                removed_duplicates_df = None
-                key_columns = self.duplicates_config.get("key_columns", [])
-                generate_report = self.duplicates_config.get("generate_report", False)
-                if key_columns:
-                    rows_before = consolidated_df.height
-                    self.log_message.emit(f"Removendo duplicatas com base nas chaves: {', '.join(key_columns)}...", LogLevel.INFO)
-                    df_with_index = consolidated_df.with_row_index("__temp_index__")
-                    unique_rows = df_with_index.unique(subset = key_columns, keep = 'first')
-                    if generate_report:
-                        removed_duplicates_df = df_with_index.join(unique_rows, on = "__temp_index__", how = "anti").drop("__temp_index__")
-                    consolidated_df = unique_rows.drop("__temp_index__")
-                    rows_after = consolidated_df.height
-                    self.log_message.emit(f"{rows_before - rows_after} linhas duplicadas foram removidas. Linhas restantes: {rows_after}", LogLevel.SUCCESS)
-                    if removed_duplicates_df is not None and not removed_duplicates_df.is_empty():
-                        self.log_message.emit(f"Uma aba com as {removed_duplicates_df.height} linhas removidas será gerada.", LogLevel.INFO)
-                
-                # --- Aplicar Regras da Tabela de Resumo (Pivot) ---
-                pivot_df = None # DataFrame para a tabela de resumo
-                if self.pivot_rules and self.pivot_rules.get("group_by") and self.pivot_rules.get("aggregations"):
-                    self.log_message.emit("Criando Tabela de Resumo (em memória)...", LogLevel.INFO)
-                    try:
-                        group_by_cols = self.pivot_rules['group_by']
-                        aggregations = self.pivot_rules['aggregations']
-
-                        op_map = {
-                            "Soma": pl.sum, "Média": pl.mean, "Contagem": pl.count,
-                            "Mínimo": pl.min, "Máximo": pl.max,
-                            "Contagem Única": lambda col: pl.col(col).n_unique()
-                        }
-
-                        agg_expressions = []
-                        for rule in aggregations:
-                            col_name = rule['column']
-                            op_str = rule['operation']
-                            
-                            if col_name not in consolidated_df.columns:
-                                self.log_message.emit(f"Coluna '{col_name}' da regra de resumo não encontrada. Pulando.", LogLevel.WARNING)
-                                continue
-                            
-                            if op_str in op_map:
-                                polars_func = op_map[op_str]
-                                new_col_name = f"{col_name}_{op_str.replace(' ', '_')}"
-                                agg_expressions.append(polars_func(col_name).alias(new_col_name))
-                        
-                        if agg_expressions:
-                            pivot_df = consolidated_df.group_by(group_by_cols).agg(agg_expressions).sort(group_by_cols)
-                            self.log_message.emit("Tabela de resumo criada com sucesso.", LogLevel.SUCCESS)
-
-                    except Exception as e_pivot:
-                        self.log_message.emit(f"Erro ao criar tabela de resumo: {e_pivot}. O resultado do resumo não será salvo.", LogLevel.ERROR)
-                        pivot_df = None
-                # --- FIM DO BLOCO DE PIVOT --
-            except Exception as e: 
-                 self.log_message.emit(f"Erro concatenação final: {e}", LogLevel.ERROR)
-                 self.finished.emit(False, f"Erro concatenação: {e}"); return
-            if self.output_format == "XLSX":
-                illegal_xml_chars_re = r"[\u0000-\u0008\u000B\u000C\u000E-\u001F]"
-                # Sanitiza ambos os dataframes
-                consolidated_df = consolidated_df.with_columns(
-                    pl.col(pl.String).str.replace_all(illegal_xml_chars_re, "")
-                )
-                if pivot_df is not None:
-                    pivot_df = pivot_df.with_columns(
-                        pl.col(pl.String).str.replace_all(illegal_xml_chars_re, "")
-                    )
-            
-            self.log_message.emit(f"Salvando: {self.output_path}", LogLevel.INFO)
-            only_pivot = self.pivot_rules.get("only_pivot", False)
-
-            if self.output_format == "XLSX":
-                try:
-                    import xlsxwriter
-                    workbook = xlsxwriter.Workbook(self.output_path, {'use_zip64': True})
-                    
-                    # Formatos
-                    header_format = workbook.add_format({'font_name': 'Aptos', 'bold': True, 'font_color': 'white', 'bg_color': '#000000', 'border': 1, 'align': 'center', 'valign': 'vcenter'})
-                    data_format = workbook.add_format({'font_name': 'Aptos'})
-                    group_by_header_format = workbook.add_format({'font_name': 'Aptos', 'bold': True, 'font_color': 'white', 'bg_color': '#000000', 'border': 1, 'align': 'center', 'valign': 'vcenter'})
-
-                    total_rows_to_write = consolidated_df.height + (pivot_df.height if pivot_df is not None else 0)
-                    total_rows_written = 0
-
-                    # 1. Escrever a Tabela de Resumo (pivot_df), se existir
-                    if pivot_df is not None:
-                        self.log_message.emit("Escrevendo aba 'Tabela_Resumo'...", LogLevel.INFO)
-                        worksheet_pivot = workbook.add_worksheet("Tabela_Resumo")
-                        worksheet_pivot.freeze_panes('A2')
-                        worksheet_pivot.set_zoom(70)
-                        worksheet_pivot.hide_gridlines(2)
-                        
-                        group_by_cols = self.pivot_rules.get('group_by', [])
-                        for col_idx, col_name in enumerate(pivot_df.columns):
-                            fmt = group_by_header_format if col_name in group_by_cols else header_format
-                            worksheet_pivot.write(0, col_idx, col_name, fmt)
-                        
-                        max_lengths_pivot = {col: max(len(str(col)), pivot_df.select(pl.col(col).cast(pl.String).str.len_chars().max()).item() or 1) for col in pivot_df.columns}
-                        for col_idx, col_name in enumerate(pivot_df.columns):
-                            width = min(max_lengths_pivot.get(col_name, len(col_name)) + 2, 60)
-                            worksheet_pivot.set_column(col_idx, col_idx, width, data_format)
-                        
-                        for r_idx, row_tuple in enumerate(pivot_df.iter_rows(), start=1):
-                            worksheet_pivot.write_row(r_idx, 0, row_tuple)
-                            total_rows_written += 1
-                    if not only_pivot:
-                        # 2. Escrever os Dados Consolidados 
-                        self.log_message.emit("Escrevendo aba(s) de 'Dados_Consolidados'...", LogLevel.INFO)
-                        max_rows_per_sheet = 1_048_570
-                        dfs_to_write = []
-                        if consolidated_df.height > max_rows_per_sheet:
-                            num_chunks = (consolidated_df.height + max_rows_per_sheet - 1) // max_rows_per_sheet
-                            for i in range(num_chunks):
-                                df_chunk = consolidated_df.slice(i * max_rows_per_sheet, max_rows_per_sheet)
-                                dfs_to_write.append((f"Dados_Consolidados_{i+1}", df_chunk))
-                        else:
-                            dfs_to_write.append(("Dados_Consolidados", consolidated_df))
-
-                        max_lengths_consolidated = {col: max(len(str(col)), consolidated_df.select(pl.col(col).cast(pl.String).str.len_chars().max()).item() or 1) for col in consolidated_df.columns}
-                        if removed_duplicates_df is not None and not removed_duplicates_df.is_empty():
-                            self.log_message.emit("Escrevendo aba 'Duplicatas_Removidas'...", LogLevel.INFO)
-                            duplicates_header_format = workbook.add_format({'font_name': 'Aptos', 'bold': True, 'font_color': 'white', 'bg_color': '#C00000', 'border': 1, 'align': 'center', 'valign': 'vcenter'}) # Cabeçalho vermelho
-
-                            # A lógica de chunking é importante aqui também
-                            max_rows_per_sheet = 1_048_570
-                            duplicates_to_write = []
-                            if removed_duplicates_df.height > max_rows_per_sheet:
-                                num_chunks = (removed_duplicates_df.height + max_rows_per_sheet - 1) // max_rows_per_sheet
-                                for i in range(num_chunks):
-                                    duplicates_to_write.append((f"Duplicatas_Removidas_{i+1}", removed_duplicates_df.slice(i * max_rows_per_sheet, max_rows_per_sheet)))
-                            else:
-                                duplicates_to_write.append(("Duplicatas_Removidas", removed_duplicates_df))
-                            
-                            max_lengths_duplicates = {col: max(len(str(col)), removed_duplicates_df.select(pl.col(col).cast(pl.String).str.len_chars().max()).item() or 1) for col in removed_duplicates_df.columns}
-
-                            for sheet_name, df_chunk in duplicates_to_write:
-                                worksheet = workbook.add_worksheet(sheet_name)
-                                worksheet.freeze_panes('A2')
-                                worksheet.set_zoom(70)
-                                worksheet.hide_gridlines(2)
-                                worksheet.write_row('A1', df_chunk.columns, duplicates_header_format)
-                                worksheet.autofilter(0, 0, df_chunk.height, df_chunk.width - 1)
-                                for col_idx, col_name in enumerate(df_chunk.columns):
-                                    worksheet.set_column(col_idx, col_idx, min(max_lengths_duplicates.get(col_name, len(col_name)) + 2, 60), data_format)
-                                for r_idx, row_tuple in enumerate(df_chunk.iter_rows(), start=1):
-                                    worksheet.write_row(r_idx, 0, row_tuple)
-                                    total_rows_written += 1
-                                    if total_rows_written % 5000 == 0:
-                                        self.progress_text_updated.emit(f"Escrevendo linha {total_rows_written:,} de {total_rows_to_write:,}...")
-                                
-                            
-                            # max_lengths_duplicates = {col: max(len(str(col)), removed_duplicates_df.select(pl.col(col).cast(pl.String).str.len_chars().max()).item() or 1) for col in removed_duplicates_df.columns}
-                        for sheet_name, df_chunk in dfs_to_write:
-                            worksheet = workbook.add_worksheet(sheet_name)
-                            worksheet.freeze_panes('A2')
-                            worksheet.set_zoom(70)
-                            worksheet.hide_gridlines(2)
-                            worksheet.write_row('A1', df_chunk.columns, header_format)
-                            worksheet.autofilter(0, 0, df_chunk.height, df_chunk.width - 1)
-                            for col_idx, col_name in enumerate(df_chunk.columns):
-                                width = min(max_lengths_consolidated.get(col_name, len(col_name)) + 2, 60)
-                                worksheet.set_column(col_idx, col_idx, width, data_format)
-                            
-                            for r_idx, row_tuple in enumerate(df_chunk.iter_rows(), start=1):
-                                worksheet.write_row(r_idx, 0, row_tuple)
-                                total_rows_written += 1
-                                if total_rows_written % 5000 == 0:
-                                    self.progress_text_updated.emit(f"Escrevendo linha {total_rows_written:,} de {total_rows_to_write:,}...")
-                        
-                        self.progress_text_updated.emit(f"Finalizando escrita de {total_rows_to_write:,} linhas...")
-                    workbook.close()
-
-                except Exception as e_save_excel:
-                    self.log_message.emit(f"Erro ao salvar arquivo Excel com XlsxWriter: {e_save_excel}", LogLevel.ERROR)
-                    self.finished.emit(False, f"Erro ao salvar Excel: {e_save_excel}")
-                    return
-
-            elif self.output_format in ["CSV", "Parquet"]:
-                df_to_save = pivot_df if pivot_df is not None else consolidated_df
-                if pivot_df is not None:
-                    self.log_message.emit(f"Salvando resultado da Tabela de Resumo em {self.output_format}.", LogLevel.INFO)
-                
-                if self.output_format == "CSV":
-                    df_to_save.write_csv(self.output_path, separator='|')
-                elif self.output_format == "Parquet":
-                    df_to_save.write_parquet(self.output_path, compression='zstd')
-
-            self.progress_updated.emit(100)
-            self.log_message.emit(f"Concluído! Salvo em: {self.output_path}", LogLevel.SUCCESS)
-            self.finished.emit(True, f"Salvo em: {self.output_path}")
-
-        except Exception as e:
-            self.log_message.emit(f"Erro inesperado consolidação: {e}", LogLevel.ERROR)
-            self.finished.emit(False, f"Erro: {e}")
-
-    def stop(self): # stop() permanece o mesmo
-        self.is_running = False
-        self.log_message.emit("Tentativa de parada da consolidação solicitada...", LogLevel.INFO)
+    def stop(self):
+        self.job.stop()
 
 class SheetLoadingWorker(QThread):
     finished = Signal(str, list, str)  # file_path, sheet_names_list, error_message_or_None
@@ -1094,15 +519,8 @@ class SheetLoadingWorker(QThread):
             if not self.is_running: # Checar novamente
                 raise InterruptedError("Carregamento de abas cancelado.")
 
-            if self.file_path.lower().endswith(".xlsx"):
-                # Usar read_only=True para performance, data_only=True para evitar carregar fórmulas complexas se não necessário
-                workbook = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
-                sheet_names_from_file = workbook.sheetnames
-                workbook.close() # É bom fechar o workbook
-            elif self.file_path.lower().endswith(".xls"):
-                workbook = xlrd.open_workbook(self.file_path, on_demand=True)
-                sheet_names_from_file = workbook.sheet_names()
-            # Não precisa de else, pois a thread só é chamada para .xlsx/.xls
+            # A thread só é chamada para .xlsx/.xls
+            sheet_names_from_file = _read_sheet_names(self.file_path)
         except InterruptedError as ie:
             error_message = str(ie)
         except Exception as e:
@@ -1133,28 +551,17 @@ class SheetAnalysisWorker(QThread):
         error_message = None
 
         try:
-            for file_path in self.excel_files_paths:
+            # Só o índice de abas de cada arquivo é lido, vários arquivos ao mesmo tempo
+            for file_path, sheet_names, error in iter_sheet_names(self.excel_files_paths):
                 if not self.is_running:
                     raise InterruptedError("Análise de abas cancelada.")
                 
-                try:
-                    sheet_names = []
-                    # Usamos openpyxl diretamente pois é otimizado para apenas ler nomes de abas
-                    if file_path.lower().endswith(".xlsx"):
-                        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-                        sheet_names = workbook.sheetnames
-                        workbook.close()
-                    elif file_path.lower().endswith(".xls"):
-                        workbook = xlrd.open_workbook(file_path, on_demand=True)
-                        sheet_names = workbook.sheet_names()
-                    
-                    if sheet_names:
-                        all_sheets_cache[file_path] = sheet_names
-                        unique_sheet_names.update(sheet_names)
-
-                except Exception as e:
+                if error is not None:
                     # Loga um erro para um arquivo específico mas continua o processo
-                    print(f"AVISO: Não foi possível ler as abas de '{os.path.basename(file_path)}'. Erro: {e}")
+                    print(f"AVISO: Não foi possível ler as abas de '{os.path.basename(file_path)}'. Erro: {error}")
+                elif sheet_names:
+                    all_sheets_cache[file_path] = sheet_names
+                    unique_sheet_names.update(sheet_names)
             
             if self.is_running:
                 self.finished.emit(all_sheets_cache, unique_sheet_names, None)
@@ -1171,116 +578,156 @@ class SheetAnalysisWorker(QThread):
         self.is_running = False
 
 class HeaderAnalysisWorker(QThread):
-    '''Worker para os cabeçalhos'''
+    '''
+    Worker para os cabeçalhos. As pré-leituras (só as primeiras linhas de cada arquivo/aba)
+    rodam em até max_workers threads, um arquivo por tarefa; cada arquivo é detectado,
+    perfilado e agrupado assim que termina, com o andamento no log. stop() interrompe a
+    análise e descarta as leituras ainda não iniciadas.
+    '''
     finished = Signal(list, object)
     progress_log = Signal(str, LogLevel)
 
-    def __init__(self, files_and_sheets_config, delimiter):
+    def __init__(self, files_and_sheets_config, delimiter, encoding=DEFAULT_CSV_ENCODING, cache_path=None, max_workers=DEFAULT_MAX_WORKERS, excel_engine=None):
         super().__init__()
         self.files_and_sheets_config = files_and_sheets_config
         self.delimiter = delimiter
+        self.encoding = encoding
+        self.excel_engine = excel_engine # None: o leitor de Excel mais rápido instalado
+        self.cache_path = cache_path # Sem caminho, a análise não usa cache
+        self.max_workers = max(1, max_workers)
         self.is_running = True
 
-    def _get_series_profile(self, series: pl.Series):
-        non_null_series = series.filter(series.is_not_null() & (series.str.strip_chars() != ""))
-        if non_null_series.is_empty():
-            return {"dtype": pl.String, "null_ratio": series.is_null().mean()}
-        try:
-            if non_null_series.cast(pl.Int64, strict=True).is_not_null().all():
-                return {"dtype": pl.Int64, "null_ratio": series.is_null().mean()}
-        except (Exception, pl.exceptions.PanicException): pass
-        try:
-            if non_null_series.cast(pl.Float64, strict=True).is_not_null().all():
-                return {"dtype": pl.Float64, "null_ratio": series.is_null().mean()}
-        except (Exception, pl.exceptions.PanicException): pass
-        try:
-            if non_null_series.str.to_datetime(strict=True, exact=False, cache=False).is_not_null().all():
-                return {"dtype": pl.Datetime, "null_ratio": series.is_null().mean()}
-        except (Exception, pl.exceptions.PanicException): pass
-        return {"dtype": pl.String, "null_ratio": series.is_null().mean()}
+    def _fingerprints_from_cache(self, cache_entry, file_path, sheet_name):
+        """Reconstrói os fingerprints das colunas de um arquivo/aba a partir de uma entrada do HeaderCache."""
+        return [{
+            **column,
+            "source_tuple": (column["name"], file_path, sheet_name),
+            "dtype": PROFILE_DTYPES.get(column["dtype"], pl.String),
+        } for column in cache_entry["columns"]]
+
+    def _pre_read_file(self, file_path, sheet_names, n_preread_rows):
+        """Primeiras n_preread_rows linhas de cada aba de um arquivo (roda numa thread do pool): [(aba, pré-leitura ou None)]."""
+        pre_reads = []
+        if file_path.lower().endswith((".csv", ".txt")):
+            with CsvSource(file_path, self.delimiter, self.encoding, n_preread_rows) as csv_source:
+                pre_reads.append((None, csv_source.read_head()))
+        elif file_path.lower().endswith((".xlsx", ".xls")):
+            # O arquivo é aberto uma única vez para todas as suas abas
+            with open_workbook(file_path, self.excel_engine) as workbook:
+                for sheet_name in sheet_names:
+                    if not self.is_running:
+                        break
+                    try:
+                        pre_reads.append((sheet_name, workbook.read_head(sheet_name, n_preread_rows)))
+                    except Exception:
+                        pre_reads.append((sheet_name, None))
+        return pre_reads
+
+    def _profile_source(self, file_path, sheet_name, pre_read_df, header_row_index, header_names, n_sample_rows):
+        """Fingerprints das colunas de uma pré-leitura, a partir do cabeçalho detectado."""
+        data_rows_df = pre_read_df.slice(offset=header_row_index + 1).head(n_sample_rows)
+        if data_rows_df.is_empty():
+            return []
+        sample_df = data_rows_df.rename({old_name: new_name for old_name, new_name in zip(data_rows_df.columns, header_names)})
+
+        try: # <-- INÍCIO DO BLOCO DE BLINDAGEM
+            profiles = _profile_columns(sample_df)
+        except (Exception, pl.exceptions.PanicException) as e_profile: # <-- CAPTURA O "PANIC"
+            # Se a análise falhar, todas as colunas recebem um perfil "seguro"
+            self.progress_log.emit(f"Falha ao analisar as colunas de '{os.path.basename(file_path)}'. Tratando como texto. Erro: {e_profile}", LogLevel.WARNING)
+            profiles = [{"dtype": pl.String, "null_ratio": 0.0, "distinct_ratio": 0.0, # Tipo de dado seguro
+                         "min_length": None, "max_length": None, "date_format": None} for _ in sample_df.columns]
+        return [{
+            **profile,
+            "source_tuple": (col_name, file_path, sheet_name),
+            "normalized_name": _normalize_header_name(col_name),
+        } for col_name, profile in zip(sample_df.columns, profiles)]
 
     def run(self):
         if not self.is_running:
             self.finished.emit([], InterruptedError("Análise cancelada."))
             return
 
-        all_column_fingerprints = []
         n_sample_rows, n_preread_rows = 200, 20
+        # Agrupamento incremental: nome normalizado -> tipo -> [(posição da fonte, posição da coluna, source_tuple)].
+        # As posições vêm da ordem de entrada, então o resultado não depende da ordem de conclusão.
+        groups_by_name = defaultdict(lambda: defaultdict(list))
+
+        def add_fingerprints(source_position, source_fingerprints):
+            for column_position, fp in enumerate(source_fingerprints):
+                type_key = "numeric" if fp["dtype"].is_numeric() else str(fp["dtype"])
+                groups_by_name[fp["normalized_name"]][type_key].append((source_position, column_position, fp["source_tuple"]))
 
+        executor = None
         try:
+            header_cache = HeaderCache(self.cache_path)
+            cached_count = 0
+
+            # 1. Fontes do cache (sem alterações) entram direto; as demais são lidas por arquivo
+            source_positions = {} # (file_path, sheet_name) -> posição na ordem de entrada
+            files_to_read = [] # [(file_path, [abas])]
             for file_path, selected_sheets in self.files_and_sheets_config:
                 if not self.is_running: raise InterruptedError("Análise cancelada.")
-
-                self.progress_log.emit(f"Analisando: {os.path.basename(file_path)}...", LogLevel.INFO)
-                
-                sheets_to_iterate = selected_sheets if selected_sheets is not None else [None]
-                for sheet_name in sheets_to_iterate:
+                sheets_to_read = []
+                for sheet_name in (selected_sheets if selected_sheets is not None else [None]):
+                    source_position = source_positions.setdefault((file_path, sheet_name), len(source_positions))
+                    cache_entry = header_cache.get(file_path, sheet_name, _header_read_options(file_path, self.delimiter, self.encoding, n_preread_rows))
+                    if cache_entry is not None:
+                        add_fingerprints(source_position, self._fingerprints_from_cache(cache_entry, file_path, sheet_name))
+                        cached_count += 1
+                    else:
+                        sheets_to_read.append(sheet_name)
+                if sheets_to_read:
+                    files_to_read.append((file_path, sheets_to_read))
+            if cached_count:
+                self.progress_log.emit(f"{cached_count} arquivo(s)/aba(s) sem alterações reaproveitados do cache de análise.", LogLevel.INFO)
+
+            # 2. Pré-leitura em paralelo; detecção, perfil e agrupamento de cada arquivo assim que ele termina
+            if files_to_read:
+                self.progress_log.emit(f"Lendo o início de {len(files_to_read)} arquivo(s) com até {self.max_workers} leitura(s) em paralelo...", LogLevel.INFO)
+                executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(files_to_read)))
+                futures = {executor.submit(self._pre_read_file, file_path, sheets_to_read, n_preread_rows): file_path
+                           for file_path, sheets_to_read in files_to_read}
+                for completed_count, future in enumerate(as_completed(futures), start=1):
                     if not self.is_running: raise InterruptedError("Análise cancelada.")
+                    file_path = futures[future]
+                    self.progress_log.emit(f"Analisado ({completed_count}/{len(futures)}): {os.path.basename(file_path)}", LogLevel.INFO)
                     try:
-                        pre_read_df = None
-                        if file_path.lower().endswith((".csv", ".txt")):
-                            pre_read_df = pl.read_csv(source=file_path, has_header=False, n_rows=n_preread_rows, separator=self.delimiter, encoding='latin-1', ignore_errors=True, infer_schema = False, truncate_ragged_lines = True, quote_char = None)
-                        elif file_path.lower().endswith((".xlsx", ".xls")):
-                            pre_read_df = pl.read_excel(source=file_path, sheet_name=sheet_name, has_header = False, infer_schema_length = 0).head(n_preread_rows)
-                        
-                        if pre_read_df is None or pre_read_df.is_empty(): continue
-                        
-                        header_row_index = _find_header_row_index(pre_read_df, n_preread_rows)
-                        header_names_raw = [str(h) if h is not None else f"column_{i}" for i, h in enumerate(pre_read_df.row(header_row_index))]
-                        header_names = _make_headers_unique(header_names_raw)
-                        data_rows_df = pre_read_df.slice(offset=header_row_index + 1).head(n_sample_rows)
-                        
-                        if data_rows_df.is_empty(): continue
-                        
-                        rename_mapping = {old_name: new_name for old_name, new_name in zip(data_rows_df.columns, header_names)}
-                        sample_df = data_rows_df.rename(rename_mapping)
-
-                        for col_name in sample_df.columns:
-                            try: # <-- INÍCIO DO BLOCO DE BLINDAGEM
-                                series = sample_df[col_name]
-                                profile = self._get_series_profile(series)
-                                fingerprint = {
-                                    "source_tuple": (col_name, file_path, sheet_name),
-                                    "normalized_name": _normalize_header_name(col_name),
-                                    "dtype": profile["dtype"],
-                                    "null_ratio": profile["null_ratio"],
-                                }
-                            except Exception as e_profile: # <-- CAPTURA O "PANIC"
-                                # Se a análise da coluna falhar, cria um perfil "seguro"
-                                self.progress_log.emit(f"Falha ao analisar coluna '{col_name}' em '{os.path.basename(file_path)}'. Tratando como texto. Erro: {e_profile}", LogLevel.WARNING)
-                                fingerprint = {
-                                    "source_tuple": (col_name, file_path, sheet_name),
-                                    "normalized_name": _normalize_header_name(col_name),
-                                    "dtype": pl.String, # Tipo de dado seguro
-                                    "null_ratio": 0.0,
-                                }
-                            all_column_fingerprints.append(fingerprint)
+                        pre_reads = [(sheet_name, pre_read_df) for sheet_name, pre_read_df in future.result()
+                                     if pre_read_df is not None and not pre_read_df.is_empty()]
                     except Exception:
                         continue
+                    detected_headers = _detect_headers([pre_read_df for _, pre_read_df in pre_reads], n_preread_rows)
+                    read_options = _header_read_options(file_path, self.delimiter, self.encoding, n_preread_rows)
+                    for (sheet_name, pre_read_df), (header_row_index, header_names) in zip(pre_reads, detected_headers):
+                        try:
+                            source_fingerprints = self._profile_source(file_path, sheet_name, pre_read_df, header_row_index, header_names, n_sample_rows)
+                        except Exception:
+                            continue
+                        add_fingerprints(source_positions[(file_path, sheet_name)], source_fingerprints)
+                        header_cache.put(file_path, sheet_name, read_options, header_row_index, header_names, [
+                            {**{key: value for key, value in fp.items() if key != "source_tuple"}, "name": fp["source_tuple"][0], "dtype": str(fp["dtype"])}
+                            for fp in source_fingerprints])
+
+            try:
+                header_cache.save()
+            except Exception as e_cache:
+                self.progress_log.emit(f"Não foi possível salvar o cache de análise: {e_cache}", LogLevel.WARNING)
 
             # --- ALGORITMO DE AGRUPAMENTO DEFINITIVO ---
-            groups_by_name = defaultdict(list)
-            for fp in all_column_fingerprints:
-                groups_by_name[fp["normalized_name"]].append(fp)
-            
+            # Nomes na ordem da primeira coluna de cada um; dentro do nome, um grupo por tipo (numérico junto)
             final_groups = []
-            for normalized_name, fp_list in groups_by_name.items():
-                if len(fp_list) == 1:
-                    final_groups.append([fp_list[0]["source_tuple"]])
-                    continue
-
-                sub_groups_by_type = defaultdict(list)
-                for fp in fp_list:
-                    type_key = "numeric" if fp["dtype"].is_numeric() else str(fp["dtype"])
-                    sub_groups_by_type[type_key].append(fp["source_tuple"])
-                
-                for type_key, source_tuples in sub_groups_by_type.items():
-                    final_groups.append(source_tuples)
+            for sub_groups_by_type in sorted(groups_by_name.values(), key=lambda sub_groups: min(min(members) for members in sub_groups.values())):
+                for members in sorted(sub_groups_by_type.values(), key=min):
+                    final_groups.append([source_tuple for _, _, source_tuple in sorted(members)])
 
             if self.is_running:
                 self.finished.emit(final_groups, None)
         except Exception as e:
             self.finished.emit([], e)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
 
     def stop(self):
         self.is_running = False
@@ -1442,6 +889,10 @@ class HeaderMappingDialog(QDialog):
         self.report_duplicates_checkbox.setChecked(True)
         duplicates_layout.addWidget(self.report_duplicates_checkbox)
 
+        self.key_index_checkbox = QCheckBox("Remover também chaves já emitidas em execuções anteriores (índice de chaves na pasta da saída).")
+        self.key_index_checkbox.setToolTip("As chaves de cada execução bem-sucedida ficam salvas em uma pasta oculta ao lado do arquivo de saída.\nNas próximas consolidações na mesma pasta, apenas registros com chaves novas são gravados.")
+        duplicates_layout.addWidget(self.key_index_checkbox)
+
         self.duplicate_check_list = QListWidget()
         self.duplicate_check_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
         # Popula a lista com os nomes finais sugeridos
@@ -1476,7 +927,8 @@ class HeaderMappingDialog(QDialog):
         generate_report = self.report_duplicates_checkbox.isChecked()
         return {
             "key_columns": key_columns,
-            "generate_report": generate_report
+            "generate_report": generate_report,
+            "use_key_index": self.key_index_checkbox.isChecked()
         }
 
     def populate_table(self):
@@ -1853,6 +1305,13 @@ class MainWindow(QMainWindow):
         self.sheet_selection_rules = {}
         self.all_sheets_cache = {}
         menu_bar = self.menuBar()
+
+        # Menu "Arquivo"
+        file_menu = menu_bar.addMenu("&Arquivo")
+
+        export_job_action = QAction("Exportar Job...", self)
+        export_job_action.triggered.connect(self.export_job_definition)
+        file_menu.addAction(export_job_action)
         
         # Menu "Ajuda"
         help_menu = menu_bar.addMenu("&Ajuda") # O & cria um atalho (Alt+A)
@@ -1966,9 +1425,29 @@ class MainWindow(QMainWindow):
         self.delimiter_custom_edit.setFixedWidth(120)
         self.delimiter_custom_edit.setVisible(False) # Começa oculto
         self.delimiter_combo.currentTextChanged.connect(self._on_delimiter_changed)
+        encoding_label = QLabel("Codificação: ")
+        self.encoding_combo = QComboBox()
+        self.encoding_combo.addItems(list(CSV_ENCODING_OPTIONS.keys()))
+        self.encoding_combo.setToolTip("Arquivos em UTF-8 são lidos diretamente pelo Polars, com menor uso de memória.")
         options_layout.addWidget(delimiter_label)
         options_layout.addWidget(self.delimiter_combo)
         options_layout.addWidget(self.delimiter_custom_edit)
+        excel_engine_label = QLabel("Leitor Excel: ")
+        self.excel_engine_combo = QComboBox()
+        installed_engines = available_excel_engines()
+        self.excel_engine_combo.addItems([label for label, engine in EXCEL_ENGINE_OPTIONS.items() if engine is None or engine in installed_engines])
+        self.excel_engine_combo.setToolTip("Leitor usado para .xlsx/.xls na pré-visualização, na análise de cabeçalhos e na consolidação.\nO openpyxl lê apenas .xlsx; para .xls é usado o Calamine.")
+        options_layout.addWidget(encoding_label)
+        options_layout.addWidget(self.encoding_combo)
+        options_layout.addWidget(excel_engine_label)
+        options_layout.addWidget(self.excel_engine_combo)
+        workers_label = QLabel("Leituras em paralelo: ")
+        self.max_workers_spin_box = QSpinBox()
+        self.max_workers_spin_box.setRange(1, max(DEFAULT_MAX_WORKERS, 64))
+        self.max_workers_spin_box.setValue(DEFAULT_MAX_WORKERS)
+        self.max_workers_spin_box.setToolTip("Quantos arquivos/abas são lidos ao mesmo tempo na análise de cabeçalhos e na consolidação (Excel em processos, CSV/TXT em threads).")
+        options_layout.addWidget(workers_label)
+        options_layout.addWidget(self.max_workers_spin_box)
         options_layout.addStretch() # Empurra tudo para a esquerda
         self.options_group_box.setLayout(options_layout)
         main_layout.addWidget(self.options_group_box)
@@ -2051,10 +1530,20 @@ class MainWindow(QMainWindow):
         self.save_as_button = QPushButton("Salvar Como...")
         self.save_as_button.clicked.connect(self.open_save_file_dialog)
 
+        self.engine_mode_label = QLabel("Motor:")
+        self.engine_mode_combo_box = QComboBox()
+        self.engine_mode_combo_box.addItems(list(ENGINE_MODE_OPTIONS.keys()))
+        self.engine_mode_combo_box.setToolTip("Lazy: lê todos os arquivos em um único plano otimizado (menor uso de memória).\nEager: processa e materializa arquivo a arquivo.\nStreaming: grava a saída CSV/Parquet em lotes, sem montar o resultado inteiro na memória.")
+        self.incremental_check_box = QCheckBox("Incremental")
+        self.incremental_check_box.setToolTip("Guarda cada arquivo/aba já processado em uma pasta oculta ao lado da saída e, nas próximas execuções,\nreprocessa apenas os arquivos novos ou alterados (ou todos, se o mapeamento, os tipos ou os filtros mudarem).")
+
         output_config_layout.addWidget(self.output_name_label)
         output_config_layout.addWidget(self.output_name_line_edit)
         output_config_layout.addWidget(self.output_format_label)
         output_config_layout.addWidget(self.output_format_combo_box)
+        output_config_layout.addWidget(self.engine_mode_label)
+        output_config_layout.addWidget(self.engine_mode_combo_box)
+        output_config_layout.addWidget(self.incremental_check_box)
         output_config_layout.addWidget(self.save_as_button)
         main_layout.addLayout(output_config_layout)
 
@@ -2115,7 +1604,7 @@ class MainWindow(QMainWindow):
         if dialog.exec() == QDialog.Accepted:
             self.pivot_rules = dialog.get_rules()
             if self.pivot_rules:
-                self.log_message("Regras da tabela de resumo foram definidas.", LogLevel.SUCCESS)
+                self.log_message(f"Regras de {len(_pivot_definitions(self.pivot_rules))} tabela(s) de resumo foram definidas.", LogLevel.SUCCESS)
             else:
                 self.log_message("Regras da tabela de resumo foram limpas.", LogLevel.INFO)
 
@@ -2164,6 +1653,28 @@ class MainWindow(QMainWindow):
         # Passamos 'self' para que o diálogo seja "filho" da janela principal.
         dialog = HelpDialog(self)
         dialog.exec() # .exec() abre o diálogo de forma moda
+
+    def export_job_definition(self):
+        """Salva o mapeamento, filtros, resumo, duplicatas e regras de abas atuais como job (JSON) para a linha de comando."""
+        folder_path = self.folder_path_line_edit.text()
+        if not folder_path or not self.header_mapping:
+            self.log_message("Selecione uma pasta e mapeie os cabeçalhos antes de exportar o job.", LogLevel.WARNING)
+            return
+        initial_path = os.path.join(folder_path, "job_dataflow.json")
+        job_path, _ = QFileDialog.getSaveFileName(self, "Exportar Job Como...", initial_path, "Job do DataFlow (*.json)")
+        if not job_path:
+            self.log_message("Exportação do job cancelada.", LogLevel.INFO)
+            return
+        job = build_job_definition(
+            folder_path, self.header_mapping, self.filter_rules, self.pivot_rules,
+            getattr(self, "duplicates_config", None), self.get_selected_delimiter(), self.get_selected_encoding(),
+            self.sheet_selection_rules, self.sheet_selections, self.output_format_combo_box.currentText(),
+            ENGINE_MODE_OPTIONS.get(self.engine_mode_combo_box.currentText(), "lazy"), self.incremental_check_box.isChecked())
+        try:
+            save_job(job_path, job)
+            self.log_message(f"Job exportado para: {job_path}", LogLevel.SUCCESS)
+        except Exception as e:
+            self.log_message(f"Erro ao exportar o job: {e}", LogLevel.ERROR)
     
     def _on_delimiter_changed(self, text):
         is_custom = (text == "Outro...")
@@ -2197,6 +1708,14 @@ class MainWindow(QMainWindow):
             else:
                 raise
     
+    def get_selected_encoding(self):
+        """Retorna a codificação (no formato do Polars) escolhida para arquivos CSV/TXT."""
+        return CSV_ENCODING_OPTIONS.get(self.encoding_combo.currentText(), DEFAULT_CSV_ENCODING)
+
+    def get_selected_excel_engine(self):
+        """Retorna o leitor de Excel escolhido (None para o mais rápido instalado)."""
+        return EXCEL_ENGINE_OPTIONS.get(self.excel_engine_combo.currentText())
+
     def mark_all_sheets(self):
         self._set_all_sheets_check_state(Qt.Checked)
     
@@ -2224,15 +1743,11 @@ class MainWindow(QMainWindow):
 
     def _get_config_path(self):
         """Retorna o caminho para o arquivo de configuração da aplicação."""
-        # Salvar na pasta do usuário (mais robusto) ou na pasta da aplicação
-        # Usar AppData ou .config no Linux/macOS é o ideal, mas para simplicidade:
-        try:
-            # Tenta obter o diretório do script
-            base_path = os.path.dirname(os.path.abspath(sys.argv[0]))
-        except:
-            # Fallback para o diretório de trabalho atual se sys.argv[0] não for confiável (ex: PyInstaller one-file)
-            base_path = os.getcwd() 
-        return os.path.join(base_path, CONFIG_FILE_NAME)
+        return os.path.join(_get_app_dir(), CONFIG_FILE_NAME)
+
+    def _get_header_cache_path(self):
+        """Retorna o caminho para o cache da análise de cabeçalhos."""
+        return os.path.join(_get_app_dir(), HEADER_CACHE_FILE_NAME)
 
     def _load_last_input_folder(self):
         """Carrega o último caminho da pasta de entrada do arquivo de configuração."""
@@ -2306,7 +1821,8 @@ class MainWindow(QMainWindow):
         self.pivot_button.setEnabled(False)
 
         self.filter_rules.clear()
-        self.header_analyzer_thread = HeaderAnalysisWorker(files_and_sheets_config, selected_delimiter)
+        self.header_analyzer_thread = HeaderAnalysisWorker(files_and_sheets_config, selected_delimiter, self.get_selected_encoding(), self._get_header_cache_path(),
+                                                           self.max_workers_spin_box.value(), self.get_selected_excel_engine())
         self.header_analyzer_thread.finished.connect(self.on_header_analysis_finished)
         self.header_analyzer_thread.progress_log.connect(self.log_message)
         self.header_analyzer_thread.start()
@@ -2482,16 +1998,15 @@ class MainWindow(QMainWindow):
                 if not delimiter:
                     self.log_message("Pré-visualização falhou: Delimitador inválido.", LogLevel.ERROR)
                     return
-                pre_read_df = pl.read_csv(source=file_path, has_header=False, n_rows=n_preread_rows, separator=delimiter, encoding='latin-1', ignore_errors=True, infer_schema = False, quote_char = None, truncate_ragged_lines = True)
+                with CsvSource(file_path, delimiter, self.get_selected_encoding(), n_preread_rows) as csv_source:
+                    pre_read_df = csv_source.read_head()
             elif file_path.lower().endswith((".xlsx", ".xls")) and sheet_name:
-                pre_read_df = pl.read_excel(source=file_path, sheet_name=sheet_name, has_header = False).head(n_preread_rows)
+                with open_workbook(file_path, self.get_selected_excel_engine()) as workbook:
+                    pre_read_df = workbook.read_head(sheet_name, n_preread_rows)
 
             if pre_read_df is not None and not pre_read_df.is_empty():
-                header_row_index = _find_header_row_index(pre_read_df, n_preread_rows)
-
                 # 2. Extrair cabeçalhos, dados e renomear (a lógica robusta)
-                header_names_raw = [str(h) if h is not None else f"column_{i}" for i, h in enumerate(pre_read_df.row(header_row_index))]
-                header_names = _make_headers_unique(header_names_raw)
+                header_row_index, header_names = _detect_header(pre_read_df, n_preread_rows)
                 data_rows = pre_read_df.slice(offset=header_row_index + 1).head(n_rows_to_preview)
                 
                 if not data_rows.is_empty():
@@ -2857,7 +2372,9 @@ class MainWindow(QMainWindow):
             return
         
         
-        self.consolidation_thread = ConsolidationWorker(files_to_process, self.output_file_path, output_format, self.header_mapping, self.filter_rules, selected_delimiter, self.pivot_rules, self.duplicates_config)
+        engine_mode = ENGINE_MODE_OPTIONS.get(self.engine_mode_combo_box.currentText(), "lazy")
+        incremental_dir = _incremental_store_dir(self.output_file_path) if self.incremental_check_box.isChecked() else None
+        self.consolidation_thread = ConsolidationWorker(files_to_process, self.output_file_path, output_format, self.header_mapping, self.filter_rules, selected_delimiter, self.pivot_rules, self.duplicates_config, self.get_selected_encoding(), engine_mode, self.max_workers_spin_box.value(), header_cache_path=self._get_header_cache_path(), incremental_dir=incremental_dir, excel_engine=self.get_selected_excel_engine())
         self.consolidation_thread.log_message.connect(self.log_message) 
         self.consolidation_thread.progress_updated.connect(self.update_progress_bar)
         self.consolidation_thread.finished.connect(self.on_consolidation_finished)
@@ -2898,6 +2415,8 @@ class MainWindow(QMainWindow):
         self.unmark_all_sheets_button.setEnabled(sheet_buttons_enabled)
         self.output_name_line_edit.setEnabled(not_proc)
         self.output_format_combo_box.setEnabled(not_proc)
+        self.engine_mode_combo_box.setEnabled(not_proc)
+        self.incremental_check_box.setEnabled(not_proc)
         self.save_as_button.setEnabled(not_proc)
         self.consolidate_button.setVisible(not_proc) 
         self.cancel_button.setVisible(processing)
@@ -2944,6 +2463,7 @@ class MainWindow(QMainWindow):
         event.accept()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Necessário para o pool de processos no executável empacotado
     app = QApplication(sys.argv)
     
     app.setStyle("Fusion")
@@ -0,0 +1,92 @@
+"""
+Comparação da escrita de abas XLSX no modo constant_memory: o write_* tipado por célula
+usado pelo ConsolidationJob (_write_xlsx_sheet, método de cada coluna escolhido pelo tipo
+Polars) contra um write_row por linha, que passa cada célula pelo despacho genérico de
+write(). As duas variantes preparam a aba do mesmo jeito. Nos dois casos, a maior parte do
+tempo fica na serialização do XlsxWriter, e as medidas variam bastante entre execuções:
+compare várias rodadas. Não é coletado pelo pytest; uso, a partir da raiz do repositório:
+
+    python tests/bench_xlsx_writer.py [linhas]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import polars as pl
+import xlsxwriter
+
+from dataflow.engine import XLSX_WRITE_BATCH_ROWS, _prepare_for_xlsx
+
+# As opções do ConsolidationJob, sem conversão de textos em fórmula/URL: write_row grava o texto como está
+WORKBOOK_OPTIONS = {'use_zip64': True, 'constant_memory': True, 'nan_inf_to_errors': True,
+                    'strings_to_formulas': False, 'strings_to_urls': False}
+
+
+def _sample(n_rows: int) -> pl.DataFrame:
+    return pl.DataFrame({
+        "inteiro": pl.int_range(n_rows, eager=True),
+        "decimal": pl.int_range(n_rows, eager=True) / 7,
+        "texto": [f"cliente {i % 1000}" for i in range(n_rows)],
+        "esparsa": [None if i % 3 else "x" for i in range(n_rows)],
+        "logico": [i % 2 == 0 for i in range(n_rows)],
+    })
+
+
+def _new_sheet(workbook, df):
+    """Aba preparada como no _write_xlsx_sheet (cabeçalho e formato das colunas): só a gravação dos dados muda."""
+    worksheet = workbook.add_worksheet("Dados")
+    data_format = workbook.add_format({'font_name': 'Aptos'})
+    for col_idx, col_name in enumerate(df.columns):
+        worksheet.write_string(0, col_idx, col_name)
+        worksheet.set_column(col_idx, col_idx, 12, data_format)
+    return worksheet
+
+
+def _write_rows(workbook, df):
+    """Alternativa: um write_row por linha."""
+    worksheet = _new_sheet(workbook, df)
+    row_idx = 1
+    for batch in _prepare_for_xlsx(df).iter_slices(XLSX_WRITE_BATCH_ROWS):
+        for row_values in zip(*[series.to_list() for series in batch.iter_columns()]):
+            worksheet.write_row(row_idx, 0, row_values)
+            row_idx += 1
+
+
+def _write_typed_cells(workbook, df):
+    """Como o _write_xlsx_sheet: um write_* por célula, com o método de cada coluna escolhido pelo tipo Polars."""
+    worksheet = _new_sheet(workbook, df)
+    df = _prepare_for_xlsx(df)
+    column_writers = [worksheet.write_boolean if dtype == pl.Boolean else worksheet.write_number if dtype.is_numeric() else worksheet.write_string
+                      for dtype in df.dtypes]
+    row_idx = 1
+    for batch in df.iter_slices(XLSX_WRITE_BATCH_ROWS):
+        for row_values in zip(*[series.to_list() for series in batch.iter_columns()]):
+            for col_idx, (write_cell, value) in enumerate(zip(column_writers, row_values)):
+                if value is not None:
+                    write_cell(row_idx, col_idx, value)
+            row_idx += 1
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    df = _sample(n_rows)
+    variants = (("célula tipada", _write_typed_cells), ("write_row", _write_rows))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Aquecimento: a primeira gravação do processo paga custos que não são da variante medida
+        for _, write in variants:
+            workbook = xlsxwriter.Workbook(os.path.join(temp_dir, "aquecimento.xlsx"), WORKBOOK_OPTIONS)
+            write(workbook, df.head(20_000))
+            workbook.close()
+        for name, write in variants:
+            workbook = xlsxwriter.Workbook(os.path.join(temp_dir, f"{name}.xlsx"), WORKBOOK_OPTIONS)
+            start = time.perf_counter()
+            write(workbook, df)
+            workbook.close()
+            print(f"{name}: {time.perf_counter() - start:.2f}s ({n_rows:,} linhas x {df.width} colunas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# O pacote dataflow é importado a partir da pasta app (como em main.py e "python -m dataflow")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
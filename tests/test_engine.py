@@ -0,0 +1,261 @@
+import os
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from dataflow import engine
+from dataflow.engine import ConsolidationJob, DuplicateKeyIndex, FilterCompiler, LogLevel, _build_pivot_plans, _detect_headers, _first_occurrence_mask, _profile_columns, _transform_batches
+
+
+def test_profile_accepts_mixed_date_and_datetime_values():
+    """Datas com e sem hora na mesma coluna (em qualquer ordem) continuam sendo de data."""
+    sample_df = pl.DataFrame({
+        "data_primeiro": ["05/01/2023", "06/01/2023 10:30:00", None],
+        "hora_primeiro": ["06/01/2023 10:30:00", "05/01/2023", "07/01/2023"],
+        "texto": ["05/01/2023", "pendente", "07/01/2023"],
+    })
+    profiles = _profile_columns(sample_df)
+
+    assert [profile["dtype"] for profile in profiles] == [pl.Datetime, pl.Datetime, pl.String]
+    assert profiles[0]["date_format"] == "%d/%m/%Y"
+    assert profiles[1]["date_format"] == "%d/%m/%Y %H:%M:%S%.f"
+    assert profiles[2]["date_format"] is None
+
+
+
+def test_profile_rejects_dates_from_different_families():
+    """Datas ISO e dia/mês/ano na mesma coluna continuam texto, em qualquer ordem."""
+    sample_df = pl.DataFrame({"iso_primeiro": ["2024-01-05", "31/12/2023"], "dia_primeiro": ["05/01/2024", "2024-01-05"],
+                              "iso_com_hora": ["2024-01-05", "31-12-2023 10:00"]})
+
+    assert [profile["dtype"] for profile in _profile_columns(sample_df)] == [pl.String, pl.String, pl.String]
+
+
+def test_profile_accepts_datetimes_with_utc_offset():
+    sample_df = pl.DataFrame({"com_fuso": ["2024-01-05 10:00:00+02:00", "2024-01-06 11:30:00-03:00", "2024-01-07"]})
+    profiles = _profile_columns(sample_df)
+
+    assert profiles[0]["dtype"] == pl.Datetime
+    assert profiles[0]["date_format"] == "%Y-%m-%d %H:%M:%S%.f%#z"
+
+def test_profile_classifies_numbers_before_dates():
+    sample_df = pl.DataFrame({"inteiro": ["1", "20", " "], "decimal": ["1.5", "2", None], "vazia": [None, None, None]},
+                             schema={"inteiro": pl.String, "decimal": pl.String, "vazia": pl.String})
+    profiles = _profile_columns(sample_df)
+
+    assert [profile["dtype"] for profile in profiles] == [pl.Int64, pl.Float64, pl.String]
+    assert profiles[0]["null_ratio"] == 0.0
+    assert profiles[2]["null_ratio"] == 1.0
+    assert (profiles[0]["min_length"], profiles[0]["max_length"]) == (1, 2)
+
+
+def _text_frame(rows):
+    """Pré-leitura como a de um CSV: colunas column_N, todas texto, linhas curtas completadas com nulos."""
+    width = max(len(row) for row in rows)
+    return pl.DataFrame([list(row) + [None] * (width - len(row)) for row in rows], orient="row",
+                        schema={f"column_{i + 1}": pl.String for i in range(width)})
+
+
+def test_detect_headers_on_fixed_corpus():
+    """Índices esperados iguais aos da detecção linha a linha original, para todas as pré-leituras de uma vez."""
+    corpus = [
+        (_text_frame([[None, None, None], [None, None, None], ["id", "nome", "valor"], ["1", "ana", "10,5"], ["2", "bia", "7"]]),
+         (2, ["id", "nome", "valor"])),
+        (_text_frame([["Relatório de vendas"], ["Emitido em 01/02/2024"], ["codigo", "cliente", "total"], ["10", "x", "1"], ["11", "y", "2"]]),
+         (2, ["codigo", "cliente", "total"])),
+        (_text_frame([["2023", "2024", "2025"], ["regiao", "meta", "real"], ["sul", "10", "12"], ["norte", "8", "9"]]),
+         (1, ["regiao", "meta", "real"])),
+        (_text_frame([["a", "b", "c"], ["a", "b", "c"], ["1", "2", "3"]]), (0, ["a", "b", "c"])), # Empate: vale a primeira
+        (_text_frame([["1", "2"], ["3", "4"], ["5", "6"]]), (0, ["1", "2"])),
+        (_text_frame([[" ", "  ", ""], ["cpf", "nome", "uf"], ["123", "ana", "SP"], ["456", "bia", "RJ"]]), (1, ["cpf", "nome", "uf"])),
+        (_text_frame([["id", "nome"]]), (0, ["id", "nome"])),
+        # Pré-leitura de Excel, com colunas numéricas tipadas
+        (pl.DataFrame({"a": ["Relatório", "id", "x", "y"], "b": [None, None, 1, 2], "c": [None, "valor", None, "3.5"]}),
+         (1, ["id", "column_1", "valor"])),
+        (None, (0, [])),
+        (pl.DataFrame(), (0, [])),
+    ]
+
+    assert _detect_headers([pre_read_df for pre_read_df, _ in corpus]) == [expected for _, expected in corpus]
+
+def _run_job(tmp_path, files, output_format="CSV", **job_options):
+    """Executa um ConsolidationJob e devolve (sucesso, logs [(LogLevel, mensagem)])."""
+    logs, finished = [], []
+    job_options.setdefault("delimiter", ";")
+    job = ConsolidationJob([(str(file_path), None) for file_path in files], str(tmp_path / f"saida.{output_format.lower()}"),
+                           output_format, job_options.pop("header_mapping", {}), job_options.pop("filter_rules", []),
+                           job_options.pop("delimiter"), job_options.pop("pivot_rules", {}),
+                           on_log=lambda message, level: logs.append((level, message)),
+                           on_finished=lambda success, message: finished.append(success), **job_options)
+    job.run()
+    return finished == [True], logs
+
+
+def test_transform_batches_spills_each_batch_to_parquet(tmp_path):
+    raw_batches = (pl.DataFrame({"column_1": [str(i), str(i + 1)]}) for i in range(0, 6, 2))
+    plan = _transform_batches(raw_batches, ["id"], "fonte.csv", None, {}, {}, None, lambda *args: None, str(tmp_path))
+
+    assert sorted(os.listdir(tmp_path)) == ["lote_00000.parquet", "lote_00001.parquet", "lote_00002.parquet"]
+    assert plan.collect()["id"].to_list() == ["0", "1", "2", "3", "4", "5"]
+
+
+def test_lazy_run_skips_only_the_unreadable_source(tmp_path):
+    """Um CSV com bytes inválidos no meio do arquivo é pulado; as demais fontes são gravadas."""
+    rows = "".join(f"{i};{i * 2}\n" for i in range(500))
+    (tmp_path / "ok.csv").write_text("id;valor\n" + rows)
+    (tmp_path / "ruim.csv").write_bytes(("id;valor\n" + rows).encode() + b"9;\xff\xfe\n")
+
+    success, logs = _run_job(tmp_path, [tmp_path / "ok.csv", tmp_path / "ruim.csv"], encoding="utf8")
+
+    assert success
+    assert any(level == LogLevel.ERROR and "ruim.csv" in message for level, message in logs)
+    consolidated = pl.read_csv(tmp_path / "saida.csv", separator="|", infer_schema=False)
+    assert consolidated.height == 500
+    assert consolidated["Origem"].unique().to_list() == ["ok.csv"]
+
+
+def test_streaming_run_reads_non_utf8_csv_batch_by_batch(tmp_path, monkeypatch):
+    """Em latin-1, cada lote lido vai para o disco antes do próximo; a saída é a mesma de uma leitura única."""
+    monkeypatch.setattr(engine, "CSV_READ_BATCH_BYTES", 256)
+    batch_heights = []
+    iter_data = engine.CsvSource.iter_data
+    def counting_iter_data(self, *args, **kwargs):
+        for raw_batch in iter_data(self, *args, **kwargs):
+            batch_heights.append(raw_batch.height)
+            yield raw_batch
+    monkeypatch.setattr(engine.CsvSource, "iter_data", counting_iter_data)
+    rows = [f"{i};ação {i}" for i in range(200)]
+    (tmp_path / "latin.csv").write_bytes(("id;descrição\n" + "\n".join(rows) + "\n").encode("latin-1"))
+
+    success, _ = _run_job(tmp_path, [tmp_path / "latin.csv"], output_format="Parquet", engine_mode="streaming")
+
+    assert success
+    assert len(batch_heights) > 1 and sum(batch_heights) == 200
+    consolidated = pl.read_parquet(tmp_path / "saida.parquet")
+    assert consolidated["descrição"].to_list() == [f"ação {i}" for i in range(200)]
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".dataflow_")]
+
+
+def test_dedup_spill_matches_in_memory_mask_even_with_hash_collisions(tmp_path, monkeypatch):
+    """Partições no disco dão a mesma máscara da passada em memória; colisões de hash não removem chaves diferentes."""
+    keys = pl.DataFrame({"a": [i % 7 for i in range(100)], "b": [None if i % 5 == 0 else str(i % 3) for i in range(100)]})
+    expected = keys.select(pl.struct("a", "b").is_first_distinct()).to_series()
+
+    (tmp_path / "hash").mkdir()
+    (tmp_path / "colisao").mkdir()
+    spilled = _first_occurrence_mask(keys.lazy(), ["a", "b"], str(tmp_path / "hash"), budget_rows=30)
+    assert spilled.to_list() == expected.to_list()
+    assert len([name for name in os.listdir(tmp_path / "hash") if name.startswith("particao_")]) > 1
+
+    monkeypatch.setattr(engine, "_dedup_key_hash", lambda key_columns: pl.lit(0, dtype=pl.UInt64)) # Todas as chaves colidem
+    colliding = _first_occurrence_mask(keys.lazy(), ["a", "b"], str(tmp_path / "colisao"), budget_rows=30)
+    assert colliding.to_list() == expected.to_list()
+
+
+def test_key_index_skips_rows_emitted_by_previous_runs(tmp_path):
+    (tmp_path / "dados.csv").write_text("id;valor\n1;10\n2;20\n2;21\n3;30\n")
+    duplicates_config = {"key_columns": ["id"], "use_key_index": True, "key_index_path": str(tmp_path / "indice")}
+    pivot_only = {"only_pivot": True, "pivots": [{"name": "Resumo", "group_by": ["id"], "aggregations": [{"column": "valor", "operation": "Contagem"}]}]}
+
+    # Só o resumo é gravado: as chaves não entram no índice
+    assert _run_job(tmp_path, [tmp_path / "dados.csv"], duplicates_config=duplicates_config, pivot_rules=pivot_only)[0]
+    assert DuplicateKeyIndex(str(tmp_path / "indice"), ["id"]).key_count() == 0
+
+    assert _run_job(tmp_path, [tmp_path / "dados.csv"], duplicates_config=duplicates_config)[0]
+    assert pl.read_csv(tmp_path / "saida.csv", separator="|")["id"].to_list() == [1, 2, 3]
+    assert DuplicateKeyIndex(str(tmp_path / "indice"), ["id"]).key_count() == 3
+
+    assert _run_job(tmp_path, [tmp_path / "dados.csv"], duplicates_config=duplicates_config)[0]
+    assert pl.read_csv(tmp_path / "saida.csv", separator="|").height == 0
+    assert DuplicateKeyIndex(str(tmp_path / "indice"), ["id"]).key_count() == 3
+
+
+def test_filter_compiler_compiles_once_per_schema(monkeypatch):
+    filter_compiler = FilterCompiler([
+        {"column": "uf", "operator": "Igual a", "value": " SP "}, {"column": "uf", "operator": "Igual a", "value": "RJ"},
+        {"column": "nome", "operator": "Não contém", "value": "teste"}, {"column": "ausente", "operator": "Igual a", "value": "x"},
+    ])
+    compiled_columns = []
+    compile_column = filter_compiler._compile_column
+    monkeypatch.setattr(filter_compiler, "_compile_column", lambda col_name, *args: compiled_columns.append(col_name) or compile_column(col_name, *args))
+    log = lambda *args: None
+    text_schema = pl.Schema({"uf": pl.String, "nome": pl.String, "valor": pl.Int64})
+
+    first = filter_compiler.expressions_for(text_schema, "'a.csv'", log)
+    assert filter_compiler.expressions_for(pl.Schema({"nome": pl.String, "uf": pl.String}), "'b.csv'", log) is first
+    assert compiled_columns == ["uf", "nome"]
+
+    # Outro tipo em uma coluna filtrada: novas expressões
+    filter_compiler.expressions_for(pl.Schema({"uf": pl.Int64, "nome": pl.String}), "'c.csv'", log)
+    assert compiled_columns == ["uf", "nome", "uf", "nome"]
+
+    rows = pl.DataFrame({"uf": ["SP", "RJ", "MG", "SP"], "nome": ["ana", "bia", "caio", "teste 1"], "valor": [1, 2, 3, 4]})
+    assert rows.filter(first)["valor"].to_list() == [1, 2]
+
+
+def test_pivot_partials_merged_across_sources_match_single_pass():
+    """Média por soma + contagem e contagem única por conjunto de valores, combinadas entre fontes."""
+    sources = [
+        pl.DataFrame({"uf": ["SP", "SP", "RJ"], "valor": [1.0, 2.0, None], "cliente": ["a", "b", "a"]}),
+        pl.DataFrame({"uf": ["SP", "MG"], "valor": [4.0, 5.0], "cliente": ["a", None]}),
+        pl.DataFrame({"uf": ["RJ", "RJ", "SP"], "valor": [7.5, 1.5, 10.0], "cliente": ["c", "c", "d"]}),
+    ]
+    operations = {"Soma": pl.Expr.sum, "Média": pl.Expr.mean, "Contagem": pl.Expr.count,
+                  "Mínimo": pl.Expr.min, "Máximo": pl.Expr.max, "Contagem Única": pl.Expr.n_unique}
+    rules = [("valor", operation, f"valor_{operation.replace(' ', '_')}") for operation in operations if operation != "Contagem Única"]
+    rules.append(("cliente", "Contagem Única", "cliente_Contagem_Única"))
+
+    merged = _build_pivot_plans([source.lazy() for source in sources], [(["uf"], rules)])[0].collect()
+    single_pass = (pl.concat(sources).group_by("uf")
+                   .agg([operations[operation](pl.col(col_name)).alias(result_name) for col_name, operation, result_name in rules])
+                   .sort("uf"))
+
+    assert_frame_equal(merged, single_pass, check_dtypes=False)
+
+
+def test_multiple_pivots_are_written_as_separate_outputs(tmp_path):
+    (tmp_path / "dados.csv").write_text("uf;cliente;valor\nSP;a;1\nSP;b;2\nRJ;a;3\n")
+    pivot_rules = {"only_pivot": True, "pivots": [
+        {"name": "Por UF", "group_by": ["uf"], "aggregations": [{"column": "valor", "operation": "Contagem"}]},
+        {"name": "Por Cliente", "group_by": ["cliente"], "aggregations": [{"column": "uf", "operation": "Contagem Única"}]},
+        {"name": "Vazia", "group_by": [], "aggregations": [{"column": "valor", "operation": "Soma"}]}, # Ignorada
+    ]}
+
+    assert _run_job(tmp_path, [tmp_path / "dados.csv"], pivot_rules=pivot_rules)[0]
+    assert sorted(os.listdir(tmp_path)) == ["dados.csv", "saida.csv", "saida_Por Cliente.csv"]
+    by_state = pl.read_csv(tmp_path / "saida.csv", separator="|")
+    assert by_state.rows() == [("RJ", 1), ("SP", 2)]
+    assert pl.read_csv(tmp_path / "saida_Por Cliente.csv", separator="|").rows() == [("a", 2), ("b", 1)]
+
+    openpyxl = pytest.importorskip("openpyxl")
+    assert _run_job(tmp_path, [tmp_path / "dados.csv"], output_format="XLSX", pivot_rules=dict(pivot_rules, only_pivot=False))[0]
+    workbook = openpyxl.load_workbook(tmp_path / "saida.xlsx", read_only=True)
+    assert workbook.sheetnames == ["Por UF", "Por Cliente", "Dados_Consolidados"]
+    workbook.close()
+
+
+def test_incremental_run_reuses_unchanged_fragments(tmp_path):
+    data_dir, incremental_dir = tmp_path / "dados", tmp_path / "incremental"
+    data_dir.mkdir()
+    (data_dir / "a.csv").write_text("id;valor\n1;10\n")
+    (data_dir / "b.csv").write_text("id;valor\n2;20\n")
+    def run(files, **job_options):
+        success, logs = _run_job(tmp_path, files, incremental_dir=str(incremental_dir), **job_options)
+        assert success
+        return next(message for _, message in logs if message.startswith("Modo incremental")), sorted(pl.read_csv(tmp_path / "saida.csv", separator="|")["id"].to_list())
+
+    files = [data_dir / "a.csv", data_dir / "b.csv"]
+    assert run(files) == ("Modo incremental: 0 fonte(s) reaproveitada(s), 2 a processar.", [1, 2])
+    assert run(files) == ("Modo incremental: 2 fonte(s) reaproveitada(s), 0 a processar.", [1, 2])
+
+    (data_dir / "b.csv").write_text("id;valor\n2;20\n3;30\n")
+    assert run(files) == ("Modo incremental: 1 fonte(s) reaproveitada(s), 1 a processar.", [1, 2, 3])
+
+    # Outra configuração (filtro) invalida todos os fragmentos
+    filter_rules = [{"column": "id", "operator": "Diferente de", "value": "3"}]
+    assert run(files, filter_rules=filter_rules) == ("Modo incremental: 0 fonte(s) reaproveitada(s), 2 a processar.", [1, 2])
+
+    # Fonte removida: o fragmento é descartado junto com a entrada do manifesto
+    assert run(files[:1], filter_rules=filter_rules) == ("Modo incremental: 1 fonte(s) reaproveitada(s), 0 a processar.", [1])
+    assert len([name for name in os.listdir(incremental_dir) if name.endswith(".parquet")]) == 1
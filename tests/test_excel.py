@@ -0,0 +1,85 @@
+import importlib.util
+from types import SimpleNamespace
+
+import polars as pl
+import pytest
+
+from dataflow import excel
+
+
+def test_xls_sheet_names_without_xlrd_use_calamine(tmp_path, monkeypatch):
+    """Sem xlrd, a lista de abas de um .xls vem do calamine, sem voltar a read_sheet_names."""
+    pytest.importorskip("fastexcel")
+    import fastexcel
+
+    xls_path = tmp_path / "antigo.xls"
+    xls_path.write_bytes(b"\xd0\xcf\x11\xe0") # O conteúdo não é lido: o leitor do calamine é substituído abaixo
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name, *args: None if name == "xlrd" else find_spec(name, *args))
+    opened_paths = []
+    monkeypatch.setattr(fastexcel, "read_excel", lambda path: opened_paths.append(path) or SimpleNamespace(sheet_names=["Jan", "Fev"]))
+
+    assert excel.read_sheet_names(str(xls_path)) == ["Jan", "Fev"]
+    assert opened_paths == [str(xls_path)]
+    assert list(excel.iter_sheet_names([str(xls_path)])) == [(str(xls_path), ["Jan", "Fev"], None)]
+
+
+@pytest.fixture
+def late_column_xlsx(tmp_path):
+    """Aba com cabeçalho em B1:C1 e colunas (A e E) que só têm valores depois das primeiras linhas."""
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Dados"
+    sheet.append([None, "id", "nome"])
+    for i in range(1, 40):
+        sheet.append([None, i, f"n{i}"])
+    sheet.cell(row=30, column=1, value="esquerda")
+    for row in range(25, 41):
+        sheet.cell(row=row, column=5, value=f"tarde{row}")
+    file_path = tmp_path / "tardia.xlsx"
+    workbook.save(file_path)
+    return str(file_path)
+
+
+@pytest.mark.parametrize("engine", excel.EXCEL_ENGINES)
+def test_columns_empty_in_head_rows_are_kept(late_column_xlsx, engine):
+    """As colunas vazias nas linhas da pré-leitura continuam na faixa da aba e nos dados."""
+    if engine not in excel.available_excel_engines(late_column_xlsx):
+        pytest.skip(f"Motor {engine} não instalado")
+    with excel.open_workbook(late_column_xlsx, engine) as workbook:
+        head = workbook.read_head("Dados", excel.HEAD_ROWS)
+        assert head.width == 5
+        assert head.row(0) == (None, "id", "nome", None, None)
+        assert head.get_column("column_1").null_count() == head.height
+        assert head.get_column("column_5").null_count() == head.height
+
+        data = workbook.read_sheet("Dados").cast(pl.String)
+        assert data.width == 5
+        assert data.get_column("column_1").drop_nulls().to_list() == ["esquerda"]
+        assert data.get_column("column_5").drop_nulls().to_list() == [f"tarde{row}" for row in range(25, 41)]
+
+
+@pytest.fixture
+def undimensioned_xlsx(tmp_path):
+    """Aba sem <dimension> (openpyxl write_only) com uma coluna C que só aparece na linha 40."""
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Dados")
+    sheet.append(["id", "nome"])
+    for i in range(1, 60):
+        sheet.append([i, f"n{i}", "tarde" if i == 39 else None])
+    file_path = tmp_path / "sem_dimensao.xlsx"
+    workbook.save(file_path)
+    return str(file_path)
+
+
+def test_used_columns_scan_is_bounded(undimensioned_xlsx, monkeypatch):
+    """Sem <dimension>, a faixa de colunas vem só da pré-leitura e da amostra seguinte do XML, não da aba inteira."""
+    monkeypatch.setattr(excel, "USED_COLUMNS_SAMPLE_ROWS", 10)
+    with excel.open_workbook(undimensioned_xlsx, "openpyxl") as workbook:
+        assert workbook.read_head("Dados", excel.HEAD_ROWS).width == 2
+    monkeypatch.setattr(excel, "USED_COLUMNS_SAMPLE_ROWS", 30)
+    with excel.open_workbook(undimensioned_xlsx, "openpyxl") as workbook:
+        assert workbook.read_head("Dados", excel.HEAD_ROWS).width == 3
+        assert workbook.read_sheet("Dados").get_column("column_3").drop_nulls().to_list() == ["tarde"]